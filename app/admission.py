@@ -0,0 +1,315 @@
+"""Admission control for expensive routes.
+
+Routes are assigned to classes (auth, checkout, catalog, bulk). Every class
+has a concurrency limit, a bounded queue of requests waiting for a slot and
+a deadline for that wait. A request that finds the queue full, or is still
+waiting at the deadline, is answered 503 with Retry-After at once instead of
+piling up until the client times out and retries. The limit adapts to the
+latency the class actually sees (AIMD): after each window of completions it
+shrinks by a quarter if more than a tenth of them missed the class's target,
+and grows by one if the limit was reached and latency stayed on target.
+
+Each class also has token buckets that refill at `rate` per second up to
+`burst`: one per client address and, for requests naming a user (user_id in
+the path or the query), one per user. An empty bucket means 429 with
+Retry-After. Routes without a class (pages, /static, health) are not
+touched. Limits are per worker process.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs
+
+from starlette.routing import Match
+
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+# Сколько запрос может ждать свободного слота, прежде чем получит 503
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "1000"))
+# "auth=8,checkout=8": начальные лимиты параллельности, поверх значений по умолчанию
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+# Доля ответов медленнее цели, после которой лимит уменьшается
+ADMISSION_SLOW_SHARE = 0.1
+ADMISSION_DECREASE = 0.75
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBuckets:
+    """Token bucket per key; the least recently used keys are forgotten beyond max_keys.
+
+    A forgotten bucket would have been full again anyway unless the key came
+    back within burst / rate seconds.
+    """
+
+    def __init__(self, rate, burst, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, time.monotonic() последнего пополнения]
+
+    def take(self, key, now=None):
+        """0 if the key may proceed (one token taken), otherwise seconds until it may."""
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        return (1 - bucket[0]) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class AdmissionClass:
+    """Adaptive concurrency limit with a bounded, deadline-limited wait queue.
+
+    Used from the event loop only, so it needs no lock.
+    """
+
+    def __init__(self, name, limit, max_limit, target_ms, queue, rate, burst, min_limit=1,
+                 queue_timeout_ms=ADMISSION_QUEUE_TIMEOUT_MS):
+        self.name = name
+        self.limit = limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target = target_ms / 1000
+        self.max_queue = queue
+        self.queue_timeout = queue_timeout_ms / 1000
+        self.buckets = TokenBuckets(rate, burst)
+        self.in_flight = 0
+        self._waiters = deque()
+        # Окно для подстройки лимита
+        self._window = 0
+        self._window_slow = 0
+        self._window_saturated = False
+        self.latency_ewma = self.target / 2
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.rate_limited = 0
+        self.increases = 0
+        self.decreases = 0
+
+    def _try_admit(self):
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self._window_saturated |= self.in_flight >= self.limit
+            return True
+        return False
+
+    async def acquire(self):
+        """True once a slot is held (release() it), False if the request should be shed."""
+        if self._try_admit():
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.rejected_full += 1
+            return False
+        self._window_saturated = True
+        self.queued += 1
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        deadline = loop.call_later(self.queue_timeout, self._expire, waiter)
+        try:
+            admitted = await waiter
+        except asyncio.CancelledError:
+            # Клиент ушёл: слот, если он уже был передан, возвращается
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release(None)
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            deadline.cancel()
+        if admitted:
+            self.admitted += 1
+        else:
+            self.rejected_timeout += 1
+        return admitted
+
+    def _expire(self, waiter):
+        if not waiter.done():
+            self._waiters.remove(waiter)
+            waiter.set_result(False)
+
+    def release(self, seconds):
+        """Free a slot; seconds is how long the request held it (None if it never ran)."""
+        self.in_flight -= 1
+        if seconds is not None:
+            self._observe(seconds)
+        # Слот передаётся следующему в очереди, не освобождается
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(True)
+
+    def _observe(self, seconds):
+        self.latency_ewma += 0.1 * (seconds - self.latency_ewma)
+        self._window += 1
+        self._window_slow += seconds > self.target
+        if self._window < max(10, self.limit):
+            return
+        if self._window_slow > self._window * ADMISSION_SLOW_SHARE:
+            limit = max(self.min_limit, int(self.limit * ADMISSION_DECREASE))
+            if limit < self.limit:
+                self.decreases += 1
+                logger.info("Admission %s: limit %d -> %d (%d of %d over %.0f ms)", self.name, self.limit, limit,
+                            self._window_slow, self._window, self.target * 1000)
+                self.limit = limit
+        elif self._window_saturated and self.limit < self.max_limit:
+            self.limit += 1
+            self.increases += 1
+        self._window = self._window_slow = 0
+        self._window_saturated = self.in_flight >= self.limit
+
+    def retry_after(self):
+        """Whole seconds after which the queue ahead should have drained."""
+        return max(1, math.ceil(self.latency_ewma * (len(self._waiters) + 1) / max(1, self.limit)))
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "target_ms": self.target * 1000,
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "max_queue": self.max_queue,
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 2),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "rate_limited": self.rate_limited,
+            "rate": self.buckets.rate,
+            "burst": self.buckets.burst,
+            "rate_limit_keys": len(self.buckets),
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
+
+
+def _parse_limits(value):
+    limits = {}
+    for part in filter(None, (part.strip() for part in value.split(","))):
+        name, _, limit = part.partition("=")
+        limits[name.strip()] = int(limit)
+    return limits
+
+
+def default_classes(overrides=ADMISSION_LIMITS):
+    limits = _parse_limits(overrides)
+    specs = (
+        # bcrypt: пара сотен миллисекунд CPU на запрос; rate — защита от перебора паролей
+        dict(name="auth", limit=8, max_limit=32, target_ms=1000, queue=32, rate=1, burst=10),
+        # Берут строки под блокировкой и соединение из пула (20 по умолчанию)
+        dict(name="checkout", limit=8, max_limit=16, target_ms=500, queue=32, rate=2, burst=10),
+        # Полные выборки каталога и поиск
+        dict(name="catalog", limit=16, max_limit=64, target_ms=300, queue=64, rate=20, burst=40),
+        # Импорт и экспорт всего каталога: без очереди
+        dict(name="bulk", limit=2, max_limit=2, target_ms=60000, queue=0, rate=0.1, burst=2),
+    )
+    classes = {}
+    for spec in specs:
+        if spec["name"] in limits:
+            spec["limit"] = limits[spec["name"]]
+            spec["max_limit"] = max(spec["max_limit"], spec["limit"])
+        classes[spec["name"]] = AdmissionClass(**spec)
+    return classes
+
+
+class AdmissionController:
+    """Maps (method, route template) pairs to classes; see AdmissionMiddleware."""
+
+    def __init__(self, classes=None, enabled=ADMISSION_ENABLED):
+        self.classes = default_classes() if classes is None else classes
+        self.enabled = enabled
+        self.routes = {}  # (method, path template) -> AdmissionClass
+
+    def assign(self, class_name, *routes):
+        for method, path in routes:
+            self.routes[(method, path)] = self.classes[class_name]
+
+    def stats(self):
+        return {"enabled": self.enabled, "routes": {"%s %s" % key: admission_class.name
+                                                    for key, admission_class in sorted(self.routes.items())},
+                "classes": {name: admission_class.stats() for name, admission_class in self.classes.items()}}
+
+
+admission = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying ``admission`` before the request reaches the router.
+
+    It matches the request against the app's routes the way the router will
+    (first full match wins) to find the route template; rejected requests
+    get scope["route"] set too, so MetricsMiddleware counts them per route.
+    """
+
+    def __init__(self, app, routes, controller=admission):
+        self.app = app
+        self.routes = routes
+        self.controller = controller
+
+    def _match(self, scope):
+        for route in self.routes:
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                return route, child_scope
+        return None, None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.controller.enabled or not self.controller.routes:
+            await self.app(scope, receive, send)
+            return
+        route, child_scope = self._match(scope)
+        admission_class = None if route is None else self.controller.routes.get((scope["method"], route.path))
+        if admission_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        wait = admission_class.buckets.take(("ip", scope["client"][0] if scope.get("client") else None))
+        user_id = child_scope["path_params"].get("user_id") or \
+            parse_qs(scope.get("query_string", b"").decode("latin-1")).get("user_id", [None])[0]
+        if not wait and user_id is not None:
+            wait = admission_class.buckets.take(("user", str(user_id)))
+        if wait:
+            admission_class.rate_limited += 1
+            await self._reject(scope, send, route, 429, "Too many requests, slow down", math.ceil(wait))
+            return
+        if not await admission_class.acquire():
+            await self._reject(scope, send, route, 503, "Server is busy, try again later",
+                               admission_class.retry_after())
+            return
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission_class.release(time.perf_counter() - started)
+
+    async def _reject(self, scope, send, route, status, detail, retry_after):
+        scope["route"] = route
+        body = ('{"detail": "%s"}' % detail).encode()
+        await send({"type": "http.response.start", "status": status, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cache import catalog_cache
+
+
+AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_TOKEN_CACHE_MAX_ENTRIES", "50000"))
+AUTH_USER_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_USER_CACHE_MAX_ENTRIES", "10000"))
+# Страховка на случай потерянного уведомления об изменении пользователя
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "300"))
+
+USER_NAMESPACE_PREFIX = "user."
+
+
+class AuthCache:
+    """Decoded JWT claims (kept until the token's exp) and an LRU of user rows.
+
+    User changes are propagated to other workers through the catalog cache
+    NOTIFY channel under the "user.<id>" namespace.
+    """
+
+    def __init__(self, token_max_entries=AUTH_TOKEN_CACHE_MAX_ENTRIES, user_max_entries=AUTH_USER_CACHE_MAX_ENTRIES,
+                 user_ttl=AUTH_USER_CACHE_TTL):
+        self.token_max_entries = token_max_entries
+        self.user_max_entries = user_max_entries
+        self.user_ttl = user_ttl
+        self._lock = threading.Lock()
+        self._tokens = OrderedDict()  # token -> (claims, exp)
+        self._users = OrderedDict()  # id -> (row, expires_at)
+        self._ids_by_email = {}
+        self.token_hits = 0
+        self.token_misses = 0
+        self.user_hits = 0
+        self.user_misses = 0
+
+    def get_claims(self, token):
+        with self._lock:
+            item = self._tokens.get(token)
+            if item is not None:
+                claims, exp = item
+                if exp > time.time():
+                    self._tokens.move_to_end(token)
+                    self.token_hits += 1
+                    return claims
+                del self._tokens[token]
+            self.token_misses += 1
+            return None
+
+    def put_claims(self, token, claims):
+        exp = claims.get("exp")
+        if exp is None:
+            return
+        with self._lock:
+            self._tokens[token] = (claims, float(exp))
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.token_max_entries:
+                self._tokens.popitem(last=False)
+
+    def get_user(self, user_id=None, email=None):
+        with self._lock:
+            if user_id is None:
+                user_id = self._ids_by_email.get(email)
+            item = self._users.get(user_id)
+            if item is not None and item[1] > time.monotonic():
+                self._users.move_to_end(user_id)
+                self.user_hits += 1
+                return item[0]
+            self.user_misses += 1
+            return None
+
+    def put_user(self, row):
+        with self._lock:
+            self._users[row["id"]] = (row, time.monotonic() + self.user_ttl)
+            self._users.move_to_end(row["id"])
+            self._ids_by_email[row["email"]] = row["id"]
+            while len(self._users) > self.user_max_entries:
+                _, (old, _) = self._users.popitem(last=False)
+                if self._ids_by_email.get(old["email"]) == old["id"]:
+                    del self._ids_by_email[old["email"]]
+
+    def notify(self, cursor, user_id):
+        """Queue invalidation of a user in other workers; delivered when the transaction commits."""
+        catalog_cache.notify(cursor, f"{USER_NAMESPACE_PREFIX}{user_id}")
+
+    def invalidate_user(self, user_id):
+        """Forget a user's cached row after a role or password change has committed."""
+        self._drop_user(user_id)
+
+    def _drop_user(self, user_id):
+        with self._lock:
+            item = self._users.pop(user_id, None)
+            if item is not None and self._ids_by_email.get(item[0]["email"]) == user_id:
+                del self._ids_by_email[item[0]["email"]]
+
+    def handle_remote_invalidate(self, namespace):
+        if namespace is None:
+            with self._lock:
+                self._users.clear()
+                self._ids_by_email.clear()
+        elif namespace.startswith(USER_NAMESPACE_PREFIX):
+            try:
+                self._drop_user(int(namespace[len(USER_NAMESPACE_PREFIX):]))
+            except ValueError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tokens": len(self._tokens),
+                "users": len(self._users),
+                "token_hits": self.token_hits,
+                "token_misses": self.token_misses,
+                "user_hits": self.user_hits,
+                "user_misses": self.user_misses,
+            }
+
+
+auth_cache = AuthCache()
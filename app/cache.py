@@ -0,0 +1,234 @@
+import hashlib
+import logging
+import os
+import select
+import socket
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+import psycopg2
+from fastapi import Request, Response
+
+
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "60"))
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "256"))
+CATALOG_CACHE_CHANNEL = "catalog_cache"
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+logger = logging.getLogger(__name__)
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of If-None-Match against ``etag``, as RFC 9110 requires for GET."""
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or "W/" + etag in tags
+
+
+class CacheEntry:
+    def __init__(self, body: bytes, headers=None):
+        self.body = body
+        self.headers = headers or {}
+        self.etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+        # HTTP-даты имеют точность до секунды
+        self.last_modified = int(time.time())
+
+    def to_response(self, request: Request, media_type="application/json"):
+        headers = {
+            **self.headers,
+            "ETag": self.etag,
+            "Last-Modified": formatdate(self.last_modified, usegmt=True),
+            "Cache-Control": "no-cache",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            if etag_matches(if_none_match, self.etag):
+                return Response(status_code=304, headers=headers)
+        else:
+            if_modified_since = request.headers.get("if-modified-since")
+            if if_modified_since:
+                try:
+                    since = parsedate_to_datetime(if_modified_since).timestamp()
+                except (TypeError, ValueError):
+                    since = None
+                if since is not None and self.last_modified <= since:
+                    return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type=media_type, headers=headers)
+
+
+class CatalogCache:
+    """Read-through TTL + LRU cache for catalog responses.
+
+    Entries live in namespaces ("products", "categories"). Writers call
+    notify() inside their transaction and invalidate() after commit; other
+    workers drop the namespace when the notification arrives and run the
+    callbacks registered with on_remote_invalidate().
+    """
+
+    def __init__(self, ttl=CATALOG_CACHE_TTL, max_entries=CATALOG_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (namespace, key) -> (entry, expires_at)
+        # Поколения берутся из общего счётчика: у забытого namespace значение по умолчанию
+        # (_generation_floor) не меньше любого, которое он успел получить
+        self._generation = 0
+        self._generations = {}
+        self._generation_floor = 0
+        self._invalidated_at = {}  # namespace (None — всё) -> time.monotonic()
+        self._pruned_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+        self._listener = None
+        self._stop = threading.Event()
+        self._remote_callbacks = []
+
+    def get(self, namespace, key):
+        with self._lock:
+            item = self._entries.get((namespace, key))
+            if item is None:
+                self.misses += 1
+                return None
+            entry, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._entries[(namespace, key)]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end((namespace, key))
+            self.hits += 1
+            return entry
+
+    def get_or_load(self, namespace, key, loader):
+        """Return the cached entry or build one with ``loader()`` (which returns a CacheEntry)."""
+        entry = self.get(namespace, key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            generation = self._generations.get(namespace, self._generation_floor)
+        entry = loader()
+        with self._lock:
+            # Если за время загрузки namespace инвалидировали, результат может быть устаревшим
+            if self._generations.get(namespace, self._generation_floor) == generation:
+                self._entries[(namespace, key)] = (entry, time.monotonic() + self.ttl)
+                self._entries.move_to_end((namespace, key))
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return entry
+
+    def invalidate(self, namespace=None):
+        with self._lock:
+            now = time.monotonic()
+            self.invalidations += 1
+            self._invalidated_at[namespace] = now
+            self._generation += 1
+            if namespace is None:
+                for ns in {ns for ns, _ in self._entries} | set(self._generations):
+                    self._generations[ns] = self._generation
+                self._entries.clear()
+            else:
+                self._generations[namespace] = self._generation
+                for cache_key in [k for k in self._entries if k[0] == namespace]:
+                    del self._entries[cache_key]
+            self._prune(now)
+
+    def _prune(self, now):
+        """Forget namespaces invalidated more than ttl ago (under the lock).
+
+        Each "user.<id>" namespace would otherwise stay forever. A forgotten
+        namespace reads as _generation_floor, so a load that began before the
+        prune is at worst not stored. invalidated_at() only matters while
+        replicas may lag, far less than ttl.
+        """
+        if now - self._pruned_at < self.ttl:
+            return
+        self._pruned_at = now
+        for ns in [ns for ns, at in self._invalidated_at.items() if ns is not None and now - at >= self.ttl]:
+            del self._invalidated_at[ns]
+            self._generation_floor = max(self._generation_floor, self._generations.pop(ns, 0))
+
+    def invalidated_at(self, namespace):
+        """time.monotonic() of the namespace's last invalidation; reads for it must not be older."""
+        with self._lock:
+            times = [at for at in (self._invalidated_at.get(namespace), self._invalidated_at.get(None)) if at is not None]
+        return max(times) if times else None
+
+    def notify(self, cursor, namespace):
+        """Queue a cross-worker invalidation; Postgres delivers it on commit."""
+        cursor.execute("SELECT pg_notify(%s, %s)", (CATALOG_CACHE_CHANNEL, f"{namespace}:{WORKER_ID}"))
+
+    def on_remote_invalidate(self, callback):
+        """Call ``callback(namespace)`` when another worker changes a namespace (None means everything)."""
+        self._remote_callbacks.append(callback)
+
+    def _invalidate_remote(self, namespace):
+        # Сначала производные структуры (дерево категорий): иначе загрузка между вызовами
+        # закэширует их старое состояние под новым поколением
+        for callback in self._remote_callbacks:
+            callback(namespace)
+        self.invalidate(namespace)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "listening": self._listener is not None and self._listener.is_alive(),
+            }
+
+    def start_listener(self, dsn):
+        self._stop.clear()
+        self._listener = threading.Thread(target=self._listen, args=(dsn,), name="catalog-cache-listener", daemon=True)
+        self._listener.start()
+
+    def stop_listener(self):
+        self._stop.set()
+        if self._listener is not None:
+            self._listener.join(timeout=5)
+            self._listener = None
+
+    def _listen(self, dsn):
+        while not self._stop.is_set():
+            try:
+                conn = psycopg2.connect(dsn)
+            except psycopg2.Error as e:
+                logger.warning("Catalog cache listener cannot connect: %s", e)
+                self._stop.wait(1)
+                continue
+            try:
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CATALOG_CACHE_CHANNEL}")
+                # Пока соединения не было, уведомления могли потеряться
+                self._invalidate_remote(None)
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        namespace, _, origin = conn.notifies.pop(0).payload.partition(":")
+                        # Свои изменения уже инвалидированы локально после commit
+                        if origin != WORKER_ID:
+                            self._invalidate_remote(namespace or None)
+            except (psycopg2.Error, OSError) as e:
+                logger.warning("Catalog cache listener error: %s", e)
+                self._stop.wait(1)
+            finally:
+                conn.close()
+
+
+catalog_cache = CatalogCache()
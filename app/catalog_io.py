@@ -0,0 +1,583 @@
+"""Bulk catalog import and export through COPY.
+
+An upload (CSV with a header row, or NDJSON) is streamed into a temporary
+staging table with COPY FROM STDIN, checked with set-based queries and
+upserted into the target table with one INSERT ... ON CONFLICT (name)
+statement. Exports stream COPY (SELECT ...) TO STDOUT. Neither direction
+keeps more than a chunk of the file in memory, so files larger than RAM work.
+
+    python catalog_io.py import products products.csv [--on-error skip]
+    python catalog_io.py import categories categories.ndjson
+    python catalog_io.py export products -o products.csv
+    python catalog_io.py import-kaggle ../ml/data     # item_categories.csv + items.csv
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from cache import catalog_cache
+from db import DATABASE_URL, pool
+from logs import configure_logging
+
+
+CATALOG_IO_CHUNK_BYTES = int(os.getenv("CATALOG_IO_CHUNK_BYTES", str(256 * 1024)))
+CATALOG_IMPORT_MAX_ERRORS = int(os.getenv("CATALOG_IMPORT_MAX_ERRORS", "100"))
+CATALOG_EXPORT_QUEUE_CHUNKS = int(os.getenv("CATALOG_EXPORT_QUEUE_CHUNKS", "8"))
+# Столько экспорт ждёт клиента, который перестал читать ответ, прежде чем освободить соединение
+CATALOG_EXPORT_STALL_TIMEOUT = float(os.getenv("CATALOG_EXPORT_STALL_TIMEOUT", "60"))
+NDJSON_LINES_PER_CHUNK = 1000
+
+CATALOG_KINDS = ("products", "categories")
+IMPORT_COLUMNS = {
+    "products": ("name", "description", "price", "stock", "category_id", "category", "attributes"),
+    "categories": ("name", "parent_id", "parent"),
+}
+# Колонки выгрузки, которые импорт пропускает: экспорт можно загрузить обратно как есть
+IMPORT_IGNORED_COLUMNS = {
+    "products": ("id", "created_at"),
+    "categories": ("id",),
+}
+EXPORT_SQL = {
+    "products": """
+        SELECT p.id, p.name, p.description, p.price, p.stock, p.category_id, c.name AS category, p.attributes,
+               p.created_at
+        FROM products p LEFT JOIN categories c ON c.id = p.category_id
+        ORDER BY p.id
+    """,
+    "categories": """
+        SELECT c.id, c.name, c.parent_id, p.name AS parent
+        FROM categories c LEFT JOIN categories p ON p.id = c.parent_id
+        ORDER BY c.id
+    """,
+}
+EXPORT_JSON_SQL = {
+    "products": """
+        SELECT json_build_object(
+            'id', p.id, 'name', p.name, 'description', p.description, 'price', p.price, 'stock', p.stock,
+            'category_id', p.category_id, 'category', c.name, 'attributes', p.attributes, 'created_at', p.created_at
+        )::text
+        FROM products p LEFT JOIN categories c ON c.id = p.category_id
+        ORDER BY p.id
+    """,
+    "categories": """
+        SELECT json_build_object('id', c.id, 'name', c.name, 'parent_id', c.parent_id, 'parent', p.name)::text
+        FROM categories c LEFT JOIN categories p ON p.id = c.parent_id
+        ORDER BY c.id
+    """,
+}
+
+# Первая подходящая ошибка строки; CASE вычисляет ветки по порядку, поэтому приведения типов
+# выполняются только после проверки формата
+VALIDATE_SQL = {
+    "products": r"""
+        SELECT s.row_no, CASE
+            WHEN s.error IS NOT NULL THEN s.error
+            WHEN s.name IS NULL OR btrim(s.name) = '' THEN 'name is required'
+            WHEN length(btrim(s.name)) > 255 THEN 'name is longer than 255 characters'
+            WHEN s.price !~ '^\s*\d{1,8}(\.\d{0,2})?\s*$' THEN 'price must be a number from 0 to 99999999.99'
+            WHEN s.stock !~ '^\s*\d{1,9}\s*$' THEN 'stock must be an integer from 0 to 999999999'
+            WHEN s.category IS NOT NULL
+                 AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.name = btrim(s.category)) THEN 'unknown category'
+            WHEN s.category IS NULL AND s.category_id !~ '^\s*\d{1,9}\s*$' THEN 'category_id must be an integer'
+            WHEN s.category IS NULL AND s.category_id IS NOT NULL
+                 AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.id = s.category_id::int) THEN 'unknown category_id'
+            WHEN s.attributes IS NOT NULL AND jsonb_object_or_null(s.attributes) IS NULL
+                THEN 'attributes must be a JSON object'
+            WHEN (s.price IS NULL OR s.stock IS NULL)
+                 AND NOT EXISTS (SELECT 1 FROM products p WHERE p.name = btrim(s.name))
+                THEN 'price and stock are required for new products'
+        END AS error
+        FROM catalog_staging s
+    """,
+    "categories": r"""
+        SELECT s.row_no, CASE
+            WHEN s.error IS NOT NULL THEN s.error
+            WHEN s.name IS NULL OR btrim(s.name) = '' THEN 'name is required'
+            WHEN length(btrim(s.name)) > 255 THEN 'name is longer than 255 characters'
+            WHEN btrim(s.parent) = btrim(s.name) THEN 'a category cannot be its own parent'
+            WHEN s.parent IS NOT NULL
+                 AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.name = btrim(s.parent))
+                 AND NOT EXISTS (SELECT 1 FROM catalog_staging n WHERE btrim(n.name) = btrim(s.parent))
+                THEN 'unknown parent'
+            WHEN s.parent IS NULL AND s.parent_id !~ '^\s*\d{1,9}\s*$' THEN 'parent_id must be an integer'
+            WHEN s.parent IS NULL AND s.parent_id IS NOT NULL
+                 AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.id = s.parent_id::int) THEN 'unknown parent_id'
+        END AS error
+        FROM catalog_staging s
+    """,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogImportError(ValueError):
+    """The upload cannot be read at all (bad header, malformed CSV, wrong encoding)."""
+
+
+class ChunkReader:
+    """Read-only file object over an iterator of byte chunks, as COPY FROM STDIN expects."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+        self._pos = 0
+        self.bytes_read = 0
+
+    def _fill(self):
+        for chunk in self._chunks:
+            if chunk:
+                self._buffer = self._buffer[self._pos:] + chunk
+                self._pos = 0
+                self.bytes_read += len(chunk)
+                return True
+        return False
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) - self._pos < size:
+            if not self._fill():
+                break
+        end = len(self._buffer) if size < 0 else self._pos + size
+        data = self._buffer[self._pos:end]
+        self._pos += len(data)
+        return data
+
+    def readline(self):
+        while True:
+            newline = self._buffer.find(b"\n", self._pos)
+            if newline >= 0:
+                return self.read(newline + 1 - self._pos)
+            if not self._fill():
+                return self.read()
+
+
+class _ChunkWriter:
+    """Write-only file object for COPY TO STDOUT that hands out chunks of about CATALOG_IO_CHUNK_BYTES."""
+
+    def __init__(self, put):
+        self._put = put
+        self._parts = []
+        self._size = 0
+
+    def write(self, data):
+        self._parts.append(data)
+        self._size += len(data)
+        if self._size >= CATALOG_IO_CHUNK_BYTES:
+            self.flush()
+
+    def flush(self):
+        if self._parts:
+            self._put(b"".join(self._parts))
+            self._parts = []
+            self._size = 0
+
+
+class _ExportCancelled(Exception):
+    pass
+
+
+def _copy_text(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _create_staging(cursor, kind):
+    columns = IMPORT_COLUMNS[kind] + IMPORT_IGNORED_COLUMNS[kind]
+    cursor.execute("""
+        CREATE TEMP TABLE catalog_staging (
+            row_no BIGINT GENERATED BY DEFAULT AS IDENTITY,
+            error TEXT,
+            %s
+        ) ON COMMIT DROP
+    """ % ", ".join("%s TEXT" % column for column in columns))
+
+
+def _copy_csv(cursor, kind, stream):
+    """COPY a CSV upload into catalog_staging; returns the columns named in its header."""
+    header = stream.readline()
+    try:
+        columns = [column.strip() for column in next(csv.reader([header.decode("utf-8-sig")]), [])]
+    except UnicodeDecodeError:
+        raise CatalogImportError("The CSV header is not valid UTF-8")
+    allowed = IMPORT_COLUMNS[kind] + IMPORT_IGNORED_COLUMNS[kind]
+    unknown = [column for column in columns if column not in allowed]
+    if unknown:
+        raise CatalogImportError("Unknown columns %s; expected some of %s" % (", ".join(unknown), ", ".join(allowed)))
+    if "name" not in columns or len(set(columns)) != len(columns):
+        raise CatalogImportError("The CSV header must name each column once and include name")
+    # Имена колонок проверены по списку выше, их можно подставить в запрос
+    cursor.copy_expert("COPY catalog_staging (%s) FROM STDIN WITH (FORMAT csv, ENCODING 'UTF8')" % ", ".join(columns),
+                       stream, size=CATALOG_IO_CHUNK_BYTES)
+    return set(columns)
+
+
+def _copy_records(cursor, kind, records):
+    """COPY (row_no, error, record) triples into catalog_staging; returns the record keys seen."""
+    columns = IMPORT_COLUMNS[kind]
+    ignored = set(IMPORT_IGNORED_COLUMNS[kind])
+    present = set()
+
+    def lines():
+        batch = []
+        for row_no, error, record in records:
+            if error is None:
+                unknown = sorted(set(record) - set(columns) - ignored)
+                if unknown:
+                    error = "unknown fields: " + ", ".join(unknown)
+                else:
+                    present.update(key for key in record if key in columns)
+            values = [row_no, error] + [None if error else record.get(column) for column in columns]
+            batch.append("\t".join(_copy_text(value) for value in values))
+            if len(batch) >= NDJSON_LINES_PER_CHUNK:
+                yield ("\n".join(batch) + "\n").encode()
+                batch = []
+        if batch:
+            yield ("\n".join(batch) + "\n").encode()
+
+    cursor.copy_expert("COPY catalog_staging (row_no, error, %s) FROM STDIN" % ", ".join(columns),
+                       ChunkReader(lines()), size=CATALOG_IO_CHUNK_BYTES)
+    return present
+
+
+def _ndjson_records(stream):
+    for line_no, line in enumerate(iter(stream.readline, b""), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_no, "invalid JSON", None
+            continue
+        if not isinstance(record, dict):
+            yield line_no, "a line must be a JSON object", None
+            continue
+        yield line_no, None, record
+
+
+def _collect_errors(cursor, kind):
+    cursor.execute("CREATE TEMP TABLE catalog_errors ON COMMIT DROP AS "
+                   "SELECT row_no, error, NULL::bigint AS used_row FROM (%s) checked WHERE error IS NOT NULL"
+                   % VALIDATE_SQL[kind])
+    # Одно имя дважды в файле: берётся последняя корректная строка (как при повторном импорте),
+    # остальные пропускаются в обоих режимах и ошибками не считаются
+    cursor.execute("""
+        INSERT INTO catalog_errors (row_no, used_row)
+        SELECT row_no, last_row
+        FROM (
+            SELECT s.row_no, max(s.row_no) OVER (PARTITION BY btrim(s.name)) AS last_row
+            FROM catalog_staging s
+            WHERE NOT EXISTS (SELECT 1 FROM catalog_errors e WHERE e.row_no = s.row_no)
+        ) named
+        WHERE row_no < last_row
+    """)
+    cursor.execute("SELECT COUNT(*) FILTER (WHERE used_row IS NULL) AS invalid, "
+                   "COUNT(*) FILTER (WHERE used_row IS NOT NULL) AS duplicates FROM catalog_errors")
+    counts = cursor.fetchone()
+    cursor.execute("SELECT row_no AS row, error FROM catalog_errors WHERE used_row IS NULL ORDER BY row_no LIMIT %s",
+                   (CATALOG_IMPORT_MAX_ERRORS,))
+    errors = [dict(row) for row in cursor.fetchall()]
+    cursor.execute("SELECT row_no AS row, used_row FROM catalog_errors WHERE used_row IS NOT NULL "
+                   "ORDER BY row_no LIMIT %s", (CATALOG_IMPORT_MAX_ERRORS,))
+    return counts["invalid"], errors, counts["duplicates"], [dict(row) for row in cursor.fetchall()]
+
+
+def _upsert_products(cursor, present):
+    columns = [column for column in ("description", "price", "stock", "category_id", "attributes")
+               if column in present or (column == "category_id" and "category" in present)]
+    on_conflict = "DO NOTHING"
+    if columns:
+        # Совпадающие строки не переписываются: повторная загрузка всего каталога не трогает
+        # search_vector и индексы неизменившихся товаров
+        on_conflict = "DO UPDATE SET %s WHERE (%s) IS DISTINCT FROM (%s)" % (
+            ", ".join("%s = EXCLUDED.%s" % (column, column) for column in columns),
+            ", ".join("products.%s" % column for column in columns),
+            ", ".join("EXCLUDED.%s" % column for column in columns),
+        )
+    # NOT NULL проверяется до ON CONFLICT, поэтому цена и остаток существующего товара подставляются из products
+    cursor.execute("""
+        WITH upserted AS (
+            INSERT INTO products (name, description, price, stock, category_id, attributes)
+            SELECT btrim(s.name), s.description, COALESCE(s.price::numeric, p.price), COALESCE(s.stock::int, p.stock),
+                   COALESCE(c.id, s.category_id::int), s.attributes::jsonb
+            FROM catalog_staging s
+            LEFT JOIN products p ON p.name = btrim(s.name)
+            LEFT JOIN categories c ON c.name = btrim(s.category)
+            WHERE NOT EXISTS (SELECT 1 FROM catalog_errors e WHERE e.row_no = s.row_no)
+            ON CONFLICT (name) %s
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT COUNT(*) FILTER (WHERE inserted) AS inserted, COUNT(*) FILTER (WHERE NOT inserted) AS updated
+        FROM upserted
+    """ % on_conflict)
+    return cursor.fetchone()
+
+
+def _upsert_categories(cursor, present):
+    cursor.execute("""
+        INSERT INTO categories (name)
+        SELECT btrim(s.name) FROM catalog_staging s
+        WHERE NOT EXISTS (SELECT 1 FROM catalog_errors e WHERE e.row_no = s.row_no)
+        ON CONFLICT (name) DO NOTHING
+    """)
+    inserted = cursor.rowcount
+    updated = 0
+    if "parent" in present or "parent_id" in present:
+        # Родитель может быть новой категорией из этого же файла, поэтому отдельным шагом после вставки.
+        # Подзапрос встраивается в UPDATE, и приведение может выполниться раньше фильтра по catalog_errors
+        cursor.execute(r"""
+            UPDATE categories c SET parent_id = v.parent_id
+            FROM (
+                SELECT btrim(s.name) AS name,
+                       COALESCE(p.id, CASE WHEN s.parent_id ~ '^\s*\d{1,9}\s*$' THEN s.parent_id::int END) AS parent_id
+                FROM catalog_staging s
+                LEFT JOIN categories p ON p.name = btrim(s.parent)
+                WHERE NOT EXISTS (SELECT 1 FROM catalog_errors e WHERE e.row_no = s.row_no)
+            ) v
+            WHERE c.name = v.name AND c.parent_id IS DISTINCT FROM v.parent_id
+        """)
+        updated = cursor.rowcount
+    return {"inserted": inserted, "updated": updated}
+
+
+def _import(db, kind, fmt, copy, on_error, bytes_read):
+    started = time.perf_counter()
+    try:
+        with db.cursor() as cursor:
+            _create_staging(cursor, kind)
+            try:
+                present = copy(cursor)
+            except psycopg2.DataError as e:
+                raise CatalogImportError("; ".join(line.strip() for line in str(e).splitlines() if line.strip()))
+            cursor.execute("ANALYZE catalog_staging")
+            cursor.execute("SELECT COUNT(*) AS rows FROM catalog_staging")
+            rows = cursor.fetchone()["rows"]
+            invalid, errors, duplicates, duplicate_rows = _collect_errors(cursor, kind)
+            counts = {"inserted": 0, "updated": 0}
+            committed = not invalid or on_error == "skip"
+            if committed:
+                counts = _upsert_products(cursor, present) if kind == "products" else _upsert_categories(cursor, present)
+                catalog_cache.notify(cursor, kind)
+        if committed:
+            db.commit()
+        else:
+            db.rollback()
+    except Exception:
+        db.rollback()
+        raise
+    seconds = time.perf_counter() - started
+    report = {
+        "kind": kind,
+        "format": fmt,
+        "committed": committed,
+        "rows": rows,
+        "inserted": counts["inserted"],
+        "updated": counts["updated"],
+        "unchanged": rows - invalid - duplicates - counts["inserted"] - counts["updated"] if committed else 0,
+        "invalid": invalid,
+        "errors": errors,
+        "duplicates": duplicates,
+        "duplicate_rows": duplicate_rows,
+        "bytes": bytes_read(),
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds) if seconds > 0 else 0,
+    }
+    logger.info("Imported %(kind)s: %(rows)d rows (%(inserted)d new, %(updated)d updated, %(invalid)d invalid, "
+                "%(duplicates)d duplicates) in %(seconds).2f s, %(rows_per_sec)d rows/s", report)
+    return report
+
+
+def import_stream(db, kind, fmt, stream, on_error="abort"):
+    """Import a CSV or NDJSON upload from a binary file object; returns a report dict.
+
+    With on_error="abort" nothing is written if any row is invalid; "skip"
+    writes the valid rows. Either way the report lists the first
+    CATALOG_IMPORT_MAX_ERRORS errors by row (CSV rows are counted after the
+    header, NDJSON rows are line numbers). A name repeated in the file is not
+    an error: the last valid row with it is imported, and the earlier ones are
+    listed in duplicate_rows with the row that was used instead.
+    """
+    if fmt == "csv":
+        copy = lambda cursor: _copy_csv(cursor, kind, stream)
+    else:
+        copy = lambda cursor: _copy_records(cursor, kind, _ndjson_records(stream))
+    return _import(db, kind, fmt, copy, on_error, lambda: getattr(stream, "bytes_read", None))
+
+
+def import_records(db, kind, records, on_error="abort"):
+    """Import an iterable of dicts (same fields as NDJSON lines); returns a report dict."""
+    numbered = ((row_no, None, record) for row_no, record in enumerate(records, 1))
+    return _import(db, kind, "records", lambda cursor: _copy_records(cursor, kind, numbered), on_error, lambda: None)
+
+
+def export_to(db, kind, fmt, out):
+    """COPY a catalog table to ``out`` (a binary file object) as CSV or NDJSON; returns the row count."""
+    with db.cursor() as cursor:
+        if fmt == "csv":
+            cursor.copy_expert("COPY (%s) TO STDOUT WITH (FORMAT csv, HEADER true)" % EXPORT_SQL[kind], out,
+                               size=CATALOG_IO_CHUNK_BYTES)
+        else:
+            # В режиме csv поле без кавычки, разделителя и переводов строк выводится как есть, а в тексте
+            # json_build_object управляющие символы уже экранированы: получаются строки JSON без изменений
+            cursor.copy_expert("COPY (%s) TO STDOUT WITH (FORMAT csv, DELIMITER E'\\x02', QUOTE E'\\x01')"
+                               % EXPORT_JSON_SQL[kind], out, size=CATALOG_IO_CHUNK_BYTES)
+        rows = cursor.rowcount
+    db.rollback()
+    return rows
+
+
+def stream_export(kind, fmt):
+    """Chunks of an export for a StreamingResponse.
+
+    COPY TO is a single blocking call, so it runs in its own thread on a
+    pooled connection and passes chunks through a small bounded queue: a slow
+    client slows the COPY down instead of the table piling up in memory. The
+    connection is taken here, so PoolTimeout surfaces before the response starts.
+    """
+    db = pool.getconn()
+    chunks = queue.Queue(maxsize=CATALOG_EXPORT_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+
+    def put(item):
+        deadline = time.monotonic() + CATALOG_EXPORT_STALL_TIMEOUT
+        while not cancelled.is_set() and time.monotonic() < deadline:
+            try:
+                chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+        raise _ExportCancelled()
+
+    def produce():
+        started = time.perf_counter()
+        try:
+            writer = _ChunkWriter(put)
+            rows = export_to(db, kind, fmt, writer)
+            writer.flush()
+            seconds = time.perf_counter() - started
+            logger.info("Exported %s: %d rows in %.2f s, %d rows/s", kind, rows, seconds, rows / seconds if seconds > 0 else 0)
+            put(None)
+        except _ExportCancelled:
+            logger.info("Export of %s cancelled: the client stopped reading", kind)
+        except Exception as e:
+            try:
+                put(e)
+            except _ExportCancelled:
+                pass
+        finally:
+            pool.putconn(db)
+
+    threading.Thread(target=produce, name="catalog-export", daemon=True).start()
+
+    def iterate():
+        try:
+            while True:
+                item = chunks.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            cancelled.set()
+
+    return iterate()
+
+
+def kaggle_records(data_dir, price, stock):
+    """Categories and products from item_categories.csv and items.csv (attributes.item_id keeps the dataset id)."""
+    with open(os.path.join(data_dir, "item_categories.csv"), encoding="utf-8", newline="") as file:
+        category_names = {row["item_category_id"]: row["item_category_name"].strip() for row in csv.DictReader(file)}
+    categories = [{"name": name} for name in category_names.values()]
+
+    def products():
+        with open(os.path.join(data_dir, "items.csv"), encoding="utf-8", newline="") as file:
+            for row in csv.DictReader(file):
+                yield {
+                    "name": row["item_name"].strip(),
+                    "price": price,
+                    "stock": stock,
+                    "category": category_names.get(row["item_category_id"]),
+                    "attributes": {"item_id": row["item_id"]},
+                }
+
+    return categories, products()
+
+
+def _file_chunks(file):
+    return iter(lambda: file.read(CATALOG_IO_CHUNK_BYTES), b"")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="upsert a CSV or NDJSON file (- for stdin)")
+    import_parser.add_argument("kind", choices=CATALOG_KINDS)
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=("csv", "ndjson"),
+                               help="default: ndjson for .ndjson/.jsonl files, csv otherwise")
+    import_parser.add_argument("--on-error", choices=("abort", "skip"), default="abort")
+    export_parser = commands.add_parser("export", help="write a table as CSV or NDJSON")
+    export_parser.add_argument("kind", choices=CATALOG_KINDS)
+    export_parser.add_argument("-o", "--output", default="-")
+    export_parser.add_argument("--format", choices=("csv", "ndjson"), default="csv")
+    kaggle_parser = commands.add_parser("import-kaggle", help="load ml/data/item_categories.csv and items.csv")
+    kaggle_parser.add_argument("data_dir")
+    kaggle_parser.add_argument("--price", default="0", help="price of new products (the dataset has none)")
+    kaggle_parser.add_argument("--stock", default="0", help="stock of new products")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    db = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    try:
+        if args.command == "import":
+            fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+            file = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+            try:
+                report = import_stream(db, args.kind, fmt, ChunkReader(_file_chunks(file)), args.on_error)
+            finally:
+                if file is not sys.stdin.buffer:
+                    file.close()
+            for error in report["errors"]:
+                print("row %(row)d: %(error)s" % error, file=sys.stderr)
+            for duplicate in report["duplicate_rows"]:
+                print("row %(row)d: duplicate name, row %(used_row)d is used instead" % duplicate, file=sys.stderr)
+            if not report["committed"]:
+                sys.exit("Nothing imported: %d invalid rows (use --on-error skip to import the rest)" % report["invalid"])
+        elif args.command == "export":
+            started = time.perf_counter()
+            file = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+            try:
+                rows = export_to(db, args.kind, args.format, file)
+            finally:
+                if file is not sys.stdout.buffer:
+                    file.close()
+            seconds = time.perf_counter() - started
+            print("Exported %s: %d rows in %.2f s, %d rows/s" % (args.kind, rows, seconds, rows / seconds if seconds > 0 else 0),
+                  file=sys.stderr)
+        else:
+            categories, products = kaggle_records(args.data_dir, args.price, args.stock)
+            for kind, records in (("categories", categories), ("products", products)):
+                report = import_records(db, kind, records)
+                if not report["committed"]:
+                    for error in report["errors"]:
+                        print("%s row %d: %s" % (kind, error["row"], error["error"]), file=sys.stderr)
+                    sys.exit("Nothing imported into %s: %d invalid rows" % (kind, report["invalid"]))
+    except CatalogImportError as e:
+        sys.exit(str(e))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
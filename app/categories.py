@@ -0,0 +1,88 @@
+import threading
+
+from db import pool
+
+
+class CategoryTree:
+    """In-memory closure table over the ``categories`` adjacency list.
+
+    For every category it keeps the set of its descendants (including
+    itself), so a subtree resolves to a list of ids without recursion in SQL.
+    Adding a leaf only touches the sets of its ancestors.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nodes = None  # id -> row
+        self._children = {}
+        self._descendants = {}
+
+    def _load(self):
+        with pool.connection() as db:
+            with db.cursor() as cursor:
+                cursor.execute("SELECT id, name, parent_id FROM categories ORDER BY id")
+                rows = cursor.fetchall()
+        nodes = {row["id"]: dict(row) for row in rows}
+        children = {category_id: [] for category_id in nodes}
+        descendants = {category_id: {category_id} for category_id in nodes}
+        for row in nodes.values():
+            if row["parent_id"] in children:
+                children[row["parent_id"]].append(row["id"])
+        for category_id in nodes:
+            for ancestor in self._ancestors(nodes, category_id):
+                descendants[ancestor].add(category_id)
+        self._nodes, self._children, self._descendants = nodes, children, descendants
+
+    @staticmethod
+    def _ancestors(nodes, category_id):
+        seen = set()
+        parent_id = nodes[category_id]["parent_id"]
+        # seen защищает от циклов в parent_id
+        while parent_id in nodes and parent_id not in seen:
+            seen.add(parent_id)
+            yield parent_id
+            parent_id = nodes[parent_id]["parent_id"]
+
+    def _ensure_loaded(self):
+        if self._nodes is None:
+            self._load()
+
+    def invalidate(self, namespace=None):
+        if namespace in (None, "categories"):
+            with self._lock:
+                self._nodes = None
+
+    def add(self, row):
+        with self._lock:
+            if self._nodes is None:
+                return
+            category_id = row["id"]
+            self._nodes[category_id] = dict(row)
+            self._children[category_id] = []
+            self._descendants[category_id] = {category_id}
+            if row["parent_id"] in self._children:
+                self._children[row["parent_id"]].append(category_id)
+            for ancestor in self._ancestors(self._nodes, category_id):
+                self._descendants[ancestor].add(category_id)
+
+    def tree(self):
+        with self._lock:
+            self._ensure_loaded()
+
+            def build(category_id):
+                node = self._nodes[category_id]
+                return {**node, "children": [build(child) for child in self._children[category_id]]}
+
+            roots = [row["id"] for row in self._nodes.values() if row["parent_id"] not in self._nodes]
+            return [build(category_id) for category_id in roots]
+
+    def subtree_ids(self, category_id):
+        """Ids of the category and all its descendants, or None if it does not exist."""
+        with self._lock:
+            self._ensure_loaded()
+            if category_id not in self._descendants:
+                return None
+            return sorted(self._descendants[category_id])
+
+
+category_tree = CategoryTree()
@@ -0,0 +1,478 @@
+import collections
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+from metrics import record_query
+
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:password@db/shop")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5"))
+# Соединение, простоявшее без дела дольше этого времени, проверяется через SELECT 1
+DB_POOL_HEALTH_CHECK_IDLE = float(os.getenv("DB_POOL_HEALTH_CHECK_IDLE", "30"))
+# Реплики для чтения через запятую; пусто — всё читается с основного сервера
+DATABASE_REPLICA_URLS = [dsn.strip() for dsn in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if dsn.strip()]
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "1"))
+# Сколько помнить время последней записи пользователя; дольше REPLICA_MAX_LAG смысла нет
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", str(REPLICA_MAX_LAG)))
+
+# Позиция WAL, до которой записано всё закоммиченное на основном сервере. insert, а не write:
+# при synchronous_commit=off коммит возвращается клиенту раньше, чем WAL записан
+PRIMARY_LSN_SQL = "SELECT pg_current_wal_insert_lsn()::text AS lsn"
+# Всё полученное может быть применено и у реплики, которая отключилась от основного сервера,
+# поэтому свежесть сравнивается с позицией основного, а приёмник WAL проверяется отдельно
+REPLICA_STATUS_SQL = """
+    SELECT pg_is_in_recovery() AS in_recovery,
+           EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') AS streaming,
+           pg_last_wal_replay_lsn()::text AS replay_lsn
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class InstrumentedCursor(RealDictCursor):
+    """RealDictCursor that reports every statement and its time to metrics.record_query."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query(sql, time.perf_counter() - started)
+
+
+class ConnectionPool:
+    """Bounded pool of psycopg2 connections.
+
+    Connections are opened lazily up to max_size; callers beyond that wait
+    up to acquire_timeout seconds and then get PoolTimeout.
+    """
+
+    def __init__(self, dsn, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT, health_check_idle=DB_POOL_HEALTH_CHECK_IDLE, read_only=False):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size: min_size=%s, max_size=%s" % (min_size, max_size))
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_idle = health_check_idle
+        self.read_only = read_only
+
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, released_at)]
+        self._size = 0
+        self._closed = False
+
+        self._waiting = 0
+        self._acquired_total = 0
+        self._timeouts_total = 0
+        self._wait_seconds_total = 0.0
+        self._health_check_failures = 0
+        self._max_in_use = 0
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=InstrumentedCursor)
+        if self.read_only:
+            conn.set_session(readonly=True)
+        return conn
+
+    def open(self):
+        with self._cond:
+            self._closed = False
+        for _ in range(self.min_size):
+            conn = self._connect()
+            with self._cond:
+                self._size += 1
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            conn.close()
+
+    def _is_healthy(self, conn, released_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.health_check_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout=None):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Connection pool is closed")
+                    if self._idle:
+                        conn, released_at = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        conn = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts_total += 1
+                        raise PoolTimeout("Timed out waiting for a database connection (%.1fs)" % timeout)
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+        # Сетевые операции выполняются без удержания блокировки
+        try:
+            if conn is None:
+                conn = self._connect()
+            elif not self._is_healthy(conn, released_at):
+                with self._cond:
+                    self._health_check_failures += 1
+                conn.close()
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._acquired_total += 1
+            self._wait_seconds_total += time.monotonic() - started
+            self._max_in_use = max(self._max_in_use, self._size - len(self._idle))
+        return conn
+
+    def putconn(self, conn):
+        reusable = not conn.closed
+        if reusable and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                reusable = False
+        with self._cond:
+            if reusable and not self._closed:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._size -= 1
+            self._cond.notify()
+        if not reusable or self._closed:
+            conn.close()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            in_use = self._size - len(self._idle)
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "saturation": in_use / self.max_size,
+                "max_in_use": self._max_in_use,
+                "acquired_total": self._acquired_total,
+                "timeouts_total": self._timeouts_total,
+                "wait_seconds_total": round(self._wait_seconds_total, 6),
+                "health_check_failures": self._health_check_failures,
+            }
+
+
+pool = ConnectionPool(DATABASE_URL)
+
+
+def parse_lsn(text):
+    """pg_lsn text ('16/B374D848') as an integer WAL position."""
+    high, _, low = text.partition("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def primary_lsn(conn):
+    """WAL position on the primary that covers every transaction committed so far."""
+    with conn.cursor() as cursor:
+        cursor.execute(PRIMARY_LSN_SQL)
+        row = cursor.fetchone()
+    conn.rollback()
+    return parse_lsn(row["lsn"])
+
+
+def replica_status(conn):
+    """{"in_recovery", "streaming", "replay_lsn"} of a server; replay_lsn is None outside recovery."""
+    with conn.cursor() as cursor:
+        cursor.execute(REPLICA_STATUS_SQL)
+        row = cursor.fetchone()
+    conn.rollback()
+    return {
+        "in_recovery": row["in_recovery"],
+        "streaming": row["streaming"],
+        "replay_lsn": None if row["replay_lsn"] is None else parse_lsn(row["replay_lsn"]),
+    }
+
+
+class Replica:
+    def __init__(self, dsn):
+        # Соединения открываются при первой проверке: недоступная реплика не мешает старту
+        self.pool = ConnectionPool(dsn, min_size=0, read_only=True)
+        params = psycopg2.extensions.parse_dsn(dsn)
+        # Для журнала и /health/replicas: без пароля из DSN
+        self.name = "%s:%s/%s" % (params.get("host", "localhost"), params.get("port", "5432"), params.get("dbname", ""))
+        self.healthy = False
+        self.lag = None
+        # Всё, что закоммичено на основном сервере до этого момента (time.monotonic), на реплике уже видно
+        self.fresh_as_of = None
+        self.error = None
+        self.ejections = 0
+        self.reads = 0
+
+
+class ReplicaRouter:
+    """Routes read-only work to streaming replicas, falling back to the primary.
+
+    A background thread checks every replica each check_interval seconds.
+    Each check first reads the primary's WAL position. A replica's
+    fresh_as_of is the start of the latest check whose position it has
+    replayed, so everything committed on the primary before that moment is
+    visible on it; its lag is the time since then, in steps of
+    check_interval. A replica that fails the check, is not in recovery, has
+    no streaming WAL receiver or lags more than max_lag is ejected until a
+    later check passes. connection(fresh_after=t) only uses replicas with
+    fresh_as_of >= t.
+    Callers pass the time of the user's last write (read-your-writes) or
+    of the last catalog invalidation, so a read never goes back in time
+    for them. Replicas take turns round-robin. The primary is used when
+    no replica qualifies.
+    """
+
+    def __init__(self, primary, replica_dsns=(), max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_CHECK_INTERVAL,
+                 read_your_writes=READ_YOUR_WRITES_SECONDS, lsn_source=primary_lsn, status_source=replica_status):
+        self.primary = primary
+        self.replicas = [Replica(dsn) for dsn in replica_dsns]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.read_your_writes = read_your_writes
+        self.lsn_source = lsn_source
+        self.status_source = status_source
+        # (time.monotonic() начала проверки, позиция WAL основного сервера) за последние max_lag секунд
+        self._positions = collections.deque()
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        self._writes = {}  # user_id -> time.monotonic() последней записи
+        self._stop = threading.Event()
+        self._thread = None
+        self.primary_reads = 0
+        self.pinned_reads = 0
+
+    def open(self):
+        for replica in self.replicas:
+            replica.pool.open()
+        if self.replicas:
+            self.check()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="replica-checker", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for replica in self.replicas:
+            replica.pool.close()
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            self.check()
+
+    def check(self):
+        started = time.monotonic()
+        try:
+            with self.primary.connection(timeout=self.check_interval) as conn:
+                self._positions.append((started, self.lsn_source(conn)))
+        except (psycopg2.Error, PoolTimeout) as e:
+            # Без позиции основного сервера свежесть реплик не растёт, и они выйдут из ротации по отставанию
+            logger.warning("Primary WAL position unavailable: %s", str(e).strip() or type(e).__name__)
+        # Реплика, которой нужна более старая позиция, всё равно отстаёт больше max_lag
+        while self._positions and self._positions[0][0] < started - self.max_lag:
+            self._positions.popleft()
+        for replica in self.replicas:
+            try:
+                with replica.pool.connection(timeout=self.check_interval) as conn:
+                    status = self.status_source(conn)
+                error = None
+            except (psycopg2.Error, PoolTimeout) as e:
+                status, error = None, str(e).strip() or type(e).__name__
+            fresh_as_of = replica.fresh_as_of
+            if status is not None and status["in_recovery"]:
+                for at, lsn in self._positions:
+                    if lsn <= status["replay_lsn"] and (fresh_as_of is None or at > fresh_as_of):
+                        fresh_as_of = at
+            lag = None if fresh_as_of is None else started - fresh_as_of
+            if error is None:
+                if not status["in_recovery"]:
+                    error = "not a replica: the server is not in recovery"
+                elif not status["streaming"]:
+                    error = "no streaming WAL receiver"
+                elif lag is None:
+                    error = "has not replayed the primary's WAL position yet"
+                elif lag > self.max_lag:
+                    error = "lag %.1fs > %.1fs" % (lag, self.max_lag)
+            with self._lock:
+                was_healthy = replica.healthy
+                replica.lag = lag
+                replica.error = error
+                replica.healthy = error is None
+                replica.fresh_as_of = fresh_as_of
+                if was_healthy and not replica.healthy:
+                    replica.ejections += 1
+            if was_healthy != replica.healthy:
+                if replica.healthy:
+                    logger.info("Replica %s is back in rotation", replica.name)
+                else:
+                    logger.warning("Replica %s ejected: %s", replica.name, error)
+
+    def note_write(self, user_id):
+        """Remember that the user has just committed a write, so their reads see it."""
+        now = time.monotonic()
+        with self._lock:
+            self._writes[int(user_id)] = now
+            if len(self._writes) > 10000:
+                self._writes = {user: at for user, at in self._writes.items() if now - at < self.read_your_writes}
+
+    def written_at(self, user_id):
+        if user_id is None:
+            return None
+        with self._lock:
+            at = self._writes.get(int(user_id))
+        return at if at is not None and time.monotonic() - at < self.read_your_writes else None
+
+    def _choose(self, fresh_after):
+        with self._lock:
+            candidates = [replica for replica in self.replicas if replica.healthy
+                          and (fresh_after is None or replica.fresh_as_of >= fresh_after)]
+            if not candidates:
+                self.primary_reads += 1
+                if fresh_after is not None and any(replica.healthy for replica in self.replicas):
+                    self.pinned_reads += 1
+                return None
+            replica = candidates[next(self._turn) % len(candidates)]
+            replica.reads += 1
+            return replica
+
+    def getconn(self, fresh_after=None):
+        """(connection, pool it came from) for read-only work."""
+        replica = self._choose(fresh_after)
+        if replica is not None:
+            try:
+                return replica.pool.getconn(), replica.pool
+            except (psycopg2.OperationalError, PoolTimeout) as e:
+                # Реплика пропала между проверками: выводим из ротации сразу
+                with self._lock:
+                    replica.healthy = False
+                    replica.error = str(e).strip() or type(e).__name__
+                    replica.ejections += 1
+                    self.primary_reads += 1
+                logger.warning("Replica %s ejected: %s", replica.name, replica.error)
+        return self.primary.getconn(), self.primary
+
+    @contextmanager
+    def connection(self, fresh_after=None):
+        conn, source = self.getconn(fresh_after)
+        try:
+            yield conn
+        finally:
+            source.putconn(conn)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "max_lag": self.max_lag,
+                "primary_reads": self.primary_reads,
+                "pinned_reads": self.pinned_reads,
+                "pinned_users": sum(1 for at in self._writes.values() if now - at < self.read_your_writes),
+                "replicas": [{
+                    "name": replica.name,
+                    "healthy": replica.healthy,
+                    "lag": None if replica.lag is None else round(replica.lag, 3),
+                    "fresh_for": None if replica.fresh_as_of is None else round(now - replica.fresh_as_of, 3),
+                    "error": replica.error,
+                    "ejections": replica.ejections,
+                    "reads": replica.reads,
+                    "pool": replica.pool.stats(),
+                } for replica in self.replicas],
+            }
+
+
+replicas = ReplicaRouter(pool, DATABASE_REPLICA_URLS)
+
+
+def get_db():
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+def get_read_db(request: Request):
+    """Connection for read-only endpoints: a replica that has the caller's last write, or the primary."""
+    user_id = request.path_params.get("user_id") or request.query_params.get("user_id")
+    try:
+        fresh_after = replicas.written_at(user_id)
+    except ValueError:
+        fresh_after = None
+    conn, source = replicas.getconn(fresh_after)
+    try:
+        yield conn
+    finally:
+        source.putconn(conn)
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking function that takes a pooled connection off the event loop."""
+    def call():
+        with pool.connection() as conn:
+            return func(conn, *args, **kwargs)
+    return await run_in_threadpool(call)
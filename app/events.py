@@ -0,0 +1,188 @@
+import asyncio
+import io
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+from db import run_db
+
+
+EVENTS_QUEUE_MAX = int(os.getenv("EVENTS_QUEUE_MAX", "100000"))
+EVENTS_BATCH_SIZE = int(os.getenv("EVENTS_BATCH_SIZE", "5000"))
+EVENTS_FLUSH_INTERVAL = float(os.getenv("EVENTS_FLUSH_INTERVAL", "1"))
+EVENTS_MAX_PER_REQUEST = int(os.getenv("EVENTS_MAX_PER_REQUEST", "1000"))
+
+# Тип события -> значение user_logs.action (те же строки, что в тестовых данных)
+EVENT_ACTIONS = {
+    "view": "Просмотрел товар",
+    "cart_add": "Добавил товар в корзину",
+    "cart_remove": "Удалил товар из корзины",
+    "checkout": "Перешел к оформлению заказа",
+    "purchase": "Оформил заказ",
+}
+EVENT_TYPE_PATTERN = "^(%s)$" % "|".join(EVENT_ACTIONS)
+
+logger = logging.getLogger(__name__)
+
+
+class EventLog:
+    """Buffers user_logs rows in memory and writes them in batches with COPY.
+
+    record() never blocks a request: when the queue is full the event is
+    dropped and counted. offer() is all-or-nothing for POST /events, so the
+    endpoint can push back with 503 instead. A background asyncio task
+    flushes every flush_interval seconds or as soon as a batch is full.
+    """
+
+    def __init__(self, max_queue=EVENTS_QUEUE_MAX, batch_size=EVENTS_BATCH_SIZE, flush_interval=EVENTS_FLUSH_INTERVAL):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+        self.enqueued = 0
+        self.dropped = 0
+        self.overflow = 0
+        self.written = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    def _row(self, user_id, event_type, product_id):
+        return user_id, EVENT_ACTIONS[event_type], product_id, datetime.utcnow()
+
+    def _wake(self, size):
+        if size >= self.batch_size and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def record(self, user_id, event_type, product_id=None):
+        """Queue one event from server-side code; returns False if it was dropped."""
+        row = self._row(user_id, event_type, product_id)
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                return False
+            self._queue.append(row)
+            self.enqueued += 1
+            size = len(self._queue)
+        self._wake(size)
+        return True
+
+    def offer(self, events):
+        """Queue (user_id, event_type, product_id) tuples only if all of them fit."""
+        rows = [self._row(*event) for event in events]
+        with self._lock:
+            if len(self._queue) + len(rows) > self.max_queue:
+                self.overflow += len(rows)
+                return False
+            self._queue.extend(rows)
+            self.enqueued += len(rows)
+            size = len(self._queue)
+        self._wake(size)
+        return True
+
+    def start(self):
+        """Start the flush task; call from the event loop (async startup hook)."""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush task and write out everything still queued."""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._loop = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _take(self):
+        with self._lock:
+            count = min(len(self._queue), self.batch_size)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _requeue(self, batch):
+        with self._lock:
+            room = max(0, self.max_queue - len(self._queue))
+            self.dropped += max(0, len(batch) - room)
+            self._queue.extendleft(reversed(batch[:room]))
+
+    async def flush(self):
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            try:
+                inserted = await run_db(self._write, batch)
+            except Exception as e:
+                # Вернём пачку в начало очереди и попробуем на следующем тике
+                self._requeue(batch)
+                with self._lock:
+                    self.flush_errors += 1
+                logger.error("Error flushing %d events: %s", len(batch), e)
+                return
+            with self._lock:
+                self.flushes += 1
+                self.written += inserted
+                self.rejected += len(batch) - inserted
+
+    @staticmethod
+    def _write(db, batch):
+        buffer = io.StringIO()
+        for user_id, action, product_id, timestamp in batch:
+            buffer.write("%d\t%s\t%s\t%s\n" % (user_id, action, "\\N" if product_id is None else int(product_id),
+                                               timestamp.isoformat()))
+        buffer.seek(0)
+        with db.cursor() as cursor:
+            # Через временную таблицу: одно событие с несуществующим пользователем не валит всю пачку
+            cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS user_logs_staging (
+                    user_id INT, action VARCHAR(255), product_id INT, timestamp TIMESTAMP
+                ) ON COMMIT DELETE ROWS
+            """)
+            cursor.copy_expert("COPY user_logs_staging (user_id, action, product_id, timestamp) FROM STDIN", buffer)
+            cursor.execute("""
+                INSERT INTO user_logs (user_id, action, product_id, timestamp)
+                SELECT s.user_id, s.action, p.id, s.timestamp
+                FROM user_logs_staging s
+                JOIN users u ON u.id = s.user_id
+                LEFT JOIN products p ON p.id = s.product_id
+            """)
+            inserted = cursor.rowcount
+        db.commit()
+        return inserted
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": len(self._queue),
+                "max_queue": self.max_queue,
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "rejected": self.rejected,
+                "dropped": self.dropped,
+                "overflow": self.overflow,
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+            }
+
+
+event_log = EventLog()
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+
+IDEMPOTENCY_KEY_TTL = timedelta(hours=float(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24")))
+IDEMPOTENCY_CACHE_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_CACHE_MAX_ENTRIES", "10000"))
+# Сколько ждать параллельный запрос с тем же ключом в этом же воркере
+IDEMPOTENCY_INFLIGHT_WAIT = float(os.getenv("IDEMPOTENCY_INFLIGHT_WAIT", "30"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+def request_fingerprint(payload) -> str:
+    if hasattr(payload, "model_dump_json"):
+        payload = payload.model_dump_json()
+    elif not isinstance(payload, str):
+        payload = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class IdempotencyGuard:
+    """One idempotent request; see IdempotencyStore.guard()."""
+
+    def __init__(self, store, scope, key, fingerprint, db):
+        self.store = store
+        self.scope = scope
+        self.key = key
+        self.fingerprint = fingerprint
+        self.db = db
+        self.response = None
+        self._saved = None
+        self._event = None
+
+    def __enter__(self):
+        if self.key is None:
+            return self
+        if len(self.key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+        self._event, self.response = self.store._enter(self.scope, self.key)
+        if self.response is None:
+            try:
+                self.response = self._claim()
+            except BaseException:
+                self._exit()
+                raise
+        if self.response is not None:
+            self._exit()
+            self._check_fingerprint(self.response)
+        return self
+
+    def _claim(self):
+        # Вставка ключа блокирует параллельные дубликаты из других воркеров до commit
+        # нашей транзакции; после commit они увидят сохранённый ответ
+        with self.db.cursor() as cursor:
+            while True:
+                cursor.execute("""
+                    INSERT INTO idempotency_keys (scope, key, request_hash, expires_at)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (scope, key) DO NOTHING
+                    RETURNING key
+                """, (self.scope, self.key, self.fingerprint, datetime.utcnow() + self.store.ttl))
+                if cursor.fetchone():
+                    return None
+                cursor.execute("""
+                    SELECT request_hash, status_code, response, expires_at
+                    FROM idempotency_keys WHERE scope = %s AND key = %s
+                """, (self.scope, self.key))
+                row = cursor.fetchone()
+                if row is None:
+                    continue
+                if row["expires_at"] <= datetime.utcnow():
+                    cursor.execute("DELETE FROM idempotency_keys WHERE scope = %s AND key = %s",
+                                   (self.scope, self.key))
+                    continue
+                self.db.rollback()
+                if row["status_code"] is None:
+                    raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress",
+                                        headers={"Retry-After": "1"})
+                stored = (row["request_hash"], row["status_code"], row["response"])
+                self.store._remember(self.scope, self.key, stored)
+                return stored
+
+    def _check_fingerprint(self, stored):
+        if stored[0] != self.fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+
+    def replay(self):
+        _, status_code, body = self.response
+        return JSONResponse(content=body, status_code=status_code, headers={"Idempotent-Replayed": "true"})
+
+    def save(self, cursor, body, status_code=200):
+        """Store the response in the caller's transaction, right before it commits."""
+        if self.key is None:
+            return
+        body = json.loads(json.dumps(body, default=str))
+        cursor.execute(
+            "UPDATE idempotency_keys SET status_code = %s, response = %s WHERE scope = %s AND key = %s",
+            (status_code, json.dumps(body), self.scope, self.key),
+        )
+        self._saved = (self.fingerprint, status_code, body)
+
+    def _exit(self):
+        if self._event is not None:
+            self.store._leave(self.scope, self.key, self._event)
+            self._event = None
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self._saved is not None:
+            self.store._remember(self.scope, self.key, self._saved)
+        self._exit()
+        return False
+
+
+class IdempotencyStore:
+    """Idempotency-Key handling: Postgres table plus an in-memory LRU in front.
+
+    Concurrent duplicates in the same worker wait for the in-flight request;
+    duplicates in other workers wait on the key's row lock in Postgres.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_KEY_TTL, max_entries=IDEMPOTENCY_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._responses = OrderedDict()  # (scope, key) -> (stored, expires_at)
+        self._inflight = {}
+        self.replays = 0
+        self.waits = 0
+
+    def guard(self, scope, key, payload, db):
+        """Context manager for a write endpoint.
+
+        If ``guard.response`` is set after entering, return ``guard.replay()``;
+        otherwise do the work, call ``guard.save(cursor, body)`` and commit.
+        Without a key it does nothing.
+        """
+        return IdempotencyGuard(self, scope, key, request_fingerprint(payload), db)
+
+    def _enter(self, scope, key):
+        while True:
+            with self._lock:
+                item = self._responses.get((scope, key))
+                if item is not None and item[1] > time.monotonic():
+                    self._responses.move_to_end((scope, key))
+                    self.replays += 1
+                    return None, item[0]
+                event = self._inflight.get((scope, key))
+                if event is None:
+                    event = threading.Event()
+                    self._inflight[(scope, key)] = event
+                    return event, None
+                self.waits += 1
+            if not event.wait(IDEMPOTENCY_INFLIGHT_WAIT):
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress",
+                                    headers={"Retry-After": "1"})
+
+    def _leave(self, scope, key, event):
+        with self._lock:
+            if self._inflight.get((scope, key)) is event:
+                del self._inflight[(scope, key)]
+        event.set()
+
+    def _remember(self, scope, key, stored):
+        with self._lock:
+            self._responses[(scope, key)] = (stored, time.monotonic() + self.ttl.total_seconds())
+            self._responses.move_to_end((scope, key))
+            while len(self._responses) > self.max_entries:
+                self._responses.popitem(last=False)
+
+    def purge_expired(self, db):
+        with db.cursor() as cursor:
+            cursor.execute("DELETE FROM idempotency_keys WHERE expires_at <= %s", (datetime.utcnow(),))
+        db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._responses),
+                "inflight": len(self._inflight),
+                "replays": self.replays,
+                "waits": self.waits,
+            }
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,211 @@
+"""Online scoring with the user recommender, micro-batched.
+
+POST /recommendations/score asks for one user's scores of a few products
+(re-ranking a page, the cart or search results). Concurrent requests are
+queued and scored together: the batcher waits for INFERENCE_BATCH_MAX
+requests or INFERENCE_BATCH_WAIT_MS after the first one, concatenates all
+(user row, item row) pairs and runs a single forward pass in a worker thread.
+The model is the directory written by ml/export_model.py, memory-mapped by
+ncf.NCFModel, so workers share one copy in the page cache and never import
+TensorFlow.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from ncf import NCFModel
+
+
+NCF_MODEL_DIR = os.getenv("NCF_MODEL_DIR", "model_rec_user")
+INFERENCE_BATCH_MAX = int(os.getenv("INFERENCE_BATCH_MAX", "64"))
+INFERENCE_BATCH_WAIT_MS = float(os.getenv("INFERENCE_BATCH_WAIT_MS", "2"))
+INFERENCE_MAX_PRODUCTS = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class ModelMissing(Exception):
+    pass
+
+
+class UnknownUser(Exception):
+    pass
+
+
+class InferenceBatcher:
+    """Scores (user, products) requests through one NCFModel, many requests per forward pass.
+
+    score() is called from the event loop; a background task started by
+    start() collects the queued requests into batches.
+    """
+
+    def __init__(self, path=NCF_MODEL_DIR, max_batch=INFERENCE_BATCH_MAX, wait_ms=INFERENCE_BATCH_WAIT_MS):
+        self.path = path
+        self.max_batch = max_batch
+        self.wait = wait_ms / 1000
+        self._lock = threading.Lock()
+        self._model = None
+        self._product_rows = {}  # product_id -> строка item_embedding
+        self._pending = []  # [(model, user_row, item_rows, future)]
+        self._arrived = None
+        self._full = None
+        self._task = None
+        self._stopping = False
+        self.requests = 0
+        self.batches = 0
+        self.pairs = 0
+        self.max_batch_seen = 0
+        self.busy_seconds = 0.0
+
+    def set_model(self, model, product_rows):
+        with self._lock:
+            self._model = model
+            self._product_rows = product_rows
+
+    def load(self, db):
+        """Map the model at self.path and match its items to products by attributes->>'item_id'."""
+        if not os.path.exists(os.path.join(self.path, "meta.json")):
+            raise ModelMissing(f"No recommender model at {self.path}")
+        model = NCFModel.load(self.path)
+        with db.cursor() as cursor:
+            cursor.execute("SELECT id, attributes->>'item_id' AS item_id FROM products WHERE attributes ? 'item_id'")
+            products = cursor.fetchall()
+        db.rollback()
+        product_rows = {}
+        for row in products:
+            if not row["item_id"].isdigit():
+                continue
+            item_id = int(row["item_id"])
+            if model.item_index is not None:
+                item_row = model.item_index.get(item_id)
+            else:
+                item_row = item_id if item_id < model.num_items else None
+            if item_row is not None:
+                product_rows[row["id"]] = item_row
+        self.set_model(model, product_rows)
+        logger.info("Recommender model: %d users x %d items, %d matched to products, from %s",
+                    model.user_embedding.shape[0], model.num_items, len(product_rows), self.path)
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def start(self):
+        """Start the batching task; call from the event loop (async startup hook)."""
+        if self._task is None:
+            self._arrived = asyncio.Event()
+            self._full = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Score what is still queued and stop the batching task."""
+        if self._task is not None:
+            self._stopping = True
+            self._arrived.set()
+            await self._task
+            self._task = None
+
+    def _user_row(self, model, user_id):
+        if model.user_index is not None:
+            row = model.user_index.get(user_id)
+        else:
+            row = user_id if 0 <= user_id < model.user_embedding.shape[0] else None
+        if row is None:
+            raise UnknownUser(f"User {user_id} is not known to the recommender model")
+        return row
+
+    async def score(self, user_id, product_ids):
+        """[(product_id, score or None)] for the user, None for products the model does not know."""
+        model, product_rows = self._model, self._product_rows
+        if model is None:
+            raise ModelMissing(f"No recommender model at {self.path}")
+        user_row = self._user_row(model, user_id)
+        known = [(i, product_rows[product_id]) for i, product_id in enumerate(product_ids) if product_id in product_rows]
+        scores = [None] * len(product_ids)
+        if known:
+            item_rows = np.array([row for _, row in known], dtype=np.int64)
+            if self._task is None:
+                # Без запущенной задачи (скрипты, тесты) — без пакетирования
+                result = await run_in_threadpool(model.score, np.full(len(item_rows), user_row), item_rows)
+            else:
+                future = asyncio.get_running_loop().create_future()
+                self._pending.append((model, user_row, item_rows, future))
+                self._arrived.set()
+                if len(self._pending) >= self.max_batch:
+                    self._full.set()
+                result = await future
+            for (i, _), value in zip(known, result.tolist()):
+                scores[i] = value
+        return list(zip(product_ids, scores))
+
+    async def _run(self):
+        while not (self._stopping and not self._pending):
+            await self._arrived.wait()
+            if not self._stopping and len(self._pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.wait)
+                except asyncio.TimeoutError:
+                    pass
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            self._full.clear()
+            if not self._pending:
+                self._arrived.clear()
+            if batch:
+                await self._score_batch(batch)
+
+    async def _score_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            # Пакет собирается из запросов к одной модели; после перезагрузки старые дорабатываются отдельно
+            groups = {}
+            for request in batch:
+                groups.setdefault(id(request[0]), []).append(request)
+            for requests in groups.values():
+                model = requests[0][0]
+                users = np.concatenate([np.full(len(items), user_row, dtype=np.int64) for _, user_row, items, _ in requests])
+                items = np.concatenate([items for _, _, items, _ in requests])
+                scores = await run_in_threadpool(model.score, users, items)
+                start = 0
+                for _, _, request_items, future in requests:
+                    if not future.done():
+                        future.set_result(scores[start:start + len(request_items)])
+                    start += len(request_items)
+        except Exception as e:
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        with self._lock:
+            self.requests += len(batch)
+            self.batches += 1
+            self.pairs += sum(len(items) for _, _, items, _ in batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.busy_seconds += time.perf_counter() - started
+
+    def stats(self):
+        with self._lock:
+            model = self._model
+            return {
+                "loaded": model is not None,
+                "path": self.path,
+                "users": None if model is None else int(model.user_embedding.shape[0]),
+                "items": None if model is None else int(model.num_items),
+                "products": len(self._product_rows),
+                "max_batch": self.max_batch,
+                "wait_ms": self.wait * 1000,
+                "queued": len(self._pending),
+                "requests": self.requests,
+                "batches": self.batches,
+                "pairs": self.pairs,
+                "mean_batch": round(self.requests / self.batches, 2) if self.batches else 0,
+                "max_batch_seen": self.max_batch_seen,
+                "busy_seconds": round(self.busy_seconds, 6),
+            }
+
+
+inference = InferenceBatcher()
@@ -0,0 +1,34 @@
+import atexit
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener = None
+
+
+def configure_logging(level=LOG_LEVEL):
+    """Send log records through a queue to a stderr writer thread.
+
+    Handlers run on the listener's thread, so logging from a coroutine only
+    puts the record on a queue and never blocks the event loop on I/O.
+    Calling it again only changes the level.
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    records = queue.SimpleQueue()
+    root.addHandler(QueueHandler(records))
+    _listener = QueueListener(records, handler, respect_handler_level=True)
+    _listener.start()
+    # Остановка дописывает оставшиеся в очереди записи
+    atexit.register(_listener.stop)
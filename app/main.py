@@ -1,75 +1,128 @@
-from fastapi import FastAPI, Depends, HTTPException, status
-from pydantic import BaseModel
-from passlib.context import CryptContext
+from fastapi import FastAPI, Depends, Header, HTTPException, Path, Query, Request, Response, status
+from pydantic import BaseModel, Field, TypeAdapter
 from datetime import datetime, timedelta
+import base64
+import json
+import logging
 import os
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+import time
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from anyio import from_thread
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Optional, Dict, List
-
+from typing import Optional, Dict, List, Union
+
+from admission import AdmissionMiddleware, admission
+from auth_cache import auth_cache
+from cache import CacheEntry, catalog_cache
+from catalog_io import CATALOG_KINDS, CatalogImportError, ChunkReader, import_stream, stream_export
+from categories import category_tree
+from db import DATABASE_URL, PoolTimeout, get_db, get_read_db, pool, replicas, run_db
+from events import EVENT_TYPE_PATTERN, EVENTS_MAX_PER_REQUEST, event_log
+from idempotency import idempotency_store
+from inference import INFERENCE_MAX_PRODUCTS, ModelMissing, UnknownUser, inference
+from logs import configure_logging
+from metrics import PROMETHEUS_CONTENT_TYPE, MetricsMiddleware, metrics
+from migrate import check_schema, pending_migrations, upgrade
+from passwords import PasswordHasherBusy, password_hasher
+from recommendations import POPULAR_USER_ID, RECOMMENDATIONS_TOP_K
+from reservations import hold_until, reservation_sweeper
+from seller_forecasts import SELLER_FORECAST_TOP_K
+from serialization import GZIP_LEVEL, GZIP_MIN_SIZE, encode_rows, rows_response
+from similarity import SimilarityIndexMissing, similarity_index
+from static_pages import static_files
+
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+# Внутри CORS: отказы 503/429 тоже получают CORS-заголовки
+app.add_middleware(AdmissionMiddleware, routes=app.router.routes)
+admission.assign("auth", ("POST", "/login"), ("POST", "/register"))
+admission.assign("checkout", ("POST", "/purchase"), ("POST", "/orders"))
+admission.assign("catalog", ("GET", "/products"), ("GET", "/products/search"),
+                 ("GET", "/categories/{category_id}/products"))
+admission.assign("bulk", ("POST", "/admin/{kind}/import"), ("GET", "/admin/{kind}/export"))
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  
     allow_credentials=True,
     allow_methods=["*"],  
     allow_headers=["*"],  
+    expose_headers=["X-Next-Cursor", "ETag", "Last-Modified"],
 )
+# Ответы с Content-Encoding (уже сжатые страницы из static_pages) middleware пропускает
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
+# Последний добавленный — внешний: время включает сжатие и CORS
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": "Database is busy, try again later"},
+                        headers={"Retry-After": "1"})
+
+
+@app.exception_handler(PasswordHasherBusy)
+def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(status_code=503, content={"detail": "Password service is busy, try again later"},
+                        headers={"Retry-After": "1"})
+
+
+@app.exception_handler(SimilarityIndexMissing)
+def similarity_index_missing_handler(request: Request, exc: SimilarityIndexMissing):
+    return JSONResponse(status_code=503, content={"detail": "Similarity index is not built"})
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+
+@app.exception_handler(ModelMissing)
+def model_missing_handler(request: Request, exc: ModelMissing):
+    return JSONResponse(status_code=503, content={"detail": "Recommender model is not loaded"})
+
+catalog_cache.on_remote_invalidate(category_tree.invalidate)
+catalog_cache.on_remote_invalidate(auth_cache.handle_remote_invalidate)
+
+# Страницы и /static отдаются из памяти: файлы читаются и сжимаются один раз при старте
+@app.api_route("/static/{name:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def read_static(name: str, request: Request):
+    return static_files.response(request, name)
 
 @app.get("/", response_class=HTMLResponse)
-async def read_root():
-    with open("static/index.html", "r") as file:
-        return file.read()
+async def read_root(request: Request):
+    return static_files.response(request, "index.html")
 
 @app.get("/login", response_class=HTMLResponse)
-async def read_login():
-    with open("static/login.html", "r") as file:
-        return file.read()
-    
+async def read_login(request: Request):
+    return static_files.response(request, "login.html")
+
 @app.get("/shop", response_class=HTMLResponse)
-async def read_shop():
-    with open("static/shop.html", "r") as file:
-        return file.read()
-    
+async def read_shop(request: Request):
+    return static_files.response(request, "shop.html")
+
 @app.get("/recommended", response_class=HTMLResponse)
-async def read_recommended():
-    with open("static/recommended.html", "r") as file:
-        return file.read()
-    
+async def read_recommended(request: Request):
+    return static_files.response(request, "recommended.html")
+
 @app.get("/checkout", response_class=HTMLResponse)
-async def read_checkout():
-    with open("static/checkout.html", "r") as file:
-        return file.read()
+async def read_checkout(request: Request):
+    return static_files.response(request, "checkout.html")
 
 @app.get("/thank-you", response_class=HTMLResponse)
-async def read_thank_you():
-    with open("static/thank-you.html", "r") as file:
-        return file.read()
+async def read_thank_you(request: Request):
+    return static_files.response(request, "thank-you.html")
 
-def get_db():
-    conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-    try:
-        yield conn
-    finally:
-        conn.close()
 
-
-DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:password@db/shop")
 SECRET_KEY = os.getenv("SECRET_KEY", "secret_key")  
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Применять недостающие миграции при старте воркера (иначе — отказ стартовать)
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 class UserCreate(BaseModel):
@@ -103,6 +156,12 @@ class CategoryResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class CategoryTreeNode(BaseModel):
+    id: int
+    name: str
+    parent_id: Optional[int]
+    children: List["CategoryTreeNode"] = []
+
 class ProductCreate(BaseModel):
     name: str
     description: Optional[str] = None
@@ -124,9 +183,34 @@ class ProductResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class SimilarProductResponse(ProductResponse):
+    similarity: float
+
+class ProductAvailability(BaseModel):
+    product_id: int
+    stock: int
+    reserved: int
+    available: int
+
+class ProductSearchResult(ProductResponse):
+    score: float
+
+class FacetValue(BaseModel):
+    value: Union[int, str]
+    count: int
+
+class SearchFacets(BaseModel):
+    category_id: List[FacetValue]
+    attributes: Dict[str, List[FacetValue]]
+
+class ProductSearchResponse(BaseModel):
+    items: List[ProductSearchResult]
+    total: Optional[int] = None
+    facets: Optional[SearchFacets] = None
+
 class CartItemCreate(BaseModel):
     product_id: int
-    quantity: int
+    quantity: int = Field(gt=0)
 
 from pydantic import Field
 
@@ -137,10 +221,25 @@ class CartItemResponse(BaseModel):
     quantity: int
     name: str
     price: float
+    reservedUntil: Optional[datetime] = Field(None, alias='reserved_until')
 
     class Config:
         from_attributes = True
 
+class CartSummaryLine(BaseModel):
+    id: int
+    product_id: int
+    name: str
+    price: float
+    quantity: int
+    line_total: float
+    in_stock: bool
+
+class CartSummaryResponse(BaseModel):
+    items: List[CartSummaryLine]
+    item_count: int
+    total: float
+
 class OrderCreate(BaseModel):
     user_id: int
     total_amount: float
@@ -168,6 +267,51 @@ class OrderItemResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class SellerForecastItem(BaseModel):
+    rank: int
+    item_id: int
+    product_id: Optional[int]
+    name: Optional[str]
+    predicted: float
+    stock: Optional[int]
+
+class RestockSuggestion(BaseModel):
+    rank: int
+    item_id: int
+    product_id: int
+    name: str
+    predicted: float
+    stock: int
+    shortfall: int
+
+
+category_list_adapter = TypeAdapter(List[CategoryResponse])
+category_tree_adapter = TypeAdapter(List[CategoryTreeNode])
+product_list_adapter = TypeAdapter(List[ProductResponse])
+search_response_adapter = TypeAdapter(ProductSearchResponse)
+similar_products_adapter = TypeAdapter(List[SimilarProductResponse])
+cart_items_adapter = TypeAdapter(List[CartItemResponse])
+seller_forecast_adapter = TypeAdapter(List[SellerForecastItem])
+restock_suggestions_adapter = TypeAdapter(List[RestockSuggestion])
+
+
+class ProductScoreRequest(BaseModel):
+    user_id: int
+    product_ids: List[int] = Field(min_length=1, max_length=INFERENCE_MAX_PRODUCTS)
+
+
+class ProductScore(BaseModel):
+    product_id: int
+    score: Optional[float]
+
+
+product_scores_adapter = TypeAdapter(List[ProductScore])
+
+
+class EventCreate(BaseModel):
+    user_id: int
+    type: str = Field(pattern=EVENT_TYPE_PATTERN)
+    product_id: Optional[int] = None
 
 class PaymentInfo(BaseModel):
     pan: str  
@@ -177,98 +321,195 @@ class PaymentInfo(BaseModel):
     total_amount: float  
 
 
-@app.post("/register", response_model=UserResponse)
-def register_user(user: UserCreate, db: psycopg2.extensions.connection = Depends(get_db)):
-    hashed_password = pwd_context.hash(user.password)
-    email = user.email.lower()
+def insert_user(db: psycopg2.extensions.connection, name: str, email: str, hashed_password: str):
     with db.cursor() as cursor:
         cursor.execute(
             "INSERT INTO users (name, email, password, role) VALUES (%s, %s, %s, 'покупатель') RETURNING id, name, email, role, created_at",
-            (user.name, email, hashed_password),
+            (name, email, hashed_password),
         )
         new_user = cursor.fetchone()
         db.commit()
-        return new_user
+    replicas.note_write(new_user["id"])
+    return new_user
 
 
-@app.post("/login")
-def login_user(user: UserLogin, db: psycopg2.extensions.connection = Depends(get_db)):
-    email = user.email.lower()
+def find_user_by_email(db: psycopg2.extensions.connection, email: str):
     with db.cursor() as cursor:
         cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
-        db_user = cursor.fetchone()
-        if not db_user or not pwd_context.verify(user.password, db_user["password"]):
+        return cursor.fetchone()
+
+
+@app.post("/register", response_model=UserResponse)
+async def register_user(user: UserCreate):
+    hashed_password = await password_hasher.hash(user.password)
+    email = user.email.lower()
+    return await run_db(insert_user, user.name, email, hashed_password)
+
+
+@app.post("/login")
+async def login_user(user: UserLogin, request: Request):
+    email = user.email.lower()
+    client_ip = request.client.host if request.client else "unknown"
+    with password_hasher.limit(client_ip, email):
+        db_user = await run_db(find_user_by_email, email)
+        if not db_user:
+            # Неизвестный email: ждём столько же, сколько занял бы bcrypt, но без нагрузки на CPU
+            await password_hasher.reject_unknown()
+            raise HTTPException(status_code=400, detail="Incorrect email or password")
+        if not await password_hasher.verify(user.password, db_user["password"]):
             raise HTTPException(status_code=400, detail="Incorrect email or password")
         
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": db_user["email"]}, expires_delta=access_token_expires
+            data={"sub": db_user["email"], "uid": db_user["id"]}, expires_delta=access_token_expires
         )
+        auth_cache.put_user(db_user)
         return {"access_token": access_token, "token_type": "bearer", "user_id": db_user["id"]}
 
 
-@app.post("/purchase")
-async def create_purchase(payment_info: PaymentInfo, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/purchase")
-    try:
-        expiration_date = payment_info.expiration_date
-        if not expiration_date or len(expiration_date) != 5 or expiration_date[2] != '/':
-            raise HTTPException(status_code=400, detail="Invalid expiration date format. Use MM/YY.")
-
-        with db.cursor() as cursor:
-            cursor.execute(
-                "INSERT INTO orders (user_id, total_amount, status, payment_id, created_at) "
-                "VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                (payment_info.user_id, payment_info.total_amount, 'в обработке', f"payment_{payment_info.pan[-4:]}", datetime.utcnow()),
-            )
-            order_id = cursor.fetchone()["id"]
-
-            cursor.execute("""
-                SELECT ci.product_id, ci.quantity, p.price
-                FROM cart_items ci
-                JOIN cart c ON ci.cart_id = c.id
-                JOIN products p ON ci.product_id = p.id
-                WHERE c.user_id = %s
-            """, (payment_info.user_id,))
-            cart_items = cursor.fetchall()
-
-            for item in cart_items:
-                cursor.execute(
-                    "INSERT INTO order_items (order_id, product_id, quantity, price) "
-                    "VALUES (%s, %s, %s, %s)",
-                    (order_id, item["product_id"], item["quantity"], item["price"]),
-                )
-
-            cursor.execute("DELETE FROM cart_items WHERE cart_id IN (SELECT id FROM cart WHERE user_id = %s)", (payment_info.user_id,))
+# Корзина уже заблокирована (LOCK_CART_SQL), так что её строки и их удержания не меняются до конца транзакции
+CHECKOUT_SQL = """
+    WITH cart_lines AS (
+        SELECT product_id, quantity, reserved AS held
+        FROM cart_items
+        WHERE cart_id = %(cart_id)s
+    ),
+    -- Блокируем строки товаров в порядке id, чтобы параллельные покупки не взаимоблокировались
+    locked AS (
+        SELECT p.id, p.price, p.stock, p.reserved, cl.quantity, cl.held
+        FROM products p
+        JOIN cart_lines cl ON cl.product_id = p.id
+        ORDER BY p.id
+        FOR UPDATE OF p
+    ),
+    -- Покупателю доступно своё удержание плюс то, что не удержано никем
+    checked AS (
+        SELECT count(*) AS lines,
+               count(*) > 0 AND bool_and(stock - reserved + held >= quantity) AS ok,
+               COALESCE(SUM(price * quantity), 0) AS total_amount
+        FROM locked
+    ),
+    -- Удержание превращается в продажу: списывается и со склада, и из счётчика удержаний
+    updated AS (
+        UPDATE products p
+        SET stock = p.stock - l.quantity, reserved = p.reserved - l.held
+        FROM locked l, checked
+        WHERE p.id = l.id AND checked.ok
+    ),
+    new_order AS (
+        INSERT INTO orders (user_id, total_amount, status, payment_id, created_at)
+        SELECT %(user_id)s, total_amount, 'в обработке', %(payment_id)s, %(created_at)s
+        FROM checked
+        WHERE ok
+        RETURNING id
+    ),
+    new_items AS (
+        INSERT INTO order_items (order_id, product_id, quantity, price)
+        SELECT o.id, l.id, l.quantity, l.price
+        FROM new_order o CROSS JOIN locked l
+    ),
+    cleared AS (
+        DELETE FROM cart_items
+        WHERE cart_id = %(cart_id)s
+          AND EXISTS (SELECT 1 FROM new_order)
+    )
+    SELECT (SELECT id FROM new_order) AS order_id,
+           checked.lines,
+           checked.total_amount,
+           ARRAY(SELECT id FROM locked WHERE stock - reserved + held < quantity ORDER BY id) AS insufficient
+    FROM checked
+"""
 
-            db.commit()
 
-        return {"detail": "Purchase successful!", "order_id": order_id}
-    except Exception as e:
-        db.rollback()
-        print(f"Error creating purchase: {e}")
-        raise HTTPException(status_code=500, detail="An error occurred while processing the purchase.")
+@app.post("/purchase")
+def create_purchase(payment_info: PaymentInfo, db: psycopg2.extensions.connection = Depends(get_db),
+                    idempotency_key: Optional[str] = Header(None)):
+    expiration_date = payment_info.expiration_date
+    if not expiration_date or len(expiration_date) != 5 or expiration_date[2] != '/':
+        raise HTTPException(status_code=400, detail="Invalid expiration date format. Use MM/YY.")
+
+    with idempotency_store.guard(f"purchase:{payment_info.user_id}", idempotency_key, payment_info, db) as guard:
+        if guard.response is not None:
+            return guard.replay()
+        try:
+            with db.cursor() as cursor:
+                cursor.execute(LOCK_CART_SQL, (payment_info.user_id,))
+                cart = cursor.fetchone()
+                # Вся покупка — один запрос: проверка и списание остатков, заказ, позиции и очистка корзины
+                cursor.execute(CHECKOUT_SQL, {
+                    "user_id": payment_info.user_id,
+                    "cart_id": cart["id"] if cart else None,
+                    "payment_id": f"payment_{payment_info.pan[-4:]}",
+                    "created_at": datetime.utcnow(),
+                })
+                result = cursor.fetchone()
+                if result["order_id"] is None:
+                    db.rollback()
+                else:
+                    response = {
+                        "detail": "Purchase successful!",
+                        "order_id": result["order_id"],
+                        "total_amount": float(result["total_amount"]),
+                    }
+                    guard.save(cursor, response)
+                    catalog_cache.notify(cursor, "products")
+                    db.commit()
+                    replicas.note_write(payment_info.user_id)
+        except Exception as e:
+            db.rollback()
+            logger.exception("Error creating purchase")
+            raise HTTPException(status_code=500, detail="An error occurred while processing the purchase.")
+
+        if result["lines"] == 0:
+            raise HTTPException(status_code=400, detail="Cart is empty")
+        if result["order_id"] is None:
+            raise HTTPException(status_code=409, detail={
+                "message": "Insufficient stock",
+                "product_ids": result["insufficient"],
+            })
+    catalog_cache.invalidate("products")
+    event_log.record(payment_info.user_id, "purchase")
+    return response
     
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: psycopg2.extensions.connection = Depends(get_db)):
+def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+    payload = auth_cache.get_claims(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    with db.cursor() as cursor:
-        cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
-        user = cursor.fetchone()
-        if user is None:
+        if payload.get("sub") is None:
             raise credentials_exception
+        auth_cache.put_claims(token, payload)
+    # Старые токены без uid ищутся по email
+    user_id = payload.get("uid")
+    email: str = payload.get("sub")
+    user = auth_cache.get_user(user_id=user_id, email=email)
+    if user is not None:
         return user
+    with pool.connection() as db:
+        with db.cursor() as cursor:
+            if user_id is not None:
+                cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
+            else:
+                cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
+            user = cursor.fetchone()
+    if user is None:
+        raise credentials_exception
+    auth_cache.put_user(user)
+    return user
+
+
+def require_admin(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "администратор":
+        raise HTTPException(status_code=403, detail="Administrator role required")
+    return current_user
 
 
 @app.get("/users/me", response_model=UserResponse)
@@ -276,8 +517,7 @@ def get_current_user(current_user: dict = Depends(get_current_user)):
     return current_user
 
 @app.get("/users/{user_id}", response_model=UserResponse)
-def read_user(user_id: int, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/users")
+def read_user(user_id: int, db: psycopg2.extensions.connection = Depends(get_read_db)):
     with db.cursor() as cursor:
         cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
         user = cursor.fetchone()
@@ -288,28 +528,43 @@ def read_user(user_id: int, db: psycopg2.extensions.connection = Depends(get_db)
 
 @app.post("/categories", response_model=CategoryResponse)
 def create_category(category: CategoryCreate, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/categories create")
     with db.cursor() as cursor:
         cursor.execute(
             "INSERT INTO categories (name, parent_id) VALUES (%s, %s) RETURNING id, name, parent_id",
             (category.name, category.parent_id),
         )
         new_category = cursor.fetchone()
+        catalog_cache.notify(cursor, "categories")
         db.commit()
-        return new_category
+    # Сначала дерево: запрос между двумя вызовами иначе закэшировал бы дерево без новой категории
+    category_tree.add(new_category)
+    catalog_cache.invalidate("categories")
+    return new_category
     
 
+def load_categories():
+    with replicas.connection(catalog_cache.invalidated_at("categories")) as db:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT * FROM categories")
+            categories = cursor.fetchall()
+    return CacheEntry(category_list_adapter.dump_json(category_list_adapter.validate_python(categories)))
+
+
 @app.get("/categories", response_model=List[CategoryResponse])
-def get_categories(db: psycopg2.extensions.connection = Depends(get_db)):
-    with db.cursor() as cursor:
-        cursor.execute("SELECT * FROM categories")
-        categories = cursor.fetchall()
-        return categories
+def get_categories(request: Request):
+    return catalog_cache.get_or_load("categories", "", load_categories).to_response(request)
+
+
+@app.get("/categories/tree", response_model=List[CategoryTreeNode])
+def get_category_tree(request: Request):
+    def load_tree():
+        return CacheEntry(category_tree_adapter.dump_json(category_tree_adapter.validate_python(category_tree.tree())))
+
+    return catalog_cache.get_or_load("categories", "tree", load_tree).to_response(request)
 
 
 @app.post("/products", response_model=ProductResponse)
 def create_product(product: ProductCreate, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/products create")
     with db.cursor() as cursor:
         cursor.execute(
             "INSERT INTO products (name, description, price, stock, category_id, attributes, created_at) "
@@ -317,122 +572,783 @@ def create_product(product: ProductCreate, db: psycopg2.extensions.connection =
             (product.name, product.description, product.price, product.stock, product.category_id, product.attributes, datetime.utcnow()),
         )
         new_product = cursor.fetchone()
+        catalog_cache.notify(cursor, "products")
         db.commit()
-        return new_product
+    catalog_cache.invalidate("products")
+    return new_product
     
 
+CATALOG_KIND_PATTERN = "^(%s)$" % "|".join(CATALOG_KINDS)
+CATALOG_MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+@app.post("/admin/{kind}/import")
+async def import_catalog(
+    request: Request,
+    kind: str = Path(pattern=CATALOG_KIND_PATTERN),
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    on_error: str = Query("abort", pattern="^(abort|skip)$"),
+    admin: dict = Depends(require_admin),
+):
+    """Upsert products or categories by name from a CSV (with header) or NDJSON request body."""
+    body = request.stream()
+
+    async def next_chunk():
+        try:
+            return await body.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def chunks():
+        # COPY читает тело запроса по частям прямо из потока воркера, без временного файла
+        while True:
+            chunk = from_thread.run(next_chunk)
+            if chunk is None:
+                return
+            yield chunk
+
+    try:
+        report = await run_db(import_stream, kind, format, ChunkReader(chunks()), on_error)
+    except CatalogImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not report["committed"]:
+        raise HTTPException(status_code=422, detail=report)
+    if kind == "categories":
+        category_tree.invalidate("categories")
+    catalog_cache.invalidate(kind)
+    return report
+
+
+@app.get("/admin/{kind}/export")
+def export_catalog(
+    kind: str = Path(pattern=CATALOG_KIND_PATTERN),
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    admin: dict = Depends(require_admin),
+):
+    return StreamingResponse(stream_export(kind, format), media_type=CATALOG_MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"'})
+
+
+PRODUCTS_PAGE_LIMIT = 100
+PRODUCTS_MAX_PAGE_LIMIT = 1000
+PRODUCTS_STREAM_ITERSIZE = 2000
+
+# price::float8: строки сериализуются как есть (serialization.py), без Decimal
+PRODUCT_COLUMNS = "id, name, description, price::float8 AS price, stock, category_id, attributes, created_at"
+
+PRODUCT_JSON_SQL = """
+    json_build_object(
+        'id', id, 'name', name, 'description', description, 'price', price::float8,
+        'stock', stock, 'category_id', category_id, 'attributes', attributes, 'created_at', created_at
+    )::text AS line
+"""
+
+
+def encode_products_cursor(row: dict, order_by: str) -> str:
+    if order_by == "created_at":
+        raw = f"{row['created_at'].isoformat()}|{row['id']}"
+    elif order_by == "score":
+        raw = f"{row['score']!r}|{row['id']}"
+    else:
+        raw = str(row["id"])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_products_cursor(cursor: str, order_by: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        if order_by == "created_at":
+            created_at, product_id = raw.rsplit("|", 1)
+            return datetime.fromisoformat(created_at), int(product_id)
+        if order_by == "score":
+            score, product_id = raw.rsplit("|", 1)
+            return float(score), int(product_id)
+        return int(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def build_products_query(select_sql: str, order_by: str, cursor: Optional[str], category_id: Optional[int],
+                         min_price: Optional[float], max_price: Optional[float], attr: Optional[List[str]],
+                         limit: Optional[int], category_ids: Optional[List[int]] = None):
+    """Build a keyset-paginated products query."""
+    conditions = []
+    params = []
+    if cursor:
+        if order_by == "created_at":
+            conditions.append("(created_at, id) > (%s, %s)")
+            params.extend(decode_products_cursor(cursor, order_by))
+        else:
+            conditions.append("id > %s")
+            params.append(decode_products_cursor(cursor, order_by))
+    filters, filter_params = product_filter_conditions(category_id, min_price, max_price, attr, category_ids)
+    conditions.extend(filters)
+    params.extend(filter_params)
+
+    query = f"SELECT {select_sql} FROM products"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY created_at, id" if order_by == "created_at" else " ORDER BY id"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+
+def product_filter_conditions(category_id: Optional[int], min_price: Optional[float], max_price: Optional[float],
+                              attr: Optional[List[str]], category_ids: Optional[List[int]] = None):
+    """WHERE conditions and params for the catalog filters.
+
+    ``attr`` items are either ``key`` (attribute present) or ``key:value``
+    (attribute equals value), both of which can use a GIN index on attributes.
+    """
+    conditions = []
+    params = []
+    if category_id is not None:
+        conditions.append("category_id = %s")
+        params.append(category_id)
+    if category_ids is not None:
+        conditions.append("category_id = ANY(%s)")
+        params.append(category_ids)
+    if min_price is not None:
+        conditions.append("price >= %s")
+        params.append(min_price)
+    if max_price is not None:
+        conditions.append("price <= %s")
+        params.append(max_price)
+    if attr:
+        values = {}
+        keys = []
+        for item in attr:
+            key, sep, value = item.partition(":")
+            if sep:
+                values[key] = value
+            else:
+                keys.append(key)
+        if values:
+            conditions.append("attributes @> %s::jsonb")
+            params.append(json.dumps(values, ensure_ascii=False))
+        if keys:
+            conditions.append("attributes ?& %s")
+            params.append(keys)
+    return conditions, params
+
+
+def get_catalog_read_db():
+    """Read connection for uncached catalog queries: a replica only if it has the last products change."""
+    with replicas.connection(catalog_cache.invalidated_at("products")) as db:
+        yield db
+
+
+def stream_products_ndjson(query: str, params: list):
+    # Именованный (серверный) курсор: строки приходят пачками по itersize,
+    # и в памяти никогда не лежит весь каталог
+    with replicas.connection(catalog_cache.invalidated_at("products")) as db:
+        with db.cursor(name="products_stream") as cursor:
+            cursor.itersize = PRODUCTS_STREAM_ITERSIZE
+            cursor.execute(query, params)
+            for row in cursor:
+                yield row["line"] + "\n"
+
+
 @app.get("/products", response_model=List[ProductResponse])
-def get_products(db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/products")
+def get_products(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    order_by: str = Query("id", pattern="^(id|created_at)$"),
+    category_id: Optional[int] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    attr: Optional[List[str]] = Query(None),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    if format == "ndjson":
+        # В потоковом режиме без limit отдаётся весь каталог после cursor
+        query, params = build_products_query(PRODUCT_JSON_SQL, order_by, cursor, category_id,
+                                             min_price, max_price, attr, limit)
+        return StreamingResponse(stream_products_ndjson(query, params), media_type="application/x-ndjson")
+
+    limit = min(limit or PRODUCTS_PAGE_LIMIT, PRODUCTS_MAX_PAGE_LIMIT)
+
+    def load_products():
+        query, params = build_products_query(PRODUCT_COLUMNS, order_by, cursor, category_id, min_price, max_price, attr,
+                                             limit + 1)
+        with replicas.connection(catalog_cache.invalidated_at("products")) as db:
+            with db.cursor() as db_cursor:
+                db_cursor.execute(query, params)
+                products = db_cursor.fetchall()
+        headers = {}
+        if len(products) > limit:
+            products = products[:limit]
+            headers["X-Next-Cursor"] = encode_products_cursor(products[-1], order_by)
+        return CacheEntry(encode_rows(products, product_list_adapter), headers)
+
+    cache_key = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    return catalog_cache.get_or_load("products", cache_key, load_products).to_response(request)
+
+
+@app.get("/categories/{category_id}/products", response_model=List[ProductResponse])
+def get_category_products(
+    category_id: int,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    order_by: str = Query("id", pattern="^(id|created_at)$"),
+    db: psycopg2.extensions.connection = Depends(get_catalog_read_db),
+):
+    """Products of the category and all of its subcategories."""
+    subtree = category_tree.subtree_ids(category_id)
+    if subtree is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    limit = min(limit or PRODUCTS_PAGE_LIMIT, PRODUCTS_MAX_PAGE_LIMIT)
+    query, params = build_products_query(PRODUCT_COLUMNS, order_by, cursor, None, None, None, None, limit + 1, subtree)
+    with db.cursor() as db_cursor:
+        db_cursor.execute(query, params)
+        products = db_cursor.fetchall()
+    headers = {}
+    if len(products) > limit:
+        products = products[:limit]
+        headers["X-Next-Cursor"] = encode_products_cursor(products[-1], order_by)
+    return rows_response(products, product_list_adapter, headers)
+
+
+SEARCH_PAGE_LIMIT = 20
+SEARCH_MAX_PAGE_LIMIT = 100
+SEARCH_FACET_VALUES = 10
+# Слова по словоформам (russian) и как есть (simple); триграммы ловят опечатки в названии
+SEARCH_TSQUERY_SQL = "(websearch_to_tsquery('russian', %s) || websearch_to_tsquery('simple', %s))"
+SEARCH_MATCH_SQL = f"(search_vector @@ {SEARCH_TSQUERY_SQL} OR %s <%% name)"
+# float8: значение из курсора должно сравниваться с тем же числом без потери точности
+SEARCH_SCORE_SQL = f"(ts_rank_cd(search_vector, {SEARCH_TSQUERY_SQL}) + word_similarity(%s, name))::float8"
+
+
+def build_search_query(q: str, cursor: Optional[str], category_ids: Optional[List[int]], min_price: Optional[float],
+                       max_price: Optional[float], attr: Optional[List[str]], limit: int):
+    """Ranked search page plus the facet query over all matches; keyset pagination on (score, id)."""
+    filters, filter_params = product_filter_conditions(None, min_price, max_price, attr, category_ids)
+    where = " AND ".join([SEARCH_MATCH_SQL] + filters)
+    where_params = [q, q, q] + filter_params
+
+    query = f"""
+        SELECT * FROM (
+            SELECT {PRODUCT_COLUMNS}, {SEARCH_SCORE_SQL} AS score
+            FROM products
+            WHERE {where}
+        ) matches
+    """
+    params = [q, q, q] + where_params
+    if cursor:
+        query += " WHERE score < %s OR (score = %s AND id > %s)"
+        score, product_id = decode_products_cursor(cursor, "score")
+        params.extend([score, score, product_id])
+    query += " ORDER BY score DESC, id LIMIT %s"
+    params.append(limit)
+
+    facets_query = f"""
+        WITH matches AS (
+            SELECT category_id, attributes FROM products WHERE {where}
+        ), categories AS (
+            SELECT category_id AS value, COUNT(*) AS count
+            FROM matches WHERE category_id IS NOT NULL
+            GROUP BY category_id
+            ORDER BY count DESC, category_id
+            LIMIT %s
+        ), attribute_values AS (
+            SELECT key, value, COUNT(*) AS count,
+                   row_number() OVER (PARTITION BY key ORDER BY COUNT(*) DESC, value) AS position
+            FROM matches, jsonb_each_text(attributes)
+            WHERE jsonb_typeof(attributes) = 'object'
+            GROUP BY key, value
+        )
+        SELECT (SELECT COUNT(*) FROM matches) AS total,
+               (SELECT COALESCE(json_agg(categories), '[]') FROM categories) AS categories,
+               (SELECT COALESCE(json_agg(attribute_values ORDER BY key, position), '[]')
+                FROM attribute_values WHERE position <= %s) AS attributes
+    """
+    facets_params = where_params + [SEARCH_FACET_VALUES, SEARCH_FACET_VALUES]
+    return query, params, facets_query, facets_params
+
+
+@app.get("/products/search", response_model=ProductSearchResponse)
+def search_products(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    category_id: Optional[int] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    attr: Optional[List[str]] = Query(None),
+    facets: bool = True,
+):
+    """Full-text + typo-tolerant search over name/description, best matches first.
+
+    ``category_id`` includes subcategories. Facets (category and attribute
+    value counts over all matches) come with the first page only.
+    """
+    limit = min(limit or SEARCH_PAGE_LIMIT, SEARCH_MAX_PAGE_LIMIT)
+    category_ids = None
+    if category_id is not None:
+        category_ids = category_tree.subtree_ids(category_id) or []
+
+    def load_results():
+        query, params, facets_query, facets_params = build_search_query(q, cursor, category_ids, min_price, max_price,
+                                                                        attr, limit + 1)
+        result = {"items": [], "total": None, "facets": None}
+        with replicas.connection(catalog_cache.invalidated_at("products")) as db:
+            with db.cursor() as db_cursor:
+                db_cursor.execute(query, params)
+                result["items"] = db_cursor.fetchall()
+                if facets and not cursor:
+                    db_cursor.execute(facets_query, facets_params)
+                    row = db_cursor.fetchone()
+                    attributes = {}
+                    for item in row["attributes"]:
+                        attributes.setdefault(item["key"], []).append(item)
+                    result["total"] = row["total"]
+                    result["facets"] = {"category_id": row["categories"], "attributes": attributes}
+        headers = {}
+        if len(result["items"]) > limit:
+            result["items"] = result["items"][:limit]
+            headers["X-Next-Cursor"] = encode_products_cursor(result["items"][-1], "score")
+        return CacheEntry(search_response_adapter.dump_json(search_response_adapter.validate_python(result)), headers)
+
+    cache_key = "search?" + "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    return catalog_cache.get_or_load("products", cache_key, load_results).to_response(request)
+
+
+@app.get("/products/{product_id}/availability", response_model=ProductAvailability)
+def get_product_availability(product_id: int, db: psycopg2.extensions.connection = Depends(get_db)):
+    """Units still on sale: stock minus what carts hold, from the product row alone.
+
+    Read from the primary: during a launch it changes with every add-to-cart.
+    """
+    with db.cursor() as cursor:
+        cursor.execute("""
+            SELECT id AS product_id, stock, reserved, GREATEST(stock - reserved, 0) AS available
+            FROM products WHERE id = %s
+        """, (product_id,))
+        row = cursor.fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return row
+
+
+@app.get("/products/{product_id}/similar", response_model=List[SimilarProductResponse])
+def get_similar_products(product_id: int, limit: int = Query(10, ge=1, le=100),
+                         db: psycopg2.extensions.connection = Depends(get_catalog_read_db)):
+    similar = similarity_index.similar(product_id, limit)
+    if similar is None:
+        raise HTTPException(status_code=404, detail="Product is not in the similarity index")
     with db.cursor() as cursor:
-        cursor.execute("SELECT * FROM products")
-        products = cursor.fetchall()
-        return products
+        cursor.execute(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id = ANY(%s)", ([similar_id for similar_id, _ in similar],))
+        products = {row["id"]: row for row in cursor.fetchall()}
+    # Порядок — по убыванию сходства; удалённые после сборки индекса товары пропускаем
+    return rows_response([{**products[similar_id], "similarity": score} for similar_id, score in similar
+                          if similar_id in products], similar_products_adapter)
+
+
+# Одна выборка по первичному ключу (version, user_id, rank) активной версии;
+# без персональных строк — популярные товары (user_id = POPULAR_USER_ID)
+RECOMMENDATIONS_SQL = """
+    WITH active AS (
+        SELECT version FROM recommendation_active
+    ), personal AS (
+        SELECT r.rank, r.product_id
+        FROM recommendation_items r
+        JOIN active ON active.version = r.version
+        WHERE r.user_id = %(user_id)s
+        ORDER BY r.rank
+        LIMIT %(limit)s
+    ), picked AS (
+        SELECT rank, product_id FROM personal
+        UNION ALL
+        SELECT r.rank, r.product_id
+        FROM recommendation_items r
+        JOIN active ON active.version = r.version
+        WHERE r.user_id = %(popular_user_id)s AND NOT EXISTS (SELECT 1 FROM personal)
+        ORDER BY rank
+        LIMIT %(limit)s
+    )
+    SELECT p.id, p.name, p.description, p.price::float8 AS price, p.stock, p.category_id, p.attributes, p.created_at
+    FROM picked
+    JOIN products p ON p.id = picked.product_id
+    ORDER BY picked.rank
+"""
 
 
 @app.get("/recommendations", response_model=List[ProductResponse])
-async def get_recommendations(user_id: int, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/recommendations")
+def get_recommendations(user_id: int, limit: int = Query(RECOMMENDATIONS_TOP_K, ge=1, le=100),
+                        db: psycopg2.extensions.connection = Depends(get_read_db)):
     with db.cursor() as cursor:
-        cursor.execute("""
-            SELECT p.*
-            FROM recommendations r
-            JOIN products p ON r.product_id = p.id
-            WHERE r.user_id = %s
-        """, (user_id,))
-        recommended_products = cursor.fetchall()
-        return recommended_products
-    
+        cursor.execute(RECOMMENDATIONS_SQL, {"user_id": user_id, "limit": limit, "popular_user_id": POPULAR_USER_ID})
+        return rows_response(cursor.fetchall(), product_list_adapter)
+
+
+@app.post("/recommendations/score", response_model=List[ProductScore])
+async def score_products(score_request: ProductScoreRequest):
+    """Live model scores of the given products for the user, best first; unknown products last with null."""
+    try:
+        scores = await inference.score(score_request.user_id, score_request.product_ids)
+    except UnknownUser as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    scores.sort(key=lambda pair: (pair[1] is None, -(pair[1] or 0.0)))
+    return rows_response([{"product_id": product_id, "score": score} for product_id, score in scores],
+                         product_scores_adapter)
+
+
+# Прогноз активной версии ml/batch_forecast.py; порядок — по rank из первичного ключа
+SELLER_FORECAST_SQL = """
+    SELECT f.rank, f.item_id, f.product_id, p.name, f.predicted, p.stock
+    FROM seller_forecast_active a
+    JOIN seller_forecast_items f ON f.version = a.version
+    LEFT JOIN products p ON p.id = f.product_id
+    WHERE f.shop_id = %(shop_id)s
+    ORDER BY f.rank
+    LIMIT %(limit)s
+"""
+
+# Товары каталога, которых на складе меньше прогноза продаж магазина за месяц
+RESTOCK_SUGGESTIONS_SQL = """
+    SELECT f.rank, f.item_id, f.product_id, p.name, f.predicted, p.stock,
+           ceil(f.predicted)::int - p.stock AS shortfall
+    FROM seller_forecast_active a
+    JOIN seller_forecast_items f ON f.version = a.version
+    JOIN products p ON p.id = f.product_id
+    WHERE f.shop_id = %(shop_id)s AND ceil(f.predicted) > p.stock
+    ORDER BY shortfall DESC, f.rank
+    LIMIT %(limit)s
+"""
+
+SELLER_FORECAST_EXISTS_SQL = """
+    SELECT EXISTS (
+        SELECT 1 FROM seller_forecast_active a
+        JOIN seller_forecast_items f ON f.version = a.version
+        WHERE f.shop_id = %s
+    ) AS found
+"""
+
+
+@app.get("/sellers/{shop_id}/forecast", response_model=List[SellerForecastItem])
+def get_seller_forecast(shop_id: int, limit: int = Query(SELLER_FORECAST_TOP_K, ge=1, le=1000),
+                        admin: dict = Depends(require_admin), db: psycopg2.extensions.connection = Depends(get_read_db)):
+    """The shop's best-selling items next month according to the active forecast version."""
+    with db.cursor() as cursor:
+        cursor.execute(SELLER_FORECAST_SQL, {"shop_id": shop_id, "limit": limit})
+        rows = cursor.fetchall()
+    if not rows:
+        raise HTTPException(status_code=404, detail="No forecast for this shop")
+    return rows_response(rows, seller_forecast_adapter)
+
+
+@app.get("/sellers/{shop_id}/restock-suggestions", response_model=List[RestockSuggestion])
+def get_restock_suggestions(shop_id: int, limit: int = Query(50, ge=1, le=1000),
+                            admin: dict = Depends(require_admin), db: psycopg2.extensions.connection = Depends(get_read_db)):
+    """Catalog products whose stock is below the shop's forecast, largest shortfall first."""
+    with db.cursor() as cursor:
+        cursor.execute(RESTOCK_SUGGESTIONS_SQL, {"shop_id": shop_id, "limit": limit})
+        rows = cursor.fetchall()
+        if not rows:
+            cursor.execute(SELLER_FORECAST_EXISTS_SQL, (shop_id,))
+            if not cursor.fetchone()["found"]:
+                raise HTTPException(status_code=404, detail="No forecast for this shop")
+    return rows_response(rows, restock_suggestions_adapter)
+
 
 @app.get("/cart", response_model=List[CartItemResponse])
-def get_cart(user_id: int, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/cart")
+def get_cart(user_id: int, db: psycopg2.extensions.connection = Depends(get_read_db)):
     with db.cursor() as cursor:
         cursor.execute("""
-            SELECT p.name, p.price, ci.id, ci.cart_id, ci.product_id, ci.quantity
+            SELECT ci.id, ci.cart_id, ci.product_id, ci.quantity, ci.reserved_until, p.name, p.price::float8 AS price
             FROM cart_items ci
             JOIN cart c ON ci.cart_id = c.id
             JOIN products p ON ci.product_id = p.id
             WHERE c.user_id = %s
+            ORDER BY ci.id
         """, (user_id,))
-        cart_items = cursor.fetchall()
-        cart_items = [
-            {
-                'name': item['name'],
-                'price': float(item['price']),
-                'id': item['id'],
-                'cart_id': item['cart_id'],
-                'product_id': item['product_id'],
-                'quantity': item['quantity'],
-            }
-            for item in cart_items
-        ]
-        print(cart_items)
-        return cart_items
+        return rows_response(cursor.fetchall(), cart_items_adapter)
+
+# Корзина пользователя создаётся при первом обращении; пустой DO UPDATE нужен, чтобы RETURNING вернул id.
+# Любая запись в корзину начинается с блокировки её строки (этим запросом или LOCK_CART_SQL): запросы одного
+# пользователя идут по очереди, а следующий оператор транзакции видит строки корзины уже без гонок
+USER_CART_SQL = """
+    INSERT INTO cart (user_id) VALUES (%(user_id)s)
+    ON CONFLICT (user_id) DO UPDATE SET user_id = EXCLUDED.user_id
+    RETURNING id
+"""
+
+LOCK_CART_SQL = "SELECT id FROM cart WHERE user_id = %s FOR UPDATE"
+
+# Удерживается всё новое количество строки: часть уже может держаться, а после истечения — ничего.
+# Если свободного остатка (stock - reserved) не хватает, UPDATE товара не находит строку и запрос ничего не вернёт
+ADD_CART_ITEM_SQL = """
+    WITH existing AS (
+        SELECT quantity, reserved FROM cart_items WHERE cart_id = %(cart_id)s AND product_id = %(product_id)s
+    ),
+    wanted AS (
+        SELECT COALESCE((SELECT quantity FROM existing), 0) + %(quantity)s AS quantity,
+               COALESCE((SELECT quantity FROM existing), 0) + %(quantity)s
+                   - COALESCE((SELECT reserved FROM existing), 0) AS delta
+    ),
+    product AS (
+        UPDATE products p
+        SET reserved = p.reserved + w.delta
+        FROM wanted w
+        WHERE p.id = %(product_id)s AND p.stock - p.reserved >= w.delta
+        RETURNING p.id, p.name, p.price
+    ),
+    line AS (
+        INSERT INTO cart_items (cart_id, product_id, quantity, reserved, reserved_until)
+        SELECT %(cart_id)s, p.id, w.quantity, w.quantity, %(reserved_until)s FROM product p, wanted w
+        ON CONFLICT (cart_id, product_id) DO UPDATE
+        SET quantity = EXCLUDED.quantity, reserved = EXCLUDED.reserved, reserved_until = EXCLUDED.reserved_until
+        RETURNING id, cart_id, product_id, quantity, reserved_until
+    ),
+    -- Активность продлевает удержания всей корзины
+    extended AS (
+        UPDATE cart_items SET reserved_until = %(reserved_until)s
+        WHERE cart_id = %(cart_id)s AND product_id <> %(product_id)s AND reserved > 0
+    )
+    SELECT line.id, line.cart_id, line.product_id, line.quantity, line.reserved_until, p.name, p.price::float8 AS price
+    FROM line
+    JOIN product p ON p.id = line.product_id
+"""
+
+# Корзина становится ровно такой, как в запросе; несуществующие товары пропускаются.
+# Удержание каждого товара меняется на delta = новое количество - уже удержанное; если где-то свободного
+# остатка не хватает, ничего не меняется, а товары возвращаются строками с insufficient = true.
+# Изменения CTE не видны друг другу, поэтому итог собирается из RETURNING, а удалённые строки
+# возвращаются с removed = true
+SYNC_CART_SQL = """
+    WITH desired AS (
+        SELECT d.product_id, SUM(d.quantity)::int AS quantity
+        FROM unnest(%(product_ids)s::int[], %(quantities)s::int[]) AS d(product_id, quantity)
+        JOIN products p ON p.id = d.product_id
+        GROUP BY d.product_id
+    ),
+    previous AS (
+        SELECT product_id, quantity, reserved FROM cart_items WHERE cart_id = %(cart_id)s
+    ),
+    changes AS (
+        SELECT COALESCE(d.product_id, prev.product_id) AS product_id,
+               COALESCE(d.quantity, 0) - COALESCE(prev.reserved, 0) AS delta
+        FROM desired d
+        FULL JOIN previous prev ON prev.product_id = d.product_id
+    ),
+    locked AS (
+        SELECT p.id, p.stock - p.reserved AS available, ch.delta
+        FROM products p
+        JOIN changes ch ON ch.product_id = p.id
+        WHERE ch.delta <> 0
+        ORDER BY p.id
+        FOR UPDATE OF p
+    ),
+    checked AS (
+        SELECT COALESCE(bool_and(delta <= available), true) AS ok FROM locked
+    ),
+    reserved AS (
+        UPDATE products p
+        SET reserved = p.reserved + l.delta
+        FROM locked l, checked
+        WHERE p.id = l.id AND checked.ok
+    ),
+    removed AS (
+        DELETE FROM cart_items ci
+        USING checked
+        WHERE checked.ok AND ci.cart_id = %(cart_id)s
+          AND NOT EXISTS (SELECT 1 FROM desired d WHERE d.product_id = ci.product_id)
+        RETURNING ci.product_id
+    ),
+    lines AS (
+        INSERT INTO cart_items (cart_id, product_id, quantity, reserved, reserved_until)
+        SELECT %(cart_id)s, d.product_id, d.quantity, d.quantity, %(reserved_until)s
+        FROM desired d, checked
+        WHERE checked.ok
+        ON CONFLICT (cart_id, product_id) DO UPDATE
+        SET quantity = EXCLUDED.quantity, reserved = EXCLUDED.reserved, reserved_until = EXCLUDED.reserved_until
+        RETURNING id, cart_id, product_id, quantity, reserved_until
+    )
+    SELECT l.id, l.cart_id, l.product_id, l.quantity, l.reserved_until, p.name, p.price::float8 AS price,
+           l.quantity > COALESCE(prev.quantity, 0) AS added, false AS removed, false AS insufficient
+    FROM lines l
+    JOIN products p ON p.id = l.product_id
+    LEFT JOIN previous prev ON prev.product_id = l.product_id
+    UNION ALL
+    SELECT NULL, NULL, product_id, 0, NULL, NULL, NULL, false, true, false FROM removed
+    UNION ALL
+    SELECT NULL, NULL, id, 0, NULL, NULL, NULL, false, false, true FROM locked WHERE delta > available
+    ORDER BY 1, 3
+"""
+
+# Строка удаляется, её удержание возвращается товару, остальные удержания корзины продлеваются
+REMOVE_CART_ITEM_SQL = """
+    WITH line AS (
+        DELETE FROM cart_items
+        WHERE id = %(cart_item_id)s AND cart_id = %(cart_id)s
+        RETURNING product_id, reserved
+    ),
+    released AS (
+        UPDATE products p
+        SET reserved = p.reserved - line.reserved
+        FROM line
+        WHERE p.id = line.product_id AND line.reserved > 0
+    ),
+    extended AS (
+        UPDATE cart_items SET reserved_until = %(reserved_until)s
+        WHERE cart_id = %(cart_id)s AND id <> %(cart_item_id)s AND reserved > 0
+    )
+    SELECT product_id FROM line
+"""
+
+CART_SUMMARY_SQL = """
+    SELECT COALESCE(json_agg(json_build_object(
+               'id', ci.id, 'product_id', ci.product_id, 'name', p.name, 'price', p.price,
+               'quantity', ci.quantity, 'line_total', p.price * ci.quantity,
+               -- Удержанное плюс ещё свободное
+               'in_stock', p.stock - p.reserved + ci.reserved >= ci.quantity
+           ) ORDER BY ci.id), '[]') AS items,
+           COALESCE(SUM(ci.quantity), 0)::int AS item_count,
+           COALESCE(SUM(p.price * ci.quantity), 0) AS total
+    FROM cart c
+    JOIN cart_items ci ON ci.cart_id = c.id
+    JOIN products p ON p.id = ci.product_id
+    WHERE c.user_id = %s
+"""
+
+
+def cart_foreign_key_error(e: psycopg2.errors.ForeignKeyViolation):
+    if e.diag.constraint_name == "cart_user_id_fkey":
+        return HTTPException(status_code=404, detail="User not found")
+    return HTTPException(status_code=404, detail="Product not found")
+
+
+def insufficient_stock_error(db: psycopg2.extensions.connection, product_ids: List[int]):
+    """404 for a missing product, otherwise 409 with what is still free of each product."""
+    with db.cursor() as cursor:
+        cursor.execute("SELECT id, GREATEST(stock - reserved, 0) AS available FROM products WHERE id = ANY(%s) ORDER BY id",
+                       (product_ids,))
+        available = {row["id"]: row["available"] for row in cursor.fetchall()}
+    db.rollback()
+    if len(available) < len(set(product_ids)):
+        return HTTPException(status_code=404, detail="Product not found")
+    return HTTPException(status_code=409, detail={
+        "message": "Insufficient stock",
+        "product_ids": sorted(available),
+        "available": [available[product_id] for product_id in sorted(available)],
+    })
+
 
 @app.post("/cart/items", response_model=CartItemResponse)
 def add_cart_item(item: CartItemCreate, user_id: int, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/cart/items")
-    with db.cursor() as cursor:
-        cursor.execute("SELECT id FROM cart WHERE user_id = %s", (user_id,))
-        cart = cursor.fetchone()
-        if not cart:
-            cursor.execute("INSERT INTO cart (user_id, created_at) VALUES (%s, NOW()) RETURNING id", (user_id,))
-            cart = cursor.fetchone()
-        
-        cursor.execute("""
-            INSERT INTO cart_items (cart_id, product_id, quantity)
-            VALUES (%s, %s, %s)
-            RETURNING id, cart_id, product_id, quantity
-        """, (cart["id"], item.product_id, item.quantity))
-        new_item = cursor.fetchone()
-        
-        cursor.execute("SELECT name, price FROM products WHERE id = %s", (new_item["product_id"],))
-        product = cursor.fetchone()
-        
-        new_item_with_product = {
-            **new_item,
-            "name": product["name"],
-            "price": float(product["price"])
-        }
-        
+    """Add to the quantity of the product's cart line, creating the cart and the line as needed."""
+    try:
+        with db.cursor() as cursor:
+            cursor.execute(USER_CART_SQL, {"user_id": user_id})
+            cart_id = cursor.fetchone()["id"]
+            cursor.execute(ADD_CART_ITEM_SQL, {"cart_id": cart_id, "product_id": item.product_id,
+                                               "quantity": item.quantity, "reserved_until": hold_until()})
+            line = cursor.fetchone()
+        if line is None:
+            db.rollback()
+            raise insufficient_stock_error(db, [item.product_id])
         db.commit()
-        return new_item_with_product
-    
+        replicas.note_write(user_id)
+    except psycopg2.errors.ForeignKeyViolation as e:
+        db.rollback()
+        raise cart_foreign_key_error(e)
+    event_log.record(user_id, "cart_add", item.product_id)
+    return line
+
+
+@app.put("/cart", response_model=List[CartItemResponse])
+def sync_cart(items: List[CartItemCreate], user_id: int, db: psycopg2.extensions.connection = Depends(get_db)):
+    """Replace the whole cart with ``items`` in one statement and return the resulting lines."""
+    try:
+        with db.cursor() as cursor:
+            cursor.execute(USER_CART_SQL, {"user_id": user_id})
+            cart_id = cursor.fetchone()["id"]
+            cursor.execute(SYNC_CART_SQL, {
+                "cart_id": cart_id,
+                "product_ids": [item.product_id for item in items],
+                "quantities": [item.quantity for item in items],
+                "reserved_until": hold_until(),
+            })
+            rows = cursor.fetchall()
+        insufficient = [row["product_id"] for row in rows if row["insufficient"]]
+        if insufficient:
+            db.rollback()
+            raise insufficient_stock_error(db, insufficient)
+        db.commit()
+        replicas.note_write(user_id)
+    except psycopg2.errors.ForeignKeyViolation as e:
+        db.rollback()
+        raise cart_foreign_key_error(e)
+    for row in rows:
+        if row["removed"]:
+            event_log.record(user_id, "cart_remove", row["product_id"])
+        elif row["added"]:
+            event_log.record(user_id, "cart_add", row["product_id"])
+    return [row for row in rows if not row["removed"]]
+
+
+@app.get("/cart/summary", response_model=CartSummaryResponse)
+def get_cart_summary(user_id: int, db: psycopg2.extensions.connection = Depends(get_read_db)):
+    """Cart lines with line totals and the grand total, all computed in SQL."""
+    with db.cursor() as cursor:
+        cursor.execute(CART_SUMMARY_SQL, (user_id,))
+        return cursor.fetchone()
+
 
 @app.delete("/cart/items/{cart_item_id}")
 def remove_cart_item(cart_item_id: int, user_id: int, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/cart/items/delete")
+    """Delete the line and give its held units back to the product."""
     with db.cursor() as cursor:
-        cursor.execute("""
-            SELECT ci.id
-            FROM cart_items ci
-            JOIN cart c ON ci.cart_id = c.id
-            WHERE ci.id = %s AND c.user_id = %s
-        """, (cart_item_id, user_id))
-        item = cursor.fetchone()
+        cursor.execute(LOCK_CART_SQL, (user_id,))
+        cart = cursor.fetchone()
+        item = None
+        if cart:
+            cursor.execute(REMOVE_CART_ITEM_SQL, {"cart_item_id": cart_item_id, "cart_id": cart["id"],
+                                                  "reserved_until": hold_until()})
+            item = cursor.fetchone()
         if not item:
+            db.rollback()
             raise HTTPException(status_code=404, detail="Cart item not found")
-        
-        cursor.execute("DELETE FROM cart_items WHERE id = %s", (cart_item_id,))
         db.commit()
+    replicas.note_write(user_id)
+    event_log.record(user_id, "cart_remove", item["product_id"])
     return {"detail": "Cart item removed successfully"}
 
 
 @app.post("/orders", response_model=OrderResponse)
-def create_order(order: OrderCreate, db: psycopg2.extensions.connection = Depends(get_db)):
-    print("/orders")
-    with db.cursor() as cursor:
-        cursor.execute(
-            "INSERT INTO orders (user_id, total_amount, status, payment_id, created_at) "
-            "VALUES (%s, %s, %s, %s, %s) RETURNING id, user_id, total_amount, status, payment_id, created_at",
-            (order.user_id, order.total_amount, order.status, order.payment_id, datetime.utcnow()),
-        )
-        new_order = cursor.fetchone()
-        db.commit()
-        return new_order
+def create_order(order: OrderCreate, db: psycopg2.extensions.connection = Depends(get_db),
+                 idempotency_key: Optional[str] = Header(None)):
+    with idempotency_store.guard(f"orders:{order.user_id}", idempotency_key, order, db) as guard:
+        if guard.response is not None:
+            return guard.replay()
+        with db.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO orders (user_id, total_amount, status, payment_id, created_at) "
+                "VALUES (%s, %s, %s, %s, %s) RETURNING id, user_id, total_amount, status, payment_id, created_at",
+                (order.user_id, order.total_amount, order.status, order.payment_id, datetime.utcnow()),
+            )
+            new_order = cursor.fetchone()
+            guard.save(cursor, OrderResponse.model_validate(new_order).model_dump(mode="json"))
+            db.commit()
+            replicas.note_write(order.user_id)
+            return new_order
     
 
+@app.post("/events", status_code=status.HTTP_202_ACCEPTED)
+async def post_events(events: List[EventCreate]):
+    """Queue activity events for user_logs; they are written in batches, not per request."""
+    if len(events) > EVENTS_MAX_PER_REQUEST:
+        raise HTTPException(status_code=413, detail=f"At most {EVENTS_MAX_PER_REQUEST} events per request")
+    if not event_log.offer([(e.user_id, e.type, e.product_id) for e in events]):
+        raise HTTPException(status_code=503, detail="Event queue is full, try again later",
+                            headers={"Retry-After": "1"})
+    return {"accepted": len(events)}
+
+
 def create_access_token(data: dict, expires_delta: timedelta):
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
@@ -441,298 +1357,123 @@ def create_access_token(data: dict, expires_delta: timedelta):
     return encoded_jwt
 
 
-@app.on_event("startup")
-def startup_event():
-    db = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-    try:
-        # pass
-        
-        drop_all_tables(db)
-        create_tables(db)
-        insert_sample_data(db)
-    finally:
-        db.close()
+@app.get("/health/db")
+def get_db_health():
+    return pool.stats()
 
 
-def drop_all_tables(db: psycopg2.extensions.connection):
-    try:
-        with db.cursor() as cursor:
-            cursor.execute(
-            """
-                DROP TABLE IF EXISTS users CASCADE;
-                DROP TABLE IF EXISTS categories CASCADE;
-                DROP TABLE IF EXISTS products CASCADE;
-                DROP TABLE IF EXISTS cart CASCADE;
-                DROP TABLE IF EXISTS cart_items CASCADE;
-                DROP TABLE IF EXISTS orders CASCADE;
-                DROP TABLE IF EXISTS order_items CASCADE;
-                DROP TABLE IF EXISTS user_logs CASCADE;
-                DROP TABLE IF EXISTS recommendations CASCADE;
-            """)
-    except Exception as e:
-        db.rollback()
-        print(f"Error dropping tables: {e}")
+@app.get("/health/replicas")
+def get_replicas_health():
+    return replicas.stats()
 
 
-def create_tables(db: psycopg2.extensions.connection):
-    try:
-        with db.cursor() as cursor:
+@app.get("/health/admission")
+async def get_admission_health():
+    # async: состояние admission меняется только в цикле событий
+    return admission.stats()
 
-            
-            cursor.execute("""
-                CREATE TABLE users (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    password VARCHAR(255) NOT NULL,
-                    role VARCHAR(50) NOT NULL CHECK (role IN ('покупатель', 'администратор')),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-
-            
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS categories (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL UNIQUE,  -- Add UNIQUE constraint
-                    parent_id INT REFERENCES categories(id) ON DELETE SET NULL
-                );
-
-                CREATE TABLE IF NOT EXISTS products (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL UNIQUE,  -- Add UNIQUE constraint
-                    description TEXT,
-                    price DECIMAL(10, 2) NOT NULL CHECK (price >= 0),
-                    stock INT NOT NULL CHECK (stock >= 0),
-                    category_id INT REFERENCES categories(id) ON DELETE SET NULL,
-                    attributes JSONB,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-
-                CREATE TABLE IF NOT EXISTS cart (
-                    id SERIAL PRIMARY KEY,
-                    user_id INT REFERENCES users(id) ON DELETE CASCADE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-
-                CREATE TABLE IF NOT EXISTS cart_items (
-                    id SERIAL PRIMARY KEY,
-                    cart_id INT REFERENCES cart(id) ON DELETE CASCADE,
-                    product_id INT REFERENCES products(id) ON DELETE CASCADE,
-                    quantity INT NOT NULL CHECK (quantity > 0)
-                );
-
-                CREATE TABLE IF NOT EXISTS orders (
-                    id SERIAL PRIMARY KEY,
-                    user_id INT REFERENCES users(id) ON DELETE CASCADE,
-                    total_amount DECIMAL(10, 2) NOT NULL CHECK (total_amount >= 0),
-                    status VARCHAR(50) NOT NULL CHECK (status IN ('в обработке', 'отправлен', 'доставлен')),
-                    payment_id VARCHAR(255),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-
-                CREATE TABLE IF NOT EXISTS order_items (
-                    id SERIAL PRIMARY KEY,
-                    order_id INT REFERENCES orders(id) ON DELETE CASCADE,
-                    product_id INT REFERENCES products(id) ON DELETE CASCADE,
-                    quantity INT NOT NULL CHECK (quantity > 0),
-                    price DECIMAL(10, 2) NOT NULL CHECK (price >= 0)
-                );
-
-                CREATE TABLE IF NOT EXISTS user_logs (
-                    id SERIAL PRIMARY KEY,
-                    user_id INT REFERENCES users(id) ON DELETE CASCADE,
-                    action VARCHAR(255) NOT NULL,
-                    product_id INT REFERENCES products(id) ON DELETE SET NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-
-                CREATE TABLE IF NOT EXISTS recommendations (
-                    id SERIAL PRIMARY KEY,
-                    user_id INT REFERENCES users(id) ON DELETE CASCADE,
-                    product_id INT REFERENCES products(id) ON DELETE CASCADE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
 
-            db.commit()
-            print("Tables created successfully!")
-    except Exception as e:
-        db.rollback()
-        print(f"Error creating tables: {e}")
+@app.get("/health/reservations")
+def get_reservations_health():
+    return reservation_sweeper.stats()
 
 
-def insert_sample_data(db: psycopg2.extensions.connection):
-    print("Inserting sample data into categories and products...")
-    cursor = db.cursor()
-    try:
-        cursor.execute("""
-            -- Заполнение таблицы пользователей
-            INSERT INTO users (name, email, password, role)
-            VALUES
-                ('Иван Иванов', 'ivanov@example.com', %s, 'покупатель'),
-                ('Мария Петрова', 'petrova@example.com', %s, 'покупатель'),
-                ('Алексей Сидоров', 'sidorov@example.com', %s, 'администратор'),
-                ('Наталья Смирнова', 'smirnova@example.com', %s, 'покупатель'),
-                ('Дмитрий Кузнецов', 'kuznetsov@example.com', %s, 'покупатель'),
-                ('Ольга Васильева', 'vasilieva@example.com', %s, 'покупатель'),
-                ('Екатерина Зайцева', 'zaytseva@example.com', %s, 'покупатель'),
-                ('Игорь Беляев', 'belyaev@example.com', %s, 'покупатель'),
-                ('Марина Орлова', 'orlova@example.com', %s, 'покупатель'),
-                ('Юрий Михайлов', 'mikhaylov@example.com', %s, 'администратор'),
-                ('Татьяна Федорова', 'fedorova@example.com', %s, 'покупатель'),
-                ('Константин Соловьев', 'solovyov@example.com', %s, 'покупатель')
-            ON CONFLICT (email) DO NOTHING;
-        """, (pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123"),
-               pwd_context.hash("password123")))
+@app.get("/health/cache")
+def get_cache_health():
+    return catalog_cache.stats()
 
-        
-        cursor.execute("""
-            INSERT INTO categories (name, parent_id)
-            VALUES
-                ('Электроника', NULL),
-                ('Одежда', NULL),
-                ('Обувь', NULL),
-                ('Товары для дома', NULL),
-                ('Товары для детей', NULL)
-            ON CONFLICT (name) DO NOTHING;
-        """)
 
-        
-        cursor.execute("""
-            SELECT id, name FROM categories WHERE name IN (
-                'Электроника', 'Одежда', 'Обувь', 'Товары для дома', 'Товары для детей'
-            );
-        """)
-        parent_categories = {row['name']: row['id'] for row in cursor.fetchall()}
+@app.get("/health/auth")
+def get_auth_health():
+    return {**auth_cache.stats(), "password_hasher": password_hasher.stats()}
 
-        
-        cursor.execute("""
-            INSERT INTO categories (name, parent_id)
-            VALUES
-                ('Компьютеры', %(electronics_id)s),
-                ('Смартфоны', %(electronics_id)s),
-                ('Телевизоры', %(electronics_id)s),
-                ('Мужская одежда', %(clothing_id)s),
-                ('Женская одежда', %(clothing_id)s),
-                ('Спортивная обувь', %(shoes_id)s),
-                ('Повседневная обувь', %(shoes_id)s),
-                ('Мебель', %(home_goods_id)s),
-                ('Декор', %(home_goods_id)s),
-                ('Кухня', %(home_goods_id)s),
-                ('Игрушки', %(kids_goods_id)s),
-                ('Детская одежда', %(kids_goods_id)s)
-            ON CONFLICT (name) DO NOTHING;
-        """, {
-            'electronics_id': parent_categories['Электроника'],
-            'clothing_id': parent_categories['Одежда'],
-            'shoes_id': parent_categories['Обувь'],
-            'home_goods_id': parent_categories['Товары для дома'],
-            'kids_goods_id': parent_categories['Товары для детей']
-        })
 
-        
-        cursor.execute("SELECT id, name FROM categories;")
-        categories = {row['name']: row['id'] for row in cursor.fetchall()}
+@app.get("/health/similarity")
+def get_similarity_health():
+    return similarity_index.stats()
 
-        
-        cursor.execute("""
-            INSERT INTO products (name, description, price, stock, category_id, attributes)
-            VALUES
-                ('Ноутбук', 'Мощный ноутбук для работы и игр', 50000.00, 10, %(computers_id)s, '{"color": "черный", "processor": "Intel i7", "ram": "16GB"}'),
-                ('Смартфон', 'Современный смартфон с отличной камерой', 25000.00, 15, %(smartphones_id)s, '{"color": "белый", "camera": "12MP", "battery": "4000mAh"}'),
-                ('Телевизор', 'Ультра HD телевизор с поддержкой Smart TV', 35000.00, 8, %(tvs_id)s, '{"size": "55 inch", "type": "LED", "resolution": "4K"}'),
-                ('Футболка', 'Стильная мужская футболка', 1500.00, 50, %(mens_clothing_id)s, '{"size": "M", "color": "синий"}'),
-                ('Платье', 'Элегантное платье для особых случаев', 3000.00, 30, %(womens_clothing_id)s, '{"size": "S", "color": "красный"}'),
-                ('Кроссовки', 'Удобные кроссовки для спорта', 4000.00, 25, %(sports_shoes_id)s, '{"size": "42", "color": "черный"}'),
-                ('Сандалии', 'Летние сандалии для отдыха', 2000.00, 40, %(casual_shoes_id)s, '{"size": "38", "color": "бежевый"}'),
-                ('Кресло', 'Удобное кресло для офиса', 8000.00, 15, %(furniture_id)s, '{"color": "черный", "material": "кожа"}'),
-                ('Кровать', 'Комфортная двуспальная кровать с матрасом', 25000.00, 20, %(furniture_id)s, '{"material": "дерево", "size": "King"}'),
-                ('Игрушечный робот', 'Интерактивный робот для детей', 1500.00, 50, %(toys_id)s, '{"battery": "AA", "color": "красный"}'),
-                ('Детская футболка', 'Яркая футболка для детей', 800.00, 60, %(kids_clothing_id)s, '{"size": "L", "color": "голубой"}'),
-                ('aaaaa', 'sadf', 800.00, 60, %(kids_clothing_id)s, '{"size": "L", "color": "blue"}')
-            ON CONFLICT (name) DO NOTHING;
-        """, {
-            'computers_id': categories['Компьютеры'],
-            'smartphones_id': categories['Смартфоны'],
-            'tvs_id': categories['Телевизоры'],
-            'mens_clothing_id': categories['Мужская одежда'],
-            'womens_clothing_id': categories['Женская одежда'],
-            'sports_shoes_id': categories['Спортивная обувь'],
-            'casual_shoes_id': categories['Повседневная обувь'],
-            'furniture_id': categories['Мебель'],
-            'toys_id': categories['Игрушки'],
-            'kids_clothing_id': categories['Детская одежда']
-        })
 
-        cursor.execute("""
-                -- Заполнение таблицы корзин
-                INSERT INTO cart (user_id)
-                VALUES
-                    (1), (2), (3), (4), (5),
-                    (6), (7), (8), (9), (10);
-
-                -- Заполнение таблицы товаров в корзине
-                INSERT INTO cart_items (cart_id, product_id, quantity)
-                VALUES
-                    (1, 1, 1), (1, 2, 2), (2, 3, 1), (2, 4, 3), (3, 5, 1),
-                    (3, 6, 1), (4, 7, 1), (4, 8, 2), (5, 9, 1), (6, 10, 1),
-                    (7, 11, 2), (8, 12, 1);
-
-                -- Заполнение таблицы заказов
-                INSERT INTO orders (user_id, total_amount, status, payment_id)
-                VALUES
-                    (1, 55000.00, 'в обработке', 'payment_1'),
-                    (2, 70000.00, 'отправлен', 'payment_2'),
-                    (3, 30000.00, 'доставлен', 'payment_3'),
-                    (4, 12000.00, 'в обработке', 'payment_4'),
-                    (5, 10000.00, 'отправлен', 'payment_5'),
-                    (6, 8000.00, 'доставлен', 'payment_6'),
-                    (7, 25000.00, 'в обработке', 'payment_7'),
-                    (8, 20000.00, 'отправлен', 'payment_8'),
-                    (9, 15000.00, 'доставлен', 'payment_9'),
-                    (10, 40000.00, 'в обработке', 'payment_10');
-
-                -- Заполнение таблицы товаров в заказе
-                INSERT INTO order_items (order_id, product_id, quantity, price)
-                VALUES
-                    (1, 1, 1, 50000.00), (1, 2, 2, 1500.00),
-                    (2, 3, 1, 35000.00), (2, 4, 3, 1500.00),
-                    (3, 5, 1, 3000.00), (3, 6, 1, 4000.00),
-                    (4, 7, 1, 2000.00), (4, 8, 2, 1000.00),
-                    (5, 9, 1, 8000.00), (6, 10, 1, 1500.00),
-                    (7, 11, 2, 1500.00), (8, 12, 1, 12000.00);
-
-                -- Заполнение таблицы логов пользователей
-                INSERT INTO user_logs (user_id, action, product_id)
-                VALUES
-                    (1, 'Добавил товар в корзину', 1), (1, 'Перешел к оформлению заказа', NULL),
-                    (2, 'Просмотрел товар', 3), (2, 'Добавил товар в корзину', 4),
-                    (3, 'Удалил товар из корзины', 5), (4, 'Перешел к оформлению заказа', NULL),
-                    (5, 'Добавил товар в корзину', 7), (6, 'Просмотрел товар', 9),
-                    (7, 'Добавил товар в корзину', 11), (8, 'Удалил товар из корзины', 12);
-
-                -- Заполнение таблицы рекомендаций
-                INSERT INTO recommendations (user_id, product_id)
-                VALUES
-                    (1, 2), (1, 3), (2, 4), (3, 5),
-                    (4, 6), (5, 7), (6, 8), (7, 9),
-                    (8, 10), (9, 11), (10, 12);
-""")
+@app.get("/health/static")
+def get_static_health():
+    return static_files.stats()
 
-        db.commit()
-        print("Sample data inserted successfully!")
-    except Exception as e:
-        print(f"Error inserting sample data: {e}")
-    finally:
-        cursor.close()
\ No newline at end of file
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(metrics.render(pool_stats=pool.stats()), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.get("/health/inference")
+def get_inference_health():
+    return inference.stats()
+
+
+@app.get("/health/events")
+def get_events_health():
+    return event_log.stats()
+
+
+# Зарегистрированы раньше startup_event/shutdown_event: последний сброс событий идёт, пока пул ещё открыт
+@app.on_event("startup")
+async def start_event_log():
+    event_log.start()
+
+
+@app.on_event("shutdown")
+async def stop_event_log():
+    await event_log.stop()
+
+
+@app.on_event("startup")
+async def start_reservation_sweeper():
+    reservation_sweeper.start()
+
+
+@app.on_event("shutdown")
+async def stop_reservation_sweeper():
+    await reservation_sweeper.stop()
+
+
+@app.on_event("startup")
+async def start_inference():
+    inference.start()
+
+
+@app.on_event("shutdown")
+async def stop_inference():
+    await inference.stop()
+
+
+@app.on_event("startup")
+def startup_event():
+    started = time.perf_counter()
+    pool.open()
+    password_hasher.start()
+    with pool.connection() as db:
+        # Схема не пересоздаётся: только проверка версии, миграции — под advisory lock
+        pending = pending_migrations(db)
+        if pending and MIGRATE_ON_STARTUP:
+            upgrade(db)
+        elif pending:
+            check_schema(db)
+        try:
+            inference.load(db)
+        except ModelMissing as e:
+            logger.warning("%s; /recommendations/score will answer 503", e)
+    # Реплики — после миграций: до этого их схема может отставать от кода
+    replicas.open()
+    catalog_cache.start_listener(DATABASE_URL)
+    static_files.load()
+    try:
+        similarity_index.load()
+    except SimilarityIndexMissing as e:
+        logger.warning("%s; /products/{id}/similar will answer 503", e)
+    logger.info("Startup finished in %.1f ms", (time.perf_counter() - started) * 1000)
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    catalog_cache.stop_listener()
+    password_hasher.shutdown()
+    replicas.close()
+    pool.close()
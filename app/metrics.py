@@ -0,0 +1,234 @@
+"""Request and database metrics in the Prometheus text format.
+
+MetricsMiddleware times every HTTP request and counts it by route template
+and status. While a request runs, its RequestStats sit in a context
+variable that is copied into threadpool threads, so record_query() (called
+by db.InstrumentedCursor) charges each statement to the request that ran
+it. Requests slower than SLOW_REQUEST_MS are logged as one JSON line with
+the statements they executed.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+# Сколько запросов к БД хранить на один HTTP-запрос для журнала медленных запросов
+SLOW_LOG_MAX_STATEMENTS = int(os.getenv("SLOW_LOG_MAX_STATEMENTS", "20"))
+SLOW_LOG_SQL_CHARS = 500
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Пути без маршрута (404) сводятся к одной метке, иначе число рядов растёт с каждым сканером
+UNMATCHED_ROUTE = "unmatched"
+
+access_logger = logging.getLogger("access")
+slow_logger = logging.getLogger("slow_requests")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = []  # [(sql, seconds)], не больше SLOW_LOG_MAX_STATEMENTS
+
+
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последний — +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def _labels(names, values):
+    return ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for name, value in zip(names, values))
+
+
+def _histogram_lines(name, label_names, series):
+    lines = []
+    for label_values, histogram in sorted(series.items()):
+        labels = _labels(label_names, label_values)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append('%s_bucket{%s%sle="%s"} %d' % (name, labels, "," if labels else "", le, cumulative))
+        suffix = "{%s}" % labels if labels else ""
+        lines.append("%s_sum%s %r" % (name, suffix, histogram.sum))
+        lines.append("%s_count%s %d" % (name, suffix, cumulative))
+    return lines
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = {}  # (method, route, status) -> count
+        self.latency = {}  # (method, route) -> Histogram
+        self.route_queries = {}  # route -> [queries, seconds]
+        self.query_latency = Histogram(QUERY_BUCKETS)
+        self.slow_requests = 0
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, method, route, status, seconds, stats):
+        with self._lock:
+            self.in_flight -= 1
+            key = (method, route, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.latency.get((method, route))
+            if histogram is None:
+                histogram = self.latency[(method, route)] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+            totals = self.route_queries.setdefault(route, [0, 0.0])
+            totals[0] += stats.queries
+            totals[1] += stats.db_seconds
+            if seconds * 1000 >= SLOW_REQUEST_MS:
+                self.slow_requests += 1
+
+    def query_finished(self, seconds):
+        with self._lock:
+            self.query_latency.observe(seconds)
+
+    def render(self, pool_stats=None):
+        with self._lock:
+            lines = [
+                "# HELP http_requests_in_flight Requests being processed.",
+                "# TYPE http_requests_in_flight gauge",
+                "http_requests_in_flight %d" % self.in_flight,
+                "# HELP http_requests_total Finished requests by route template and status.",
+                "# TYPE http_requests_total counter",
+            ]
+            lines += ["http_requests_total{%s} %d" % (_labels(("method", "route", "status"), key), count)
+                      for key, count in sorted(self.requests.items())]
+            lines += ["# HELP http_request_duration_seconds Request latency, including streaming the body.",
+                      "# TYPE http_request_duration_seconds histogram"]
+            lines += _histogram_lines("http_request_duration_seconds", ("method", "route"), self.latency)
+            lines += ["# HELP http_request_db_queries_total Database statements run while serving the route.",
+                      "# TYPE http_request_db_queries_total counter"]
+            lines += ["http_request_db_queries_total{%s} %d" % (_labels(("route",), (route,)), totals[0])
+                      for route, totals in sorted(self.route_queries.items())]
+            lines += ["# HELP http_request_db_seconds_total Time spent in database statements while serving the route.",
+                      "# TYPE http_request_db_seconds_total counter"]
+            lines += ["http_request_db_seconds_total{%s} %r" % (_labels(("route",), (route,)), totals[1])
+                      for route, totals in sorted(self.route_queries.items())]
+            lines += ["# HELP db_query_duration_seconds Latency of every statement, requests and background jobs.",
+                      "# TYPE db_query_duration_seconds histogram"]
+            lines += _histogram_lines("db_query_duration_seconds", (), {(): self.query_latency})
+            lines += ["# HELP http_slow_requests_total Requests slower than SLOW_REQUEST_MS.",
+                      "# TYPE http_slow_requests_total counter",
+                      "http_slow_requests_total %d" % self.slow_requests]
+        if pool_stats is not None:
+            lines += _pool_lines(pool_stats)
+        return "\n".join(lines) + "\n"
+
+
+def _pool_lines(stats):
+    lines = []
+    for key, kind, help_text in (
+        ("size", "gauge", "Open connections."),
+        ("in_use", "gauge", "Connections checked out."),
+        ("idle", "gauge", "Connections waiting in the pool."),
+        ("waiting", "gauge", "Callers waiting for a connection."),
+        ("max_size", "gauge", "Pool size limit."),
+        ("acquired_total", "counter", "Connections handed out."),
+        ("timeouts_total", "counter", "Callers that gave up waiting."),
+        ("wait_seconds_total", "counter", "Time spent acquiring connections."),
+        ("health_check_failures", "counter", "Idle connections that failed the health check."),
+    ):
+        name = "db_pool_" + key
+        if kind == "counter" and not name.endswith("_total"):
+            name += "_total"
+        lines += ["# HELP %s %s" % (name, help_text), "# TYPE %s %s" % (name, kind), "%s %r" % (name, stats[key])]
+    return lines
+
+
+metrics = Metrics()
+
+
+def record_query(sql, seconds):
+    """Charge one statement to the current request (if any) and the global query histogram."""
+    metrics.query_finished(seconds)
+    stats = _current_request.get()
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.db_seconds += seconds
+    if len(stats.statements) < SLOW_LOG_MAX_STATEMENTS:
+        stats.statements.append((sql, seconds))
+
+
+def _log_slow(method, path, route, status, seconds, stats):
+    slow_logger.warning(json.dumps({
+        "method": method,
+        "path": path,
+        "route": route,
+        "status": status,
+        "ms": round(seconds * 1000, 1),
+        "db_queries": stats.queries,
+        "db_ms": round(stats.db_seconds * 1000, 1),
+        "sql": [
+            {"ms": round(statement_seconds * 1000, 2),
+             "statement": _WHITESPACE_RE.sub(" ", sql if isinstance(sql, str) else str(sql)).strip()[:SLOW_LOG_SQL_CHARS]}
+            for sql, statement_seconds in stats.statements
+        ],
+    }, ensure_ascii=False))
+
+
+class MetricsMiddleware:
+    """ASGI middleware feeding ``metrics``; added last so it also times the other middleware."""
+
+    def __init__(self, app, registry=metrics):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        self.registry.request_started()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - started
+            _current_request.reset(token)
+            # Шаблон пути ("/products/{product_id}") ставит роутер Starlette
+            route = getattr(scope.get("route"), "path", None) or UNMATCHED_ROUTE
+            method = scope["method"]
+            self.registry.request_finished(method, route, status, seconds, stats)
+            access_logger.debug("%s %s %d %.1f ms, %d queries", method, scope["path"], status, seconds * 1000,
+                                stats.queries)
+            if seconds * 1000 >= SLOW_REQUEST_MS:
+                _log_slow(method, scope["path"], route, status, seconds, stats)
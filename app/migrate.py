@@ -0,0 +1,169 @@
+"""Versioned schema migrations.
+
+Migrations are the numbered .sql files in migrations/; each is applied once,
+in its own transaction, and recorded in schema_version. A Postgres advisory
+lock makes sure only one worker or deploy step migrates at a time.
+
+    python migrate.py upgrade        # apply pending migrations
+    python migrate.py status         # show applied and pending versions
+    python migrate.py schema         # print the full schema (sql/create_tables.sql)
+    python migrate.py seed [--reset] # load sample data (--reset drops everything first)
+    python migrate.py cleanup        # delete expired idempotency keys
+    python migrate.py reconcile      # recompute products.reserved from cart holds
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from db import DATABASE_URL
+from logs import configure_logging
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE_RE = re.compile(r"^(\d+)_(\w+)\.sql$")
+# Произвольная константа, общая для всех воркеров
+MIGRATION_LOCK_ID = 72_001_001
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaOutOfDate(Exception):
+    pass
+
+
+def load_migrations():
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE_RE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError("Duplicate migration versions in %s" % MIGRATIONS_DIR)
+    return migrations
+
+
+def applied_versions(db):
+    with db.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL AS present")
+        if not cursor.fetchone()["present"]:
+            db.rollback()
+            return set()
+        cursor.execute("SELECT version FROM schema_version")
+        versions = {row["version"] for row in cursor.fetchall()}
+    db.rollback()
+    return versions
+
+
+def pending_migrations(db):
+    applied = applied_versions(db)
+    return [m for m in load_migrations() if m[0] not in applied]
+
+
+def check_schema(db):
+    """Raise SchemaOutOfDate if any migration has not been applied. One cheap query."""
+    pending = pending_migrations(db)
+    if pending:
+        raise SchemaOutOfDate("Pending migrations: %s (run `python migrate.py upgrade`)"
+                              % ", ".join("%04d_%s" % (v, n) for v, n, _ in pending))
+
+
+def upgrade(db):
+    """Apply pending migrations under the advisory lock; returns the versions applied."""
+    applied_now = []
+    db.autocommit = True
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            db.autocommit = False
+            with db.cursor() as cursor:
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INT PRIMARY KEY,
+                        name VARCHAR(255) NOT NULL,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+            db.commit()
+            # Пока ждали блокировку, другой воркер мог всё применить — перечитываем
+            for version, name, path in pending_migrations(db):
+                with open(path, encoding="utf-8") as file:
+                    sql = file.read()
+                started = time.perf_counter()
+                try:
+                    with db.cursor() as cursor:
+                        cursor.execute(sql)
+                        cursor.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (version, name))
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    raise
+                logger.info("Applied migration %04d_%s in %.1f ms", version, name, (time.perf_counter() - started) * 1000)
+                applied_now.append(version)
+        finally:
+            db.rollback()
+            db.autocommit = True
+            with db.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+    finally:
+        db.autocommit = False
+    return applied_now
+
+
+def schema_sql():
+    parts = ["-- Сгенерировано `python app/migrate.py schema` из app/migrations; не редактировать вручную.\n"]
+    for version, name, path in load_migrations():
+        with open(path, encoding="utf-8") as file:
+            parts.append("\n-- %04d_%s\n%s" % (version, name, file.read()))
+    return "".join(parts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["upgrade", "status", "schema", "seed", "cleanup", "reconcile"])
+    parser.add_argument("--reset", action="store_true", help="seed: drop all tables and re-run migrations first")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    if args.command == "schema":
+        sys.stdout.write(schema_sql())
+        return
+
+    db = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    try:
+        if args.command == "upgrade":
+            applied = upgrade(db)
+            print("Schema is up to date" if not applied else "Applied %d migration(s)" % len(applied))
+        elif args.command == "status":
+            applied = applied_versions(db)
+            for version, name, _ in load_migrations():
+                print("%04d_%s  %s" % (version, name, "applied" if version in applied else "pending"))
+        elif args.command == "seed":
+            from seed import drop_all_tables, insert_sample_data
+
+            if args.reset:
+                drop_all_tables(db)
+            upgrade(db)
+            insert_sample_data(db)
+        elif args.command == "cleanup":
+            from idempotency import idempotency_store
+
+            idempotency_store.purge_expired(db)
+        elif args.command == "reconcile":
+            from reservations import reconcile
+
+            fixed = reconcile(db)
+            print("Reserved counts fixed for %d product(s)%s" % (len(fixed), ": %s" % fixed if fixed else ""))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+-- Индексы для горячих соединений: /cart, /recommendations, /purchase, удаление из корзины
+
+-- У пользователя одна корзина: сливаем дубликаты, созданные гонкой в add_cart_item
+UPDATE cart_items ci
+SET cart_id = keep.id
+FROM cart c
+JOIN (SELECT user_id, MIN(id) AS id FROM cart GROUP BY user_id) keep ON keep.user_id = c.user_id
+WHERE ci.cart_id = c.id AND c.id <> keep.id;
+
+DELETE FROM cart c
+USING (SELECT user_id, MIN(id) AS id FROM cart GROUP BY user_id) keep
+WHERE c.user_id = keep.user_id AND c.id <> keep.id;
+
+ALTER TABLE cart ADD CONSTRAINT cart_user_id_key UNIQUE (user_id);
+
+CREATE INDEX IF NOT EXISTS cart_items_cart_id_idx ON cart_items (cart_id);
+CREATE INDEX IF NOT EXISTS cart_items_product_id_idx ON cart_items (product_id);
+CREATE INDEX IF NOT EXISTS orders_user_id_idx ON orders (user_id);
+CREATE INDEX IF NOT EXISTS order_items_order_id_idx ON order_items (order_id);
+CREATE INDEX IF NOT EXISTS order_items_product_id_idx ON order_items (product_id);
+CREATE INDEX IF NOT EXISTS recommendations_user_id_idx ON recommendations (user_id);
+CREATE INDEX IF NOT EXISTS user_logs_user_id_idx ON user_logs (user_id);
+CREATE INDEX IF NOT EXISTS products_category_id_idx ON products (category_id);
+CREATE INDEX IF NOT EXISTS categories_parent_id_idx ON categories (parent_id);
+
+-- Keyset-пагинация /products?order_by=created_at
+CREATE INDEX IF NOT EXISTS products_created_at_id_idx ON products (created_at, id);
+
+-- Фильтры по атрибутам: attributes @> '{...}' и attributes ?& ARRAY[...]
+CREATE INDEX IF NOT EXISTS products_attributes_gin_idx ON products USING GIN (attributes);
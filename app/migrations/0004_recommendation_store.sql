@@ -0,0 +1,43 @@
+-- Хранилище предрасчитанных рекомендаций (ml/batch_recommendations.py)
+
+-- Таблица: recommendation_versions (версии выгрузок)
+CREATE TABLE IF NOT EXISTS recommendation_versions (
+    version SERIAL PRIMARY KEY,
+    source VARCHAR(255) NOT NULL,
+    row_count INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Таблица: recommendation_items (top-K товаров на пользователя; user_id = 0 — популярное для новых пользователей)
+CREATE TABLE IF NOT EXISTS recommendation_items (
+    version INT NOT NULL REFERENCES recommendation_versions(version) ON DELETE CASCADE,
+    user_id INT NOT NULL,
+    rank SMALLINT NOT NULL,
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    score REAL,
+    PRIMARY KEY (version, user_id, rank)
+);
+
+CREATE INDEX IF NOT EXISTS recommendation_items_product_id_idx ON recommendation_items (product_id);
+
+-- Таблица: recommendation_active (единственная строка — какая версия сейчас отдаётся)
+CREATE TABLE IF NOT EXISTS recommendation_active (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    version INT REFERENCES recommendation_versions(version)
+);
+
+INSERT INTO recommendation_active (singleton, version) VALUES (TRUE, NULL) ON CONFLICT DO NOTHING;
+
+-- Переносим уже существующие рекомендации в первую версию
+WITH new_version AS (
+    INSERT INTO recommendation_versions (source, row_count)
+    SELECT 'recommendations table', count(*) FROM recommendations HAVING count(*) > 0
+    RETURNING version
+)
+INSERT INTO recommendation_items (version, user_id, rank, product_id)
+SELECT new_version.version, r.user_id,
+       row_number() OVER (PARTITION BY r.user_id ORDER BY r.id), r.product_id
+FROM recommendations r, new_version
+WHERE r.user_id IS NOT NULL AND r.product_id IS NOT NULL;
+
+UPDATE recommendation_active SET version = (SELECT max(version) FROM recommendation_versions);
@@ -0,0 +1,33 @@
+-- Состояние инкрементального обновления рекомендаций (recommendation_updater.py)
+
+-- Таблица: recommendation_watermarks (до какого id уже учтены события каждого источника)
+CREATE TABLE IF NOT EXISTS recommendation_watermarks (
+    source VARCHAR(64) PRIMARY KEY,
+    last_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO recommendation_watermarks (source) VALUES ('user_logs'), ('order_items') ON CONFLICT DO NOTHING;
+
+-- Таблица: user_item_interactions (накопленный вес взаимодействий пользователя с товаром)
+CREATE TABLE IF NOT EXISTS user_item_interactions (
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    weight REAL NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, product_id)
+);
+
+-- Таблица: item_cooccurrence (сколько пользователей взаимодействовали с обоими товарами)
+CREATE TABLE IF NOT EXISTS item_cooccurrence (
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    other_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    users INT NOT NULL,
+    PRIMARY KEY (product_id, other_id)
+);
+
+CREATE INDEX IF NOT EXISTS user_item_interactions_product_id_idx ON user_item_interactions (product_id);
+CREATE INDEX IF NOT EXISTS item_cooccurrence_other_id_idx ON item_cooccurrence (other_id);
+-- Самые частые соседи товара: ORDER BY users DESC LIMIT n
+CREATE INDEX IF NOT EXISTS item_cooccurrence_top_idx ON item_cooccurrence (product_id, users DESC);
+CREATE INDEX IF NOT EXISTS user_item_interactions_recent_idx ON user_item_interactions (user_id, updated_at DESC);
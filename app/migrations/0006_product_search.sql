@@ -0,0 +1,15 @@
+-- Полнотекстовый и нечёткий поиск товаров (/products/search)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- russian — поиск по словоформам, simple — по точным словам (артикулы, латиница, бренды)
+ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(description, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS products_search_vector_idx ON products USING GIN (search_vector);
+
+-- Опечатки: триграммы по названию (операторы % и <%)
+CREATE INDEX IF NOT EXISTS products_name_trgm_idx ON products USING GIN (name gin_trgm_ops);
@@ -0,0 +1,10 @@
+-- Массовый импорт каталога (catalog_io.py)
+
+-- Проверка JSON в staging-таблице без падения всего импорта на первой плохой строке
+CREATE OR REPLACE FUNCTION jsonb_object_or_null(value TEXT) RETURNS JSONB AS $$
+BEGIN
+    RETURN CASE WHEN jsonb_typeof(value::jsonb) = 'object' THEN value::jsonb END;
+EXCEPTION WHEN invalid_text_representation THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
@@ -0,0 +1,21 @@
+-- Одна строка корзины на товар: add_cart_item увеличивает количество через ON CONFLICT
+
+-- Сливаем дубликаты, накопленные прежним add_cart_item: количество суммируется в строку с меньшим id
+UPDATE cart_items ci
+SET quantity = merged.quantity
+FROM (
+    SELECT MIN(id) AS id, SUM(quantity)::int AS quantity
+    FROM cart_items
+    GROUP BY cart_id, product_id
+    HAVING COUNT(*) > 1
+) merged
+WHERE ci.id = merged.id;
+
+DELETE FROM cart_items ci
+USING cart_items keep
+WHERE keep.cart_id = ci.cart_id AND keep.product_id = ci.product_id AND keep.id < ci.id;
+
+ALTER TABLE cart_items ADD CONSTRAINT cart_items_cart_id_product_id_key UNIQUE (cart_id, product_id);
+
+-- Уникальный индекс начинается с cart_id и заменяет отдельный
+DROP INDEX IF EXISTS cart_items_cart_id_idx;
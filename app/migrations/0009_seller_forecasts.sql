@@ -0,0 +1,31 @@
+-- Прогноз продаж магазинов на следующий месяц (ml/batch_forecast.py), версии — как у рекомендаций
+
+-- Таблица: seller_forecast_versions (версии выгрузок)
+CREATE TABLE IF NOT EXISTS seller_forecast_versions (
+    version SERIAL PRIMARY KEY,
+    source VARCHAR(255) NOT NULL,
+    row_count INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Таблица: seller_forecast_items (прогноз по сетке магазин x товар; rank — место товара внутри магазина)
+CREATE TABLE IF NOT EXISTS seller_forecast_items (
+    version INT NOT NULL REFERENCES seller_forecast_versions(version) ON DELETE CASCADE,
+    shop_id INT NOT NULL,
+    rank INT NOT NULL,
+    item_id INT NOT NULL,
+    -- NULL, если товара из датасета нет в каталоге
+    product_id INT REFERENCES products(id) ON DELETE CASCADE,
+    predicted REAL NOT NULL,
+    PRIMARY KEY (version, shop_id, rank)
+);
+
+CREATE INDEX IF NOT EXISTS seller_forecast_items_product_id_idx ON seller_forecast_items (product_id);
+
+-- Таблица: seller_forecast_active (единственная строка — какая версия сейчас отдаётся)
+CREATE TABLE IF NOT EXISTS seller_forecast_active (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    version INT REFERENCES seller_forecast_versions(version)
+);
+
+INSERT INTO seller_forecast_active (singleton, version) VALUES (TRUE, NULL) ON CONFLICT DO NOTHING;
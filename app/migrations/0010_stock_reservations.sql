@@ -0,0 +1,11 @@
+-- Удержание остатков корзинами: строка корзины держит reserved единиц до reserved_until,
+-- products.reserved — сумма удержаний по товару, свободно stock - reserved
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS reserved INT NOT NULL DEFAULT 0 CHECK (reserved >= 0);
+
+ALTER TABLE cart_items ADD COLUMN IF NOT EXISTS reserved INT NOT NULL DEFAULT 0
+    CHECK (reserved >= 0 AND reserved <= quantity);
+ALTER TABLE cart_items ADD COLUMN IF NOT EXISTS reserved_until TIMESTAMP;
+
+-- Для reservations.sweep: только строки с действующим удержанием, в порядке истечения
+CREATE INDEX IF NOT EXISTS cart_items_reserved_until_idx ON cart_items (reserved_until) WHERE reserved > 0;
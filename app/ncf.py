@@ -0,0 +1,96 @@
+"""NumPy forward pass of the ml/ notebook recommenders.
+
+Both notebooks train the same shape of model: two embeddings (user or shop,
+and item) concatenated into a stack of Dense layers. ml/export_model.py writes
+the weights as a directory of .npy files plus meta.json, which this module
+memory-maps without TensorFlow.
+"""
+import json
+import os
+
+import numpy as np
+
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0, out=x),
+    "sigmoid": lambda x: 1.0 / (1.0 + np.exp(-x)),
+    "tanh": np.tanh,
+}
+# Сколько памяти можно занять под промежуточные активации одного пакета
+NCF_BATCH_BYTES = int(os.getenv("NCF_BATCH_BYTES", str(256 * 1024 * 1024)))
+
+
+class NCFModel:
+    """Embedding + Dense stack scored in float32.
+
+    The first Dense layer acts on concat(user, item), so it splits into a user
+    half and an item half. Both halves are projected once up front; scoring a
+    user against every item is then a broadcast add plus the remaining layers.
+    """
+
+    def __init__(self, user_embedding, item_embedding, layers, user_ids=None, item_ids=None):
+        self.user_embedding = user_embedding
+        self.item_embedding = item_embedding
+        self.layers = layers  # [(kernel, bias, activation)]
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.user_index = None if user_ids is None else {int(u): i for i, u in enumerate(user_ids)}
+        self.item_index = None if item_ids is None else {int(x): i for i, x in enumerate(item_ids)}
+        kernel, bias, _ = layers[0]
+        dim = user_embedding.shape[1]
+        self._user_proj = np.ascontiguousarray(user_embedding @ kernel[:dim], dtype=np.float32)
+        self._item_proj = np.ascontiguousarray(item_embedding @ kernel[dim:] + bias, dtype=np.float32)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as file:
+            meta = json.load(file)
+        mode = "r" if mmap else None
+
+        def array(name):
+            file_path = os.path.join(path, name + ".npy")
+            return np.load(file_path, mmap_mode=mode) if os.path.exists(file_path) else None
+
+        layers = [(array("dense_%d_kernel" % i), array("dense_%d_bias" % i), activation)
+                  for i, activation in enumerate(meta["activations"])]
+        return cls(array("user_embedding"), array("item_embedding"), layers, array("user_ids"), array("item_ids"))
+
+    @property
+    def num_items(self):
+        return self.item_embedding.shape[0]
+
+    def _tail(self, hidden):
+        """Finish the forward pass from the first layer's pre-activation; returns (..., ) scores."""
+        _, _, activation = self.layers[0]
+        hidden = ACTIVATIONS[activation](hidden)
+        for kernel, bias, activation in self.layers[1:]:
+            hidden = ACTIVATIONS[activation](hidden @ kernel + bias)
+        return hidden[..., 0]
+
+    def score(self, user_rows, item_rows):
+        """Scores for aligned (user row, item row) pairs."""
+        return self._tail(self._user_proj[user_rows] + self._item_proj[item_rows])
+
+    def score_users(self, user_rows, item_rows=None):
+        """(len(user_rows), items) score matrix against all items or a subset of item rows."""
+        item_proj = self._item_proj if item_rows is None else self._item_proj[item_rows]
+        return self._tail(self._user_proj[user_rows][:, None, :] + item_proj[None, :, :])
+
+    def top_k(self, user_rows, k, item_rows=None):
+        """Yield (user row, item rows, scores) best-first, batching users to fit NCF_BATCH_BYTES."""
+        items = self.num_items if item_rows is None else len(item_rows)
+        k = min(k, items)
+        widest = max(kernel.shape[1] for kernel, _, _ in self.layers)
+        batch = max(1, NCF_BATCH_BYTES // (items * widest * 4 * 2))
+        user_rows = np.asarray(user_rows)
+        for start in range(0, len(user_rows), batch):
+            rows = user_rows[start:start + batch]
+            scores = self.score_users(rows, item_rows)
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind="stable")
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            for row, picked, picked_scores in zip(rows, best, best_scores):
+                yield row, (picked if item_rows is None else np.asarray(item_rows)[picked]), picked_scores
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# "thread" достаточно: bcrypt отпускает GIL; "process" изолирует CPU полностью
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+LOGIN_MAX_CONCURRENT_PER_IP = int(os.getenv("LOGIN_MAX_CONCURRENT_PER_IP", "4"))
+LOGIN_MAX_CONCURRENT_PER_ACCOUNT = int(os.getenv("LOGIN_MAX_CONCURRENT_PER_ACCOUNT", "2"))
+
+# bcrypt-хеш с той же стоимостью, что и у настоящих паролей
+DUMMY_PASSWORD_HASH = "$2b$12$CUh7FLyJbbTQadYh53q2beuxmsiOCGeSVuORFKQN6vsyH.DD0SGcC"
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def _hash(password):
+    return pwd_context.hash(password)
+
+
+def _verify(password, hashed):
+    return pwd_context.verify(password, hashed)
+
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated executor so it never blocks the event loop.
+
+    At most max_pending operations may be queued or running; beyond that
+    callers get PasswordHasherBusy instead of piling up behind each other.
+    """
+
+    def __init__(self, kind=PASSWORD_HASH_EXECUTOR, workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_MAX_PENDING,
+                 per_ip=LOGIN_MAX_CONCURRENT_PER_IP, per_account=LOGIN_MAX_CONCURRENT_PER_ACCOUNT):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown PASSWORD_HASH_EXECUTOR: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.per_ip = per_ip
+        self.per_account = per_account
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._by_ip = {}
+        self._by_account = {}
+        # Скользящее среднее времени verify: столько же ждём для неизвестных email
+        self._verify_seconds = None
+        self.rejected_busy = 0
+        self.rejected_limited = 0
+
+    def start(self):
+        if self._executor is None:
+            executor_cls = ProcessPoolExecutor if self.kind == "process" else ThreadPoolExecutor
+            self._executor = executor_cls(max_workers=self.workers)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, func, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected_busy += 1
+                raise PasswordHasherBusy()
+            self._pending += 1
+        try:
+            self.start()
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def hash(self, password):
+        return await self._run(_hash, password)
+
+    async def verify(self, password, hashed):
+        started = time.perf_counter()
+        result = await self._run(_verify, password, hashed)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._verify_seconds = elapsed if self._verify_seconds is None else 0.9 * self._verify_seconds + 0.1 * elapsed
+        return result
+
+    async def reject_unknown(self):
+        """Spend as long as a real verify would, without burning CPU on bcrypt."""
+        if self._verify_seconds is None:
+            await self.verify("", DUMMY_PASSWORD_HASH)
+            return
+        await asyncio.sleep(self._verify_seconds)
+
+    @contextmanager
+    def limit(self, ip, account):
+        """Bound concurrent password checks per client IP and per account (429 when exceeded)."""
+        with self._lock:
+            if self._by_ip.get(ip, 0) >= self.per_ip or self._by_account.get(account, 0) >= self.per_account:
+                self.rejected_limited += 1
+                raise HTTPException(status_code=429, detail="Too many concurrent login attempts",
+                                    headers={"Retry-After": "1"})
+            self._by_ip[ip] = self._by_ip.get(ip, 0) + 1
+            self._by_account[account] = self._by_account.get(account, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for counts, key in ((self._by_ip, ip), (self._by_account, account)):
+                    counts[key] -= 1
+                    if not counts[key]:
+                        del counts[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "executor": self.kind,
+                "workers": self.workers,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "verify_seconds": self._verify_seconds,
+                "rejected_busy": self.rejected_busy,
+                "rejected_limited": self.rejected_limited,
+            }
+
+
+password_hasher = PasswordHasher()
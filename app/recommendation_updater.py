@@ -0,0 +1,333 @@
+"""Incremental recommendation updates from user_logs and order_items.
+
+Each run reads only the events after the stored watermarks, adds them to
+per-user interaction weights and item co-occurrence counts, and rewrites the
+top-K rows of the affected users in the active recommendation version. Work
+is proportional to the new events and the histories of the users they touch.
+
+    python recommendation_updater.py              # one pass
+    python recommendation_updater.py --loop 60    # every 60 seconds
+"""
+import argparse
+import logging
+import os
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from db import DATABASE_URL
+from events import EVENT_ACTIONS
+from logs import configure_logging
+from recommendations import RECOMMENDATIONS_TOP_K, activate, create_version, insert_popular
+
+# Вес события; события без товара и удаления из корзины не учитываются
+ACTION_WEIGHTS = {
+    EVENT_ACTIONS["view"]: 1.0,
+    EVENT_ACTIONS["cart_add"]: 3.0,
+}
+PURCHASE_WEIGHT = 5.0
+# Ограничивают пересчёт одного пользователя: history x neighbors строк
+RECOMMENDATIONS_UPDATE_HISTORY = int(os.getenv("RECOMMENDATIONS_UPDATE_HISTORY", "50"))
+RECOMMENDATIONS_UPDATE_NEIGHBORS = int(os.getenv("RECOMMENDATIONS_UPDATE_NEIGHBORS", "20"))
+# Сколько ждать транзакции, которые ещё могут дописать события ниже границы; не дождавшись,
+# проход берёт более раннюю безопасную границу
+RECOMMENDATIONS_UPDATE_SETTLE_TIMEOUT = float(os.getenv("RECOMMENDATIONS_UPDATE_SETTLE_TIMEOUT", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+def read_watermarks(cursor):
+    # FOR UPDATE: параллельные запуски выполняются по очереди
+    cursor.execute("SELECT source, last_id FROM recommendation_watermarks FOR UPDATE")
+    return {row["source"]: row["last_id"] for row in cursor.fetchall()}
+
+
+# Транзакции этой базы, пишущие в источники событий: RowExclusiveLock на таблицу держится до конца транзакции
+WRITERS_SQL = """
+    SELECT x.transactionid::text
+    FROM pg_locks x
+    WHERE x.locktype = 'transactionid' AND x.mode = 'ExclusiveLock' AND x.pid IN (
+        SELECT w.pid FROM pg_locks w
+        WHERE w.locktype = 'relation' AND w.mode = 'RowExclusiveLock'
+          AND w.database = (SELECT oid FROM pg_database WHERE datname = current_database())
+          AND w.relation IN ('user_logs'::regclass, 'order_items'::regclass)
+    )
+"""
+
+
+class SettledBounds:
+    """Upper ids per source below which no row can still appear.
+
+    An id is taken when a row is written, not when it commits, so a lower id
+    can become visible after a higher one. Each pass reads MAX(id) of both
+    sources in one snapshot together with the transactions then writing to
+    them (WRITERS_SQL). Writers lock the table before they take ids, so a
+    row at or below those bounds that the snapshot does not see belongs to
+    one of these transactions. Once all of them have finished, the bounds
+    are safe.
+
+    next() waits up to `timeout` for that. Transactions still running after
+    it (a long import, an idle-in-transaction session) are carried over
+    with their bounds, and the pass uses the newest earlier bounds whose
+    transactions have all finished, or None if there are none yet.
+    """
+
+    def __init__(self, timeout=RECOMMENDATIONS_UPDATE_SETTLE_TIMEOUT):
+        self.timeout = timeout
+        self._pending = []  # [(bounds, set(xid))] от старых проходов к новым
+
+    def next(self, db):
+        with db.cursor() as cursor:
+            # pg_locks читается после того, как снят снимок для MAX(id)
+            cursor.execute(f"""
+                SELECT (SELECT COALESCE(MAX(id), 0) FROM user_logs) AS user_logs,
+                       (SELECT COALESCE(MAX(id), 0) FROM order_items) AS order_items,
+                       ARRAY({WRITERS_SQL}) AS running
+            """)
+            row = cursor.fetchone()
+            bounds = {"user_logs": row["user_logs"], "order_items": row["order_items"]}
+            running = set(row["running"])
+            deadline = time.monotonic() + self.timeout
+            while running and time.monotonic() < deadline:
+                time.sleep(0.1)
+                running &= self._running(cursor, running)
+            # Транзакции прошлых проходов, не завершившиеся к их концу
+            still_running = self._running(cursor, set().union(*(xids for _, xids in self._pending)))
+        # Транзакция только читала и xid не получила, её никто не ждёт
+        db.commit()
+        if not running:
+            self._pending.clear()
+            return bounds
+        self._pending.append((bounds, running))
+        still_running |= running
+        safe = None
+        # Запись безопасна, когда завершились все её транзакции; более новая перекрывает старые
+        for position, (_, xids) in enumerate(self._pending):
+            if not xids & still_running:
+                safe = position
+        logger.warning("Transactions %s still write to user_logs/order_items after %.0f s",
+                       ", ".join(sorted(running)), self.timeout)
+        if safe is None:
+            return None
+        bounds = self._pending[safe][0]
+        del self._pending[:safe + 1]
+        return bounds
+
+    @staticmethod
+    def _running(cursor, xids):
+        if not xids:
+            return set()
+        cursor.execute("""
+            SELECT ARRAY(SELECT transactionid::text FROM pg_locks
+                         WHERE locktype = 'transactionid' AND mode = 'ExclusiveLock'
+                           AND transactionid::text = ANY(%s)) AS running
+        """, (list(xids),))
+        return set(cursor.fetchone()["running"])
+
+
+def collect_new_interactions(cursor, watermarks, upper):
+    """Fill temp table new_interactions with the events in (watermarks, upper] of each source."""
+    cursor.execute("""
+        CREATE TEMP TABLE new_interactions ON COMMIT DROP AS
+        SELECT user_id, product_id, SUM(weight) AS weight
+        FROM (
+            SELECT l.user_id, l.product_id, w.weight
+            FROM user_logs l
+            JOIN unnest(%(actions)s::text[], %(weights)s::real[]) AS w(action, weight) ON w.action = l.action
+            WHERE l.id > %(logs_from)s AND l.id <= %(logs_to)s
+              AND l.user_id IS NOT NULL AND l.product_id IS NOT NULL
+            UNION ALL
+            SELECT o.user_id, oi.product_id, %(purchase_weight)s
+            FROM order_items oi
+            JOIN orders o ON o.id = oi.order_id
+            WHERE oi.id > %(items_from)s AND oi.id <= %(items_to)s
+              AND o.user_id IS NOT NULL AND oi.product_id IS NOT NULL
+        ) events
+        WHERE EXISTS (SELECT 1 FROM users u WHERE u.id = events.user_id)
+          AND EXISTS (SELECT 1 FROM products p WHERE p.id = events.product_id)
+        GROUP BY user_id, product_id
+    """, {
+        "actions": list(ACTION_WEIGHTS), "weights": list(ACTION_WEIGHTS.values()),
+        "purchase_weight": PURCHASE_WEIGHT,
+        "logs_from": watermarks.get("user_logs", 0), "logs_to": upper["user_logs"],
+        "items_from": watermarks.get("order_items", 0), "items_to": upper["order_items"],
+    })
+    # Без статистики по временной таблице планировщик выбирает полные проходы по истории
+    cursor.execute("ANALYZE new_interactions")
+
+
+def update_counts(cursor):
+    """Add co-occurrences for first-time (user, product) pairs, then accumulate weights."""
+    cursor.execute("""
+        CREATE TEMP TABLE first_seen ON COMMIT DROP AS
+        SELECT n.user_id, n.product_id
+        FROM new_interactions n
+        LEFT JOIN user_item_interactions ui ON ui.user_id = n.user_id AND ui.product_id = n.product_id
+        WHERE ui.user_id IS NULL
+    """)
+    cursor.execute("ANALYZE first_seen")
+    # Пара учитывается один раз на пользователя: новый товар со старыми (в обе стороны) и новые между собой
+    cursor.execute("""
+        INSERT INTO item_cooccurrence (product_id, other_id, users)
+        SELECT a, b, COUNT(*)
+        FROM (
+            SELECT f.product_id AS a, ui.product_id AS b
+            FROM first_seen f JOIN user_item_interactions ui ON ui.user_id = f.user_id
+            UNION ALL
+            SELECT ui.product_id, f.product_id
+            FROM first_seen f JOIN user_item_interactions ui ON ui.user_id = f.user_id
+            UNION ALL
+            SELECT f1.product_id, f2.product_id
+            FROM first_seen f1 JOIN first_seen f2 ON f2.user_id = f1.user_id AND f2.product_id <> f1.product_id
+        ) pairs
+        GROUP BY a, b
+        ON CONFLICT (product_id, other_id) DO UPDATE SET users = item_cooccurrence.users + EXCLUDED.users
+    """)
+    pairs = cursor.rowcount
+    cursor.execute("""
+        INSERT INTO user_item_interactions (user_id, product_id, weight)
+        SELECT user_id, product_id, weight
+        FROM new_interactions
+        ON CONFLICT (user_id, product_id) DO UPDATE
+        SET weight = user_item_interactions.weight + EXCLUDED.weight, updated_at = CURRENT_TIMESTAMP
+    """)
+    return pairs
+
+
+def active_version(cursor):
+    cursor.execute("SELECT version FROM recommendation_active")
+    version = cursor.fetchone()["version"]
+    if version is None:
+        version = create_version(cursor, "incremental")
+        insert_popular(cursor, version)
+        activate(cursor, version)
+    return version
+
+
+def refresh_users(cursor, version, k):
+    """Rewrite top-K of users with new events: co-occurrence picks first, then their remaining old rows."""
+    cursor.execute("""
+        CREATE TEMP TABLE refreshed ON COMMIT DROP AS
+        WITH affected AS (
+            SELECT DISTINCT user_id FROM new_interactions
+        ), scored AS (
+            -- Последние history товаров пользователя и у каждого — neighbors самых частых соседей
+            SELECT a.user_id, n.other_id AS product_id, SUM(h.weight * n.users) AS score
+            FROM affected a
+            CROSS JOIN LATERAL (
+                SELECT ui.product_id, ui.weight FROM user_item_interactions ui
+                WHERE ui.user_id = a.user_id
+                ORDER BY ui.updated_at DESC
+                LIMIT %(history)s
+            ) h
+            CROSS JOIN LATERAL (
+                SELECT c.other_id, c.users FROM item_cooccurrence c
+                WHERE c.product_id = h.product_id
+                ORDER BY c.users DESC
+                LIMIT %(neighbors)s
+            ) n
+            GROUP BY a.user_id, n.other_id
+        ), candidates AS (
+            SELECT user_id, product_id, score, 0 AS source, 0 AS old_rank FROM scored
+            UNION ALL
+            SELECT r.user_id, r.product_id, r.score, 1, r.rank
+            FROM recommendation_items r
+            JOIN affected a ON a.user_id = r.user_id
+            WHERE r.version = %(version)s
+        ), fresh AS (
+            -- Уже знакомые пользователю товары не рекомендуем
+            SELECT DISTINCT ON (c.user_id, c.product_id) c.*
+            FROM candidates c
+            WHERE NOT EXISTS (
+                SELECT 1 FROM user_item_interactions x WHERE x.user_id = c.user_id AND x.product_id = c.product_id
+            )
+            ORDER BY c.user_id, c.product_id, c.source
+        ), ranked AS (
+            SELECT user_id, product_id, score,
+                   row_number() OVER (PARTITION BY user_id
+                                      ORDER BY source, CASE WHEN source = 0 THEN score END DESC, old_rank,
+                                               product_id) AS rank
+            FROM fresh
+        )
+        SELECT a.user_id, r.rank, r.product_id, r.score
+        FROM affected a
+        LEFT JOIN ranked r ON r.user_id = a.user_id AND r.rank <= %(k)s
+    """, {"version": version, "k": k, "history": RECOMMENDATIONS_UPDATE_HISTORY,
+          "neighbors": RECOMMENDATIONS_UPDATE_NEIGHBORS})
+    cursor.execute("""
+        DELETE FROM recommendation_items
+        WHERE version = %s AND user_id IN (SELECT user_id FROM refreshed)
+    """, (version,))
+    cursor.execute("""
+        INSERT INTO recommendation_items (version, user_id, rank, product_id, score)
+        SELECT %s, user_id, rank, product_id, score FROM refreshed WHERE product_id IS NOT NULL
+    """, (version,))
+    cursor.execute("SELECT COUNT(DISTINCT user_id) AS users FROM refreshed")
+    return cursor.fetchone()["users"]
+
+
+def run_once(db, k=RECOMMENDATIONS_TOP_K, settled=None):
+    """One incremental pass in a single transaction; returns a summary dict.
+
+    Pass the same SettledBounds to every pass so transactions still running
+    at one pass are tracked into the next.
+    """
+    started = time.perf_counter()
+    settled = SettledBounds() if settled is None else settled
+    try:
+        upper = settled.next(db)
+        with db.cursor() as cursor:
+            watermarks = read_watermarks(cursor)
+            if upper is None:
+                # Границы не сдвигаются, проход ничего не добавит
+                upper = {source: watermarks.get(source, 0) for source in ("user_logs", "order_items")}
+            collect_new_interactions(cursor, watermarks, upper)
+            cursor.execute("SELECT COUNT(*) AS pairs FROM new_interactions")
+            interactions = cursor.fetchone()["pairs"]
+            pairs = users = 0
+            if interactions:
+                pairs = update_counts(cursor)
+                users = refresh_users(cursor, active_version(cursor), k)
+            # Водяные знаки сдвигаются в той же транзакции, что и обновления
+            for source, last_id in upper.items():
+                cursor.execute("""
+                    UPDATE recommendation_watermarks SET last_id = GREATEST(last_id, %s), updated_at = CURRENT_TIMESTAMP
+                    WHERE source = %s
+                """, (last_id, source))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return {
+        "interactions": interactions,
+        "cooccurrence_pairs": pairs,
+        "users_refreshed": users,
+        "watermarks": upper,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=RECOMMENDATIONS_TOP_K)
+    parser.add_argument("--loop", type=float, metavar="SECONDS", help="keep running, one pass every SECONDS")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    db = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    settled = SettledBounds()
+    try:
+        while True:
+            summary = run_once(db, args.k, settled)
+            logger.info("%(interactions)d new interactions, %(cooccurrence_pairs)d co-occurrence pairs, "
+                        "%(users_refreshed)d users refreshed in %(seconds).2f s", summary)
+            if not args.loop:
+                break
+            time.sleep(args.loop)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
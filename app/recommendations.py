@@ -0,0 +1,81 @@
+"""Versioned store of precomputed recommendations.
+
+A batch job loads a complete version into recommendation_items with COPY and
+then flips the single-row recommendation_active pointer, so readers move from
+one full version to the next in one commit and never see a half-loaded one.
+"""
+import io
+import os
+
+
+# Строки этого "пользователя" — популярные товары для тех, у кого нет своих рекомендаций
+POPULAR_USER_ID = 0
+RECOMMENDATIONS_TOP_K = int(os.getenv("RECOMMENDATIONS_TOP_K", "20"))
+RECOMMENDATIONS_KEEP_VERSIONS = int(os.getenv("RECOMMENDATIONS_KEEP_VERSIONS", "2"))
+RECOMMENDATIONS_POPULAR_DAYS = int(os.getenv("RECOMMENDATIONS_POPULAR_DAYS", "90"))
+COPY_CHUNK_ROWS = 50_000
+
+
+def create_version(cursor, source):
+    cursor.execute("INSERT INTO recommendation_versions (source) VALUES (%s) RETURNING version", (source,))
+    row = cursor.fetchone()
+    return row["version"] if isinstance(row, dict) else row[0]
+
+
+def copy_rows(cursor, version, rows):
+    """COPY (user_id, rank, product_id, score) tuples into a version; returns the row count."""
+    count = 0
+    buffer = io.StringIO()
+    for user_id, rank, product_id, score in rows:
+        buffer.write("%d\t%d\t%d\t%s\t%s\n" % (version, user_id, rank, product_id, "\\N" if score is None else repr(float(score))))
+        count += 1
+        if count % COPY_CHUNK_ROWS == 0:
+            _flush(cursor, buffer)
+            buffer = io.StringIO()
+    _flush(cursor, buffer)
+    return count
+
+
+def _flush(cursor, buffer):
+    if buffer.tell():
+        buffer.seek(0)
+        cursor.copy_expert("COPY recommendation_items (version, user_id, rank, product_id, score) FROM STDIN", buffer)
+
+
+def insert_popular(cursor, version, k=RECOMMENDATIONS_TOP_K, days=RECOMMENDATIONS_POPULAR_DAYS):
+    """Cold-start rows: best sellers of the last `days`, topped up with the newest products."""
+    cursor.execute("""
+        WITH sold AS (
+            SELECT oi.product_id, SUM(oi.quantity) AS quantity
+            FROM order_items oi
+            JOIN orders o ON o.id = oi.order_id
+            WHERE o.created_at >= CURRENT_TIMESTAMP - make_interval(days => %(days)s)
+            GROUP BY oi.product_id
+        )
+        INSERT INTO recommendation_items (version, user_id, rank, product_id, score)
+        SELECT %(version)s, %(user_id)s, row_number() OVER (ORDER BY ranked.quantity DESC, ranked.id DESC),
+               ranked.id, ranked.quantity
+        FROM (
+            SELECT p.id, COALESCE(s.quantity, 0) AS quantity
+            FROM products p
+            LEFT JOIN sold s ON s.product_id = p.id
+            ORDER BY quantity DESC, p.id DESC
+            LIMIT %(k)s
+        ) ranked
+    """, {"version": version, "user_id": POPULAR_USER_ID, "k": k, "days": days})
+    return cursor.rowcount
+
+
+def activate(cursor, version, keep=RECOMMENDATIONS_KEEP_VERSIONS):
+    """Point readers at `version` and drop all but the `keep` newest versions."""
+    cursor.execute("""
+        UPDATE recommendation_versions
+        SET row_count = (SELECT count(*) FROM recommendation_items WHERE version = %(version)s)
+        WHERE version = %(version)s
+    """, {"version": version})
+    cursor.execute("UPDATE recommendation_active SET version = %s", (version,))
+    cursor.execute("""
+        DELETE FROM recommendation_versions
+        WHERE version <> %(version)s
+          AND version NOT IN (SELECT version FROM recommendation_versions ORDER BY version DESC LIMIT %(keep)s)
+    """, {"version": version, "keep": keep})
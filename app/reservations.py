@@ -0,0 +1,195 @@
+"""Time-bounded stock holds for cart lines.
+
+A cart line holds `reserved` units of its product until `reserved_until`;
+products.reserved is the sum of the holds, so the units still on sale are
+stock - reserved, read from one row. Cart writes in main.py reserve what a
+line needs (or fail with 409), move reserved_until STOCK_RESERVATION_TTL
+seconds ahead for the whole cart and, at /purchase, turn the holds into a
+sale. They lock the user's cart row first, and the sweeper skips locked
+carts, so a hold is never released under a running checkout.
+
+ReservationSweeper is a background asyncio task that releases expired holds
+every RESERVATION_SWEEP_INTERVAL seconds, RESERVATION_SWEEP_BATCH lines per
+transaction. Until it runs an expired hold still counts; a checkout that
+gets there first simply uses it.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from db import run_db
+
+
+STOCK_RESERVATION_TTL = int(os.getenv("STOCK_RESERVATION_TTL", "900"))
+RESERVATION_SWEEP_INTERVAL = float(os.getenv("RESERVATION_SWEEP_INTERVAL", "5"))
+RESERVATION_SWEEP_BATCH = int(os.getenv("RESERVATION_SWEEP_BATCH", "1000"))
+
+logger = logging.getLogger(__name__)
+
+# Корзины, занятые запросами, пропускаются (SKIP LOCKED) до следующего прохода.
+# Товары блокируются в порядке id, как в CHECKOUT_SQL
+SWEEP_SQL = """
+    WITH expired AS (
+        SELECT ci.id, ci.product_id, ci.reserved
+        FROM cart_items ci
+        JOIN cart c ON c.id = ci.cart_id
+        WHERE ci.reserved > 0 AND ci.reserved_until <= %(now)s
+        ORDER BY ci.reserved_until
+        LIMIT %(batch)s
+        FOR UPDATE OF ci, c SKIP LOCKED
+    ),
+    released AS (
+        SELECT product_id, SUM(reserved)::int AS reserved
+        FROM expired
+        GROUP BY product_id
+    ),
+    locked AS (
+        SELECT p.id
+        FROM products p
+        WHERE p.id IN (SELECT product_id FROM released)
+        ORDER BY p.id
+        FOR UPDATE OF p
+    ),
+    products_released AS (
+        UPDATE products p
+        SET reserved = p.reserved - r.reserved
+        FROM released r JOIN locked l ON l.id = r.product_id
+        WHERE p.id = r.product_id
+    ),
+    lines_released AS (
+        UPDATE cart_items ci
+        SET reserved = 0
+        FROM expired e
+        WHERE ci.id = e.id
+    )
+    SELECT count(*) AS lines, COALESCE(SUM(reserved), 0)::int AS units FROM expired
+"""
+
+# Пересчёт счётчика из строк корзин; SHARE-блокировка ждёт пишущие транзакции и не пускает новые
+RECONCILE_SQL = """
+    UPDATE products p
+    SET reserved = COALESCE(h.reserved, 0)
+    FROM products q
+    LEFT JOIN (
+        SELECT product_id, SUM(reserved)::int AS reserved
+        FROM cart_items
+        WHERE reserved > 0
+        GROUP BY product_id
+    ) h ON h.product_id = q.id
+    WHERE p.id = q.id AND p.reserved <> COALESCE(h.reserved, 0)
+    RETURNING p.id
+"""
+
+
+def hold_until(ttl=STOCK_RESERVATION_TTL):
+    """reserved_until for holds taken or extended now."""
+    return datetime.utcnow() + timedelta(seconds=ttl)
+
+
+def sweep_batch(db, batch=RESERVATION_SWEEP_BATCH, now=None):
+    """Release up to `batch` expired holds in one transaction; returns (lines, units)."""
+    with db.cursor() as cursor:
+        cursor.execute(SWEEP_SQL, {"now": now or datetime.utcnow(), "batch": batch})
+        row = cursor.fetchone()
+    db.commit()
+    return row["lines"], row["units"]
+
+
+def reconcile(db):
+    """Recompute products.reserved from the cart lines; returns the ids of products that had drifted.
+
+    Holds can only drift if cart lines are deleted behind the app's back
+    (deleting a user cascades to their cart).
+    """
+    with db.cursor() as cursor:
+        cursor.execute("LOCK TABLE cart_items IN SHARE MODE")
+        cursor.execute(RECONCILE_SQL)
+        fixed = [row["id"] for row in cursor.fetchall()]
+    db.commit()
+    return fixed
+
+
+class ReservationSweeper:
+    """Background asyncio task releasing expired holds in batches."""
+
+    def __init__(self, interval=RESERVATION_SWEEP_INTERVAL, batch_size=RESERVATION_SWEEP_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+        self.sweeps = 0
+        self.batches = 0
+        self.released_lines = 0
+        self.released_units = 0
+        self.errors = 0
+        self.last_sweep_seconds = None
+
+    def start(self):
+        """Start the sweep task; call from the event loop (async startup hook)."""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if not self._stopping:
+                await self.sweep()
+
+    async def sweep(self):
+        """Release every hold expired by now, batch by batch."""
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        while True:
+            try:
+                lines, units = await run_db(sweep_batch, self.batch_size, now)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                logger.error("Error releasing expired stock reservations: %s", e)
+                return
+            with self._lock:
+                self.batches += 1
+                self.released_lines += lines
+                self.released_units += units
+            if lines:
+                logger.debug("Released %d expired holds (%d units)", lines, units)
+            # Неполная пачка: истёкшие кончились или остались только занятые корзины
+            if lines < self.batch_size:
+                break
+        with self._lock:
+            self.sweeps += 1
+            self.last_sweep_seconds = round(time.perf_counter() - started, 6)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ttl_seconds": STOCK_RESERVATION_TTL,
+                "interval": self.interval,
+                "batch_size": self.batch_size,
+                "sweeps": self.sweeps,
+                "batches": self.batches,
+                "released_lines": self.released_lines,
+                "released_units": self.released_units,
+                "errors": self.errors,
+                "last_sweep_seconds": self.last_sweep_seconds,
+            }
+
+
+reservation_sweeper = ReservationSweeper()
@@ -0,0 +1,214 @@
+"""Sample data for local development; run with `python migrate.py seed`."""
+import psycopg2
+
+from passwords import pwd_context
+from recommendations import activate, create_version, insert_popular
+
+
+def drop_all_tables(db: psycopg2.extensions.connection):
+    try:
+        with db.cursor() as cursor:
+            cursor.execute(
+            """
+                DROP TABLE IF EXISTS users CASCADE;
+                DROP TABLE IF EXISTS categories CASCADE;
+                DROP TABLE IF EXISTS products CASCADE;
+                DROP TABLE IF EXISTS cart CASCADE;
+                DROP TABLE IF EXISTS cart_items CASCADE;
+                DROP TABLE IF EXISTS orders CASCADE;
+                DROP TABLE IF EXISTS order_items CASCADE;
+                DROP TABLE IF EXISTS user_logs CASCADE;
+                DROP TABLE IF EXISTS recommendations CASCADE;
+                DROP TABLE IF EXISTS recommendation_active CASCADE;
+                DROP TABLE IF EXISTS recommendation_items CASCADE;
+                DROP TABLE IF EXISTS recommendation_versions CASCADE;
+                DROP TABLE IF EXISTS recommendation_watermarks CASCADE;
+                DROP TABLE IF EXISTS user_item_interactions CASCADE;
+                DROP TABLE IF EXISTS item_cooccurrence CASCADE;
+                DROP TABLE IF EXISTS seller_forecast_active CASCADE;
+                DROP TABLE IF EXISTS seller_forecast_items CASCADE;
+                DROP TABLE IF EXISTS seller_forecast_versions CASCADE;
+                DROP TABLE IF EXISTS idempotency_keys CASCADE;
+                DROP TABLE IF EXISTS schema_version CASCADE;
+            """)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error dropping tables: {e}")
+
+
+def insert_sample_data(db: psycopg2.extensions.connection):
+    print("Inserting sample data into categories and products...")
+    cursor = db.cursor()
+    # У всех тестовых пользователей один пароль — хватит одного bcrypt
+    sample_password_hash = pwd_context.hash("password123")
+    try:
+        cursor.execute("""
+            -- Заполнение таблицы пользователей
+            INSERT INTO users (name, email, password, role)
+            VALUES
+                ('Иван Иванов', 'ivanov@example.com', %s, 'покупатель'),
+                ('Мария Петрова', 'petrova@example.com', %s, 'покупатель'),
+                ('Алексей Сидоров', 'sidorov@example.com', %s, 'администратор'),
+                ('Наталья Смирнова', 'smirnova@example.com', %s, 'покупатель'),
+                ('Дмитрий Кузнецов', 'kuznetsov@example.com', %s, 'покупатель'),
+                ('Ольга Васильева', 'vasilieva@example.com', %s, 'покупатель'),
+                ('Екатерина Зайцева', 'zaytseva@example.com', %s, 'покупатель'),
+                ('Игорь Беляев', 'belyaev@example.com', %s, 'покупатель'),
+                ('Марина Орлова', 'orlova@example.com', %s, 'покупатель'),
+                ('Юрий Михайлов', 'mikhaylov@example.com', %s, 'администратор'),
+                ('Татьяна Федорова', 'fedorova@example.com', %s, 'покупатель'),
+                ('Константин Соловьев', 'solovyov@example.com', %s, 'покупатель')
+            ON CONFLICT (email) DO NOTHING;
+        """, (sample_password_hash,) * 12)
+
+        
+        cursor.execute("""
+            INSERT INTO categories (name, parent_id)
+            VALUES
+                ('Электроника', NULL),
+                ('Одежда', NULL),
+                ('Обувь', NULL),
+                ('Товары для дома', NULL),
+                ('Товары для детей', NULL)
+            ON CONFLICT (name) DO NOTHING;
+        """)
+
+        
+        cursor.execute("""
+            SELECT id, name FROM categories WHERE name IN (
+                'Электроника', 'Одежда', 'Обувь', 'Товары для дома', 'Товары для детей'
+            );
+        """)
+        parent_categories = {row['name']: row['id'] for row in cursor.fetchall()}
+
+        
+        cursor.execute("""
+            INSERT INTO categories (name, parent_id)
+            VALUES
+                ('Компьютеры', %(electronics_id)s),
+                ('Смартфоны', %(electronics_id)s),
+                ('Телевизоры', %(electronics_id)s),
+                ('Мужская одежда', %(clothing_id)s),
+                ('Женская одежда', %(clothing_id)s),
+                ('Спортивная обувь', %(shoes_id)s),
+                ('Повседневная обувь', %(shoes_id)s),
+                ('Мебель', %(home_goods_id)s),
+                ('Декор', %(home_goods_id)s),
+                ('Кухня', %(home_goods_id)s),
+                ('Игрушки', %(kids_goods_id)s),
+                ('Детская одежда', %(kids_goods_id)s)
+            ON CONFLICT (name) DO NOTHING;
+        """, {
+            'electronics_id': parent_categories['Электроника'],
+            'clothing_id': parent_categories['Одежда'],
+            'shoes_id': parent_categories['Обувь'],
+            'home_goods_id': parent_categories['Товары для дома'],
+            'kids_goods_id': parent_categories['Товары для детей']
+        })
+
+        
+        cursor.execute("SELECT id, name FROM categories;")
+        categories = {row['name']: row['id'] for row in cursor.fetchall()}
+
+        
+        cursor.execute("""
+            INSERT INTO products (name, description, price, stock, category_id, attributes)
+            VALUES
+                ('Ноутбук', 'Мощный ноутбук для работы и игр', 50000.00, 10, %(computers_id)s, '{"color": "черный", "processor": "Intel i7", "ram": "16GB"}'),
+                ('Смартфон', 'Современный смартфон с отличной камерой', 25000.00, 15, %(smartphones_id)s, '{"color": "белый", "camera": "12MP", "battery": "4000mAh"}'),
+                ('Телевизор', 'Ультра HD телевизор с поддержкой Smart TV', 35000.00, 8, %(tvs_id)s, '{"size": "55 inch", "type": "LED", "resolution": "4K"}'),
+                ('Футболка', 'Стильная мужская футболка', 1500.00, 50, %(mens_clothing_id)s, '{"size": "M", "color": "синий"}'),
+                ('Платье', 'Элегантное платье для особых случаев', 3000.00, 30, %(womens_clothing_id)s, '{"size": "S", "color": "красный"}'),
+                ('Кроссовки', 'Удобные кроссовки для спорта', 4000.00, 25, %(sports_shoes_id)s, '{"size": "42", "color": "черный"}'),
+                ('Сандалии', 'Летние сандалии для отдыха', 2000.00, 40, %(casual_shoes_id)s, '{"size": "38", "color": "бежевый"}'),
+                ('Кресло', 'Удобное кресло для офиса', 8000.00, 15, %(furniture_id)s, '{"color": "черный", "material": "кожа"}'),
+                ('Кровать', 'Комфортная двуспальная кровать с матрасом', 25000.00, 20, %(furniture_id)s, '{"material": "дерево", "size": "King"}'),
+                ('Игрушечный робот', 'Интерактивный робот для детей', 1500.00, 50, %(toys_id)s, '{"battery": "AA", "color": "красный"}'),
+                ('Детская футболка', 'Яркая футболка для детей', 800.00, 60, %(kids_clothing_id)s, '{"size": "L", "color": "голубой"}'),
+                ('aaaaa', 'sadf', 800.00, 60, %(kids_clothing_id)s, '{"size": "L", "color": "blue"}')
+            ON CONFLICT (name) DO NOTHING;
+        """, {
+            'computers_id': categories['Компьютеры'],
+            'smartphones_id': categories['Смартфоны'],
+            'tvs_id': categories['Телевизоры'],
+            'mens_clothing_id': categories['Мужская одежда'],
+            'womens_clothing_id': categories['Женская одежда'],
+            'sports_shoes_id': categories['Спортивная обувь'],
+            'casual_shoes_id': categories['Повседневная обувь'],
+            'furniture_id': categories['Мебель'],
+            'toys_id': categories['Игрушки'],
+            'kids_clothing_id': categories['Детская одежда']
+        })
+
+        cursor.execute("""
+                -- Заполнение таблицы корзин
+                INSERT INTO cart (user_id)
+                VALUES
+                    (1), (2), (3), (4), (5),
+                    (6), (7), (8), (9), (10);
+
+                -- Заполнение таблицы товаров в корзине
+                INSERT INTO cart_items (cart_id, product_id, quantity)
+                VALUES
+                    (1, 1, 1), (1, 2, 2), (2, 3, 1), (2, 4, 3), (3, 5, 1),
+                    (3, 6, 1), (4, 7, 1), (4, 8, 2), (5, 9, 1), (6, 10, 1),
+                    (7, 11, 2), (8, 12, 1);
+
+                -- Заполнение таблицы заказов
+                INSERT INTO orders (user_id, total_amount, status, payment_id)
+                VALUES
+                    (1, 55000.00, 'в обработке', 'payment_1'),
+                    (2, 70000.00, 'отправлен', 'payment_2'),
+                    (3, 30000.00, 'доставлен', 'payment_3'),
+                    (4, 12000.00, 'в обработке', 'payment_4'),
+                    (5, 10000.00, 'отправлен', 'payment_5'),
+                    (6, 8000.00, 'доставлен', 'payment_6'),
+                    (7, 25000.00, 'в обработке', 'payment_7'),
+                    (8, 20000.00, 'отправлен', 'payment_8'),
+                    (9, 15000.00, 'доставлен', 'payment_9'),
+                    (10, 40000.00, 'в обработке', 'payment_10');
+
+                -- Заполнение таблицы товаров в заказе
+                INSERT INTO order_items (order_id, product_id, quantity, price)
+                VALUES
+                    (1, 1, 1, 50000.00), (1, 2, 2, 1500.00),
+                    (2, 3, 1, 35000.00), (2, 4, 3, 1500.00),
+                    (3, 5, 1, 3000.00), (3, 6, 1, 4000.00),
+                    (4, 7, 1, 2000.00), (4, 8, 2, 1000.00),
+                    (5, 9, 1, 8000.00), (6, 10, 1, 1500.00),
+                    (7, 11, 2, 1500.00), (8, 12, 1, 12000.00);
+
+                -- Заполнение таблицы логов пользователей
+                INSERT INTO user_logs (user_id, action, product_id)
+                VALUES
+                    (1, 'Добавил товар в корзину', 1), (1, 'Перешел к оформлению заказа', NULL),
+                    (2, 'Просмотрел товар', 3), (2, 'Добавил товар в корзину', 4),
+                    (3, 'Удалил товар из корзины', 5), (4, 'Перешел к оформлению заказа', NULL),
+                    (5, 'Добавил товар в корзину', 7), (6, 'Просмотрел товар', 9),
+                    (7, 'Добавил товар в корзину', 11), (8, 'Удалил товар из корзины', 12);
+
+                -- Заполнение таблицы рекомендаций
+                INSERT INTO recommendations (user_id, product_id)
+                VALUES
+                    (1, 2), (1, 3), (2, 4), (3, 5),
+                    (4, 6), (5, 7), (6, 8), (7, 9),
+                    (8, 10), (9, 11), (10, 12);
+""")
+
+        # Публикуем рекомендации как версию хранилища, которое читает /recommendations
+        version = create_version(cursor, "sample data")
+        cursor.execute("""
+            INSERT INTO recommendation_items (version, user_id, rank, product_id)
+            SELECT %s, user_id, row_number() OVER (PARTITION BY user_id ORDER BY id), product_id
+            FROM recommendations
+        """, (version,))
+        insert_popular(cursor, version)
+        activate(cursor, version)
+
+        db.commit()
+        print("Sample data inserted successfully!")
+    except Exception as e:
+        print(f"Error inserting sample data: {e}")
+    finally:
+        cursor.close()
\ No newline at end of file
@@ -0,0 +1,56 @@
+"""Versioned store of monthly sales forecasts per shop.
+
+Works like recommendations.py: ml/batch_forecast.py COPYs a complete version
+into seller_forecast_items and then repoints seller_forecast_active in one
+short transaction.
+"""
+import io
+import os
+
+
+SELLER_FORECAST_KEEP_VERSIONS = int(os.getenv("SELLER_FORECAST_KEEP_VERSIONS", "2"))
+SELLER_FORECAST_TOP_K = int(os.getenv("SELLER_FORECAST_TOP_K", "10"))
+COPY_CHUNK_ROWS = 50_000
+
+
+def create_version(cursor, source):
+    cursor.execute("INSERT INTO seller_forecast_versions (source) VALUES (%s) RETURNING version", (source,))
+    row = cursor.fetchone()
+    return row["version"] if isinstance(row, dict) else row[0]
+
+
+def copy_rows(cursor, version, rows):
+    """COPY (shop_id, rank, item_id, product_id or None, predicted) tuples into a version; returns the row count."""
+    count = 0
+    buffer = io.StringIO()
+    for shop_id, rank, item_id, product_id, predicted in rows:
+        buffer.write("%d\t%d\t%d\t%d\t%s\t%r\n" % (
+            version, shop_id, rank, item_id, "\\N" if product_id is None else product_id, float(predicted)))
+        count += 1
+        if count % COPY_CHUNK_ROWS == 0:
+            _flush(cursor, buffer)
+            buffer = io.StringIO()
+    _flush(cursor, buffer)
+    return count
+
+
+def _flush(cursor, buffer):
+    if buffer.tell():
+        buffer.seek(0)
+        cursor.copy_expert("COPY seller_forecast_items (version, shop_id, rank, item_id, product_id, predicted) "
+                           "FROM STDIN", buffer)
+
+
+def activate(cursor, version, keep=SELLER_FORECAST_KEEP_VERSIONS):
+    """Point readers at `version` and drop all but the `keep` newest versions."""
+    cursor.execute("""
+        UPDATE seller_forecast_versions
+        SET row_count = (SELECT count(*) FROM seller_forecast_items WHERE version = %(version)s)
+        WHERE version = %(version)s
+    """, {"version": version})
+    cursor.execute("UPDATE seller_forecast_active SET version = %s", (version,))
+    cursor.execute("""
+        DELETE FROM seller_forecast_versions
+        WHERE version <> %(version)s
+          AND version NOT IN (SELECT version FROM seller_forecast_versions ORDER BY version DESC LIMIT %(keep)s)
+    """, {"version": version, "keep": keep})
@@ -0,0 +1,122 @@
+"""Item-to-item similarity over a memory-mapped float32 matrix.
+
+ml/build_similarity_index.py writes the index: L2-normalized item vectors
+(model embeddings or a TF-IDF fallback) in vectors.npy and the product id of
+each row in product_ids.npy. Workers map the file read-only, so the page
+cache holds one copy however many uvicorn processes serve it.
+"""
+import logging
+import os
+import threading
+
+import numpy as np
+
+
+SIMILARITY_INDEX_PATH = os.getenv("SIMILARITY_INDEX_PATH", "similarity_index")
+# Сколько строк матрицы умножается за раз: ограничивает память под блок оценок
+SIMILARITY_BLOCK_ROWS = int(os.getenv("SIMILARITY_BLOCK_ROWS", "65536"))
+
+logger = logging.getLogger(__name__)
+
+
+class SimilarityIndexMissing(Exception):
+    pass
+
+
+def top_k_blocked(queries, vectors, k, exclude=None, block_rows=SIMILARITY_BLOCK_ROWS):
+    """Best k rows of `vectors` by dot product for each query row.
+
+    Scores one block of rows at a time and merges each block's argpartition
+    candidates into a running top-k, so memory is O(queries * block_rows).
+    `exclude` holds one row per query to skip (the query item itself).
+    Returns (rows, scores), each (queries, k), best first.
+    """
+    queries = np.atleast_2d(queries)
+    total = vectors.shape[0]
+    k = min(k, total - (exclude is not None))
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    for start in range(0, total, block_rows):
+        scores = queries @ vectors[start:start + block_rows].T
+        if exclude is not None:
+            inside = (exclude >= start) & (exclude < start + scores.shape[1])
+            scores[np.nonzero(inside)[0], exclude[inside] - start] = -np.inf
+        take = min(k, scores.shape[1])
+        picked = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+        rows = np.concatenate([best_rows, picked + start], axis=1)
+        merged = np.concatenate([best_scores, np.take_along_axis(scores, picked, axis=1)], axis=1)
+        if merged.shape[1] > k:
+            keep = np.argpartition(-merged, k - 1, axis=1)[:, :k]
+            rows = np.take_along_axis(rows, keep, axis=1)
+            merged = np.take_along_axis(merged, keep, axis=1)
+        best_rows, best_scores = rows, merged
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class SimilarityIndex:
+    """Lazily loaded index; similar() raises SimilarityIndexMissing until one is built."""
+
+    def __init__(self, path=SIMILARITY_INDEX_PATH, block_rows=SIMILARITY_BLOCK_ROWS):
+        self.path = path
+        self.block_rows = block_rows
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._product_ids = None
+        self._rows = None
+        self.queries = 0
+
+    def load(self):
+        vectors_path = os.path.join(self.path, "vectors.npy")
+        if not os.path.exists(vectors_path):
+            raise SimilarityIndexMissing(f"No similarity index at {self.path}")
+        vectors = np.load(vectors_path, mmap_mode="r")
+        product_ids = np.load(os.path.join(self.path, "product_ids.npy"))
+        with self._lock:
+            self._vectors = vectors
+            self._product_ids = product_ids
+            self._rows = {int(product_id): row for row, product_id in enumerate(product_ids)}
+        logger.info("Similarity index: %d items x %d dims from %s", vectors.shape[0], vectors.shape[1], self.path)
+
+    def _ensure_loaded(self):
+        if self._vectors is None:
+            self.load()
+
+    def __contains__(self, product_id):
+        self._ensure_loaded()
+        return product_id in self._rows
+
+    def similar_many(self, product_ids, k):
+        """[(product_id, score)] lists for each product id, or None for ids not in the index."""
+        self._ensure_loaded()
+        known = [(i, self._rows[product_id]) for i, product_id in enumerate(product_ids) if product_id in self._rows]
+        result = [None] * len(product_ids)
+        if not known:
+            return result
+        rows = np.array([row for _, row in known], dtype=np.int64)
+        best_rows, best_scores = top_k_blocked(self._vectors[rows], self._vectors, k, exclude=rows,
+                                               block_rows=self.block_rows)
+        for (i, _), picked, scores in zip(known, best_rows, best_scores):
+            result[i] = list(zip(self._product_ids[picked].tolist(), scores.tolist()))
+        with self._lock:
+            self.queries += len(known)
+        return result
+
+    def similar(self, product_id, k):
+        return self.similar_many([product_id], k)[0]
+
+    def stats(self):
+        with self._lock:
+            if self._vectors is None:
+                return {"loaded": False, "path": self.path, "queries": self.queries}
+            return {
+                "loaded": True,
+                "path": self.path,
+                "items": int(self._vectors.shape[0]),
+                "dims": int(self._vectors.shape[1]),
+                "bytes": int(self._vectors.nbytes),
+                "queries": self.queries,
+            }
+
+
+similarity_index = SimilarityIndex()
@@ -0,0 +1,199 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from fastapi import Request, Response
+
+from cache import etag_matches
+
+try:
+    import brotli
+except ImportError:
+    # Без пакета brotli отдаются только gzip и несжатый вариант
+    brotli = None
+
+
+STATIC_DIR = os.getenv("STATIC_DIR", "static")
+# Только для разработки: файл перечитывается, если изменился на диске
+STATIC_RELOAD = os.getenv("STATIC_RELOAD", "0") == "1"
+STATIC_CACHE_CONTROL = os.getenv("STATIC_CACHE_CONTROL", "public, max-age=60")
+# 11 — максимальное сжатие; на все страницы это около 60 мс при старте воркера
+STATIC_BROTLI_QUALITY = int(os.getenv("STATIC_BROTLI_QUALITY", "11"))
+STATIC_MIN_COMPRESS_BYTES = 256
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+class StaticAsset:
+    """One file held in memory with its precompressed variants and their strong ETags."""
+
+    def __init__(self, path, body):
+        stat = os.stat(path)
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if content_type.startswith("text/"):
+            content_type += "; charset=utf-8"
+        self.content_type = content_type
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        # encoding -> (body, etag); у каждого варианта свой ETag, иначе он не был бы strong
+        self.variants = {"identity": (body, '"%s"' % digest)}
+        if content_type.startswith(COMPRESSIBLE_TYPES) and len(body) >= STATIC_MIN_COMPRESS_BYTES:
+            compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed["br"] = brotli.compress(body, quality=STATIC_BROTLI_QUALITY)
+            for encoding, data in compressed.items():
+                if len(data) < len(body):
+                    self.variants[encoding] = (data, '"%s-%s"' % (digest, encoding))
+
+    def changed_on_disk(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return True
+        return stat.st_mtime_ns != self.mtime_ns or stat.st_size != self.size
+
+
+def accepted_encodings(header):
+    """Content codings from Accept-Encoding mapped to their q-values."""
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(accepted, available):
+    """The available coding with the highest q, br before gzip before identity on ties; None if none is acceptable.
+
+    A coding not named in Accept-Encoding gets the q of "*" (0 if there is
+    none), except identity, which is acceptable unless excluded by
+    "identity;q=0" or "*;q=0". An empty header accepts only identity.
+    """
+    best, best_q = None, 0.0
+    for encoding in ("br", "gzip", "identity"):
+        if encoding not in available:
+            continue
+        default = accepted.get("*", 1.0 if encoding == "identity" else 0.0)
+        q = accepted.get(encoding, default)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class StaticFilesCache:
+    """Files under STATIC_DIR, loaded and compressed once at startup and served from memory.
+
+    The response variant (br, gzip or identity) is picked from
+    Accept-Encoding by q-value, with 406 if none is acceptable;
+    If-None-Match with the variant's ETag gets 304. With STATIC_RELOAD=1
+    every request checks the file's mtime and reloads it, so edits show up
+    without a restart.
+    """
+
+    def __init__(self, directory=STATIC_DIR, reload=STATIC_RELOAD, cache_control=STATIC_CACHE_CONTROL):
+        self.directory = directory
+        self.reload = reload
+        self.cache_control = "no-cache" if reload else cache_control
+        self._lock = threading.Lock()
+        self._assets = {}  # путь относительно directory -> StaticAsset
+        self.responses = 0
+        self.not_modified = 0
+        self.reloads = 0
+
+    def _read(self, name):
+        path = os.path.join(self.directory, name)
+        with open(path, "rb") as file:
+            return StaticAsset(path, file.read())
+
+    def load(self):
+        assets = {}
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                name = os.path.relpath(os.path.join(root, filename), self.directory).replace(os.sep, "/")
+                assets[name] = self._read(name)
+        with self._lock:
+            self._assets = assets
+        return len(assets)
+
+    def _reload(self, name, asset):
+        path = os.path.realpath(os.path.join(self.directory, name))
+        # Новые файлы подхватываются только внутри каталога
+        if not path.startswith(os.path.realpath(self.directory) + os.sep) or not os.path.isfile(path):
+            asset = None
+        elif asset is None or asset.changed_on_disk():
+            asset = self._read(name)
+        else:
+            return asset
+        with self._lock:
+            if asset is None:
+                self._assets.pop(name, None)
+            else:
+                self._assets[name] = asset
+                self.reloads += 1
+        return asset
+
+    def get(self, name):
+        with self._lock:
+            asset = self._assets.get(name)
+        if self.reload:
+            asset = self._reload(name, asset)
+        return asset
+
+    def response(self, request: Request, name):
+        asset = self.get(name)
+        if asset is None:
+            return Response(status_code=404, content="Not Found", media_type="text/plain")
+        encoding = choose_encoding(accepted_encodings(request.headers.get("accept-encoding", "")), asset.variants)
+        headers = {"Cache-Control": self.cache_control}
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if encoding is None:
+            # identity;q=0 и ни одного подходящего сжатого варианта
+            headers["Vary"] = "Accept-Encoding"
+            return Response(status_code=406, content="Not Acceptable", media_type="text/plain", headers=headers)
+        body, etag = asset.variants[encoding]
+        headers["ETag"] = etag
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        if_none_match = request.headers.get("if-none-match")
+        with self._lock:
+            self.responses += 1
+            if if_none_match is not None and etag_matches(if_none_match, etag):
+                self.not_modified += 1
+                return Response(status_code=304, headers=headers)
+        if request.method == "HEAD":
+            return Response(media_type=asset.content_type, headers={**headers, "Content-Length": str(len(body))})
+        return Response(content=body, media_type=asset.content_type, headers=headers)
+
+    def stats(self):
+        with self._lock:
+            assets = list(self._assets.values())
+            return {
+                "files": len(assets),
+                "reload": self.reload,
+                "brotli": brotli is not None,
+                "bytes": {
+                    encoding: sum(len(asset.variants.get(encoding, asset.variants["identity"])[0]) for asset in assets)
+                    for encoding in ("identity", "gzip", "br")
+                },
+                "responses": self.responses,
+                "not_modified": self.not_modified,
+                "reloads": self.reloads,
+            }
+
+
+static_files = StaticFilesCache()
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# Модули приложения импортируются так же, как в контейнере: из каталога app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Тесты с базой: отдельная база, в которую применены миграции; без неё они пропускаются
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+# Потоковая реплика этой базы, для проверок с настоящим отставанием (нужен суперпользователь)
+TEST_REPLICA_DATABASE_URL = os.getenv("TEST_REPLICA_DATABASE_URL")
+
+
+@pytest.fixture
+def dsn():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    return TEST_DATABASE_URL
+
+
+@pytest.fixture
+def replica_dsn(dsn):
+    if not TEST_REPLICA_DATABASE_URL:
+        pytest.skip("TEST_REPLICA_DATABASE_URL is not set")
+    return TEST_REPLICA_DATABASE_URL
@@ -0,0 +1,217 @@
+import asyncio
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from admission import AdmissionClass, AdmissionController, AdmissionMiddleware, TokenBuckets
+
+
+def make_class(limit=2, max_limit=4, queue=2, target_ms=100, queue_timeout_ms=1000, **kwargs):
+    return AdmissionClass("test", limit=limit, max_limit=max_limit, target_ms=target_ms, queue=queue,
+                          rate=1, burst=1, queue_timeout_ms=queue_timeout_ms, **kwargs)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_bucket_allows_burst_then_waits_for_refill():
+    buckets = TokenBuckets(rate=2, burst=3)
+    assert [buckets.take("a", now=0) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take("a", now=0) == 0.5
+    assert buckets.take("a", now=0.5) == 0
+    # Ключи независимы, а простой не копит токенов больше burst
+    assert buckets.take("b", now=0.5) == 0
+    assert [buckets.take("a", now=100) for _ in range(4)] == [0, 0, 0, 0.5]
+
+
+def test_bucket_forgets_least_recently_used_keys():
+    buckets = TokenBuckets(rate=1, burst=1, max_keys=2)
+    buckets.take("a", now=0)
+    buckets.take("b", now=0)
+    buckets.take("a", now=0)
+    buckets.take("c", now=0)
+    assert len(buckets) == 2
+    assert buckets.take("a", now=0) > 0
+    assert buckets.take("b", now=0) == 0
+
+
+def observe(admission_class, seconds, count):
+    for _ in range(count):
+        admission_class._observe(seconds)
+
+
+def test_limit_decreases_when_a_tenth_is_slow():
+    admission_class = make_class(limit=8, max_limit=16)
+    observe(admission_class, 0.01, 8)
+    observe(admission_class, 0.5, 2)
+    assert admission_class.limit == 6
+    assert admission_class.decreases == 1
+    # Один медленный из десяти — не больше десятой доли
+    observe(admission_class, 0.01, 9)
+    observe(admission_class, 0.5, 1)
+    assert admission_class.limit == 6
+
+
+def test_limit_does_not_go_below_min_limit():
+    admission_class = make_class(limit=2, min_limit=2)
+    observe(admission_class, 0.5, 10)
+    assert admission_class.limit == 2
+    assert admission_class.decreases == 0
+
+
+def test_limit_increases_only_when_saturated():
+    admission_class = make_class(limit=2, max_limit=3)
+    observe(admission_class, 0.01, 10)
+    assert admission_class.limit == 2
+
+    async def saturate():
+        limit = admission_class.limit
+        for _ in range(limit):
+            assert await admission_class.acquire()
+        for _ in range(limit):
+            admission_class.release(0.01)
+        return limit
+
+    observe(admission_class, 0.01, 10 - run(saturate()))
+    assert admission_class.limit == 3
+    # Дальше max_limit не растёт
+    observe(admission_class, 0.01, 10 - run(saturate()))
+    assert admission_class.limit == 3
+    assert admission_class.increases == 1
+
+
+def test_slot_is_handed_to_waiters_in_order():
+    admission_class = make_class(limit=1, queue=2)
+
+    async def scenario():
+        assert await admission_class.acquire()
+        order = []
+
+        async def wait(name):
+            order.append((name, await admission_class.acquire()))
+
+        tasks = [asyncio.create_task(wait("first")), asyncio.create_task(wait("second"))]
+        await asyncio.sleep(0)
+        assert admission_class.stats()["waiting"] == 2
+        admission_class.release(0.01)
+        await asyncio.sleep(0)
+        # Слот перешёл первому в очереди, новый запрос его не перехватывает
+        assert order == [("first", True)]
+        assert admission_class.in_flight == 1
+        admission_class.release(0.01)
+        await asyncio.gather(*tasks)
+        assert order == [("first", True), ("second", True)]
+        admission_class.release(0.01)
+
+    run(scenario())
+    assert admission_class.in_flight == 0
+    assert admission_class.stats()["admitted"] == 3
+    assert admission_class.stats()["queued"] == 2
+
+
+def test_full_queue_is_rejected_at_once():
+    admission_class = make_class(limit=1, queue=1)
+
+    async def scenario():
+        assert await admission_class.acquire()
+        waiter = asyncio.create_task(admission_class.acquire())
+        await asyncio.sleep(0)
+        assert not await admission_class.acquire()
+        admission_class.release(0.01)
+        assert await waiter
+        admission_class.release(0.01)
+
+    run(scenario())
+    assert admission_class.rejected_full == 1
+
+
+def test_wait_past_the_deadline_is_rejected():
+    admission_class = make_class(limit=1, queue=2, queue_timeout_ms=20)
+
+    async def scenario():
+        assert await admission_class.acquire()
+        assert not await admission_class.acquire()
+        assert admission_class.stats()["waiting"] == 0
+        admission_class.release(0.01)
+
+    run(scenario())
+    assert admission_class.rejected_timeout == 1
+    assert admission_class.in_flight == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    admission_class = make_class(limit=1, queue=2)
+
+    async def scenario():
+        assert await admission_class.acquire()
+        waiter = asyncio.create_task(admission_class.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert admission_class.stats()["waiting"] == 0
+        admission_class.release(0.01)
+
+    run(scenario())
+    assert admission_class.in_flight == 0
+
+
+def test_slot_handed_to_a_cancelled_waiter_is_returned():
+    admission_class = make_class(limit=1, queue=2)
+
+    async def scenario():
+        assert await admission_class.acquire()
+        waiter = asyncio.create_task(admission_class.acquire())
+        await asyncio.sleep(0)
+        admission_class.release(0.01)
+        # Слот уже передан, но задача отменена раньше, чем продолжилась
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+    run(scenario())
+    assert admission_class.in_flight == 0
+
+
+def test_retry_after_grows_with_the_queue():
+    admission_class = make_class(limit=1, queue=10, target_ms=2000)
+    assert admission_class.retry_after() == 1
+
+    async def scenario():
+        assert await admission_class.acquire()
+        waiters = [asyncio.create_task(admission_class.acquire()) for _ in range(4)]
+        await asyncio.sleep(0)
+        retry_after = admission_class.retry_after()
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return retry_after
+
+    assert run(scenario()) == 5
+
+
+def app_with(admission_class):
+    async def item(request):
+        return PlainTextResponse("ok")
+
+    routes = [Route("/users/{user_id}/items", item), Route("/free", item)]
+    controller = AdmissionController(classes={"test": admission_class})
+    controller.assign("test", ("GET", "/users/{user_id}/items"))
+    app = Starlette(routes=routes)
+    app.add_middleware(AdmissionMiddleware, routes=routes, controller=controller)
+    return app
+
+
+def test_middleware_rate_limits_per_user():
+    admission_class = AdmissionClass("test", limit=4, max_limit=4, target_ms=100, queue=0, rate=0.5, burst=2)
+    client = TestClient(app_with(admission_class))
+    assert client.get("/users/1/items").status_code == 200
+    # Ведро адреса ещё не пусто, но у пользователя 1 токенов больше нет
+    admission_class.buckets.take(("user", "1"))
+    response = client.get("/users/1/items")
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "2"
+    assert client.get("/free").status_code == 200
+    assert admission_class.rate_limited == 1
+    assert admission_class.in_flight == 0
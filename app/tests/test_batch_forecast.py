@@ -0,0 +1,51 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "ml"))
+
+from batch_forecast import id_rows, top_k_per_group
+
+
+def brute_force(groups, scores, k):
+    """Per group, stable sort by score descending: the groupby().apply(sort_values) the lexsort replaced."""
+    indices, ranks = [], []
+    for group in sorted(set(groups.tolist())):
+        rows = sorted(np.flatnonzero(groups == group).tolist(), key=lambda row: -scores[row])
+        rows = rows[:k] if k else rows
+        indices += rows
+        ranks += range(1, len(rows) + 1)
+    return indices, ranks
+
+
+@pytest.mark.parametrize("k", [0, 1, 3, 100])
+def test_matches_brute_force(k):
+    rng = np.random.default_rng(0)
+    groups = rng.integers(0, 7, 200)
+    # Округление даёт одинаковые оценки внутри группы: проверяется порядок при равенстве
+    scores = np.round(rng.random(200), 1).astype(np.float32)
+    order, ranks = top_k_per_group(groups, scores, k)
+    expected_order, expected_ranks = brute_force(groups, scores, k)
+    assert order.tolist() == expected_order
+    assert ranks.tolist() == expected_ranks
+
+
+def test_small_example():
+    groups = np.array([5, 2, 5, 2, 5])
+    scores = np.array([1.0, 3.0, 2.0, 3.0, 0.5])
+    order, ranks = top_k_per_group(groups, scores, 2)
+    assert order.tolist() == [1, 3, 2, 0]
+    assert ranks.tolist() == [1, 2, 1, 2]
+
+
+def test_empty_input():
+    order, ranks = top_k_per_group(np.array([], dtype=np.int64), np.array([], dtype=np.float32), 5)
+    assert len(order) == 0 and len(ranks) == 0
+
+
+def test_id_rows():
+    ids = np.array([3, 10, -1, 7])
+    assert id_rows(None, ids, 8).tolist() == [3, -1, -1, 7]
+    assert id_rows(np.array([7, 3, 4]), np.array([3, 10, 7, 5]), 3).tolist() == [1, -1, 0, -1]
@@ -0,0 +1,112 @@
+import time
+
+from cache import CacheEntry, CatalogCache, etag_matches
+
+
+def entry(body=b"[]"):
+    return CacheEntry(body)
+
+
+def test_get_or_load_caches_until_ttl():
+    cache = CatalogCache(ttl=0.05)
+    loads = []
+    loader = lambda: loads.append(1) or entry()
+    first = cache.get_or_load("products", "page", loader)
+    assert cache.get_or_load("products", "page", loader) is first
+    time.sleep(0.06)
+    assert cache.get_or_load("products", "page", loader) is not first
+    assert len(loads) == 2
+    assert cache.stats()["expirations"] == 1
+
+
+def test_least_recently_used_is_evicted():
+    cache = CatalogCache(max_entries=2)
+    for key in ("a", "b"):
+        cache.get_or_load("products", key, entry)
+    cache.get("products", "a")
+    cache.get_or_load("products", "c", entry)
+    assert cache.get("products", "b") is None
+    assert cache.get("products", "a") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_drops_only_its_namespace():
+    cache = CatalogCache()
+    cache.get_or_load("products", "page", entry)
+    cache.get_or_load("categories", "tree", entry)
+    cache.invalidate("products")
+    assert cache.get("products", "page") is None
+    assert cache.get("categories", "tree") is not None
+    cache.invalidate()
+    assert cache.get("categories", "tree") is None
+
+
+def test_load_racing_an_invalidation_is_not_stored():
+    cache = CatalogCache()
+
+    def loader():
+        # Запись закоммичена и namespace инвалидирован, пока загрузчик читал старые данные
+        cache.invalidate("products")
+        return entry(b"stale")
+
+    assert cache.get_or_load("products", "page", loader).body == b"stale"
+    assert cache.get("products", "page") is None
+
+
+def test_invalidated_at_includes_full_invalidation():
+    cache = CatalogCache()
+    assert cache.invalidated_at("products") is None
+    cache.invalidate("products")
+    products_at = cache.invalidated_at("products")
+    cache.invalidate()
+    assert cache.invalidated_at("products") > products_at
+    assert cache.invalidated_at("categories") == cache.invalidated_at("products")
+
+
+def test_remote_invalidation_runs_callbacks_first():
+    cache = CatalogCache()
+
+    def rebuild(namespace):
+        # Запрос, пришедший, пока производные структуры сбрасываются, не должен остаться в кэше
+        cache.get_or_load("categories", "tree", lambda: entry(b"stale"))
+
+    cache.on_remote_invalidate(rebuild)
+    cache._invalidate_remote("categories")
+    assert cache.get("categories", "tree") is None
+
+
+def test_old_namespaces_are_pruned():
+    cache = CatalogCache(ttl=0.05)
+    for user_id in range(100):
+        cache.invalidate("user.%d" % user_id)
+    time.sleep(0.06)
+    cache.invalidate("user.100")
+    assert set(cache._generations) == {"user.100"}
+    assert set(cache._invalidated_at) == {"user.100"}
+    assert cache.invalidated_at("user.1") is None
+
+
+def test_load_started_before_prune_is_not_stored():
+    cache = CatalogCache(ttl=0.05)
+    cache.invalidate("products")
+
+    def loader():
+        cache.invalidate("products")
+        time.sleep(0.06)
+        # Прореживание забывает "products"; загрузка, начатая до инвалидации, всё равно устарела
+        cache.invalidate("user.1")
+        return entry(b"stale")
+
+    cache.get_or_load("products", "page", loader)
+    assert "products" not in cache._generations
+    assert cache.get("products", "page") is None
+    cache.get_or_load("products", "page", entry)
+    assert cache.get("products", "page") is not None
+
+
+def test_etag_matches():
+    assert etag_matches('"a"', '"a"')
+    assert etag_matches('"b", W/"a"', '"a"')
+    assert etag_matches(" * ", '"a"')
+    assert not etag_matches('"ab"', '"a"')
+    assert not etag_matches('"a-gzip"', '"a"')
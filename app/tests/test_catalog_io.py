@@ -0,0 +1,71 @@
+import io
+import time
+
+import psycopg2
+import pytest
+from psycopg2.extras import RealDictCursor
+
+from catalog_io import import_records, import_stream
+
+
+@pytest.fixture
+def db(dsn):
+    db = psycopg2.connect(dsn, cursor_factory=RealDictCursor)
+    yield db
+    db.rollback()
+    with db.cursor() as cursor:
+        cursor.execute("DELETE FROM categories WHERE name LIKE 'test-import-%'")
+    db.commit()
+    db.close()
+
+
+@pytest.fixture
+def name():
+    prefix = "test-import-%d-" % time.time_ns()
+    return lambda suffix: prefix + suffix
+
+
+def category_names(db, name):
+    with db.cursor() as cursor:
+        cursor.execute("SELECT name FROM categories WHERE name LIKE %s ORDER BY name", (name("%"),))
+        names = [row["name"] for row in cursor.fetchall()]
+    db.rollback()
+    return names
+
+
+def test_duplicate_names_do_not_abort(db, name):
+    report = import_records(db, "categories", [{"name": name("a")}, {"name": name("b")}, {"name": " %s " % name("a")}])
+    assert report["committed"]
+    assert (report["invalid"], report["errors"]) == (0, [])
+    assert report["duplicates"] == 1
+    assert report["duplicate_rows"] == [{"row": 1, "used_row": 3}]
+    assert (report["inserted"], report["unchanged"]) == (2, 0)
+    assert category_names(db, name) == [name("a"), name("b")]
+
+
+def test_invalid_row_aborts(db, name):
+    report = import_records(db, "categories", [{"name": name("a")}, {"name": ""}, {"name": name("a")}])
+    assert not report["committed"]
+    assert report["invalid"] == 1
+    assert report["errors"] == [{"row": 2, "error": "name is required"}]
+    assert report["duplicate_rows"] == [{"row": 1, "used_row": 3}]
+    assert category_names(db, name) == []
+
+
+def test_skip_reports_invalid_and_duplicates_separately(db, name):
+    upload = "name,parent\n{a},\n,\n{a},\n{b},nowhere-{a}\n".format(a=name("a"), b=name("b"))
+    report = import_stream(db, "categories", "csv", io.BytesIO(upload.encode()), on_error="skip")
+    assert report["committed"]
+    assert report["errors"] == [{"row": 2, "error": "name is required"}, {"row": 4, "error": "unknown parent"}]
+    assert (report["invalid"], report["duplicates"]) == (2, 1)
+    assert (report["inserted"], report["unchanged"]) == (1, 0)
+    assert category_names(db, name) == [name("a")]
+
+
+def test_duplicate_of_an_invalid_row_is_not_superseded(db, name):
+    # Последняя строка с ошибкой не заменяет предыдущую корректную
+    report = import_records(db, "categories", [{"name": name("a")}, {"name": name("a"), "parent_id": "x"}],
+                            on_error="skip")
+    assert report["errors"] == [{"row": 2, "error": "parent_id must be an integer"}]
+    assert report["duplicates"] == 0
+    assert category_names(db, name) == [name("a")]
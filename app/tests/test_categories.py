@@ -0,0 +1,93 @@
+from contextlib import contextmanager
+
+import pytest
+
+import categories
+from categories import CategoryTree
+
+
+class FakePool:
+    def __init__(self, rows):
+        self.rows = rows
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, query, vars=None):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+
+def row(category_id, parent_id=None):
+    return {"id": category_id, "name": "c%d" % category_id, "parent_id": parent_id}
+
+
+@pytest.fixture
+def load(monkeypatch):
+    def load(*rows):
+        monkeypatch.setattr(categories, "pool", FakePool(list(rows)))
+        return CategoryTree()
+    return load
+
+
+def test_subtree_ids(load):
+    tree = load(row(1), row(2, 1), row(3, 2), row(4, 1), row(5))
+    assert tree.subtree_ids(1) == [1, 2, 3, 4]
+    assert tree.subtree_ids(2) == [2, 3]
+    assert tree.subtree_ids(5) == [5]
+    assert tree.subtree_ids(99) is None
+
+
+def test_ancestors_nearest_first():
+    nodes = {1: row(1), 2: row(2, 1), 3: row(3, 2)}
+    assert list(CategoryTree._ancestors(nodes, 3)) == [2, 1]
+    assert list(CategoryTree._ancestors(nodes, 1)) == []
+
+
+def test_ancestors_stop_on_cycle():
+    nodes = {1: row(1, 3), 2: row(2, 1), 3: row(3, 2)}
+    assert list(CategoryTree._ancestors(nodes, 1)) == [3, 2, 1]
+
+
+def test_cycle_does_not_hang_load(load):
+    tree = load(row(1, 2), row(2, 1), row(3))
+    assert tree.subtree_ids(1) == [1, 2]
+    # Категории из цикла не достижимы ни из одного корня
+    assert [node["id"] for node in tree.tree()] == [3]
+
+
+def test_orphan_is_a_root(load):
+    tree = load(row(1), row(2, 42))
+    assert [node["id"] for node in tree.tree()] == [1, 2]
+
+
+def test_add_updates_ancestors(load):
+    tree = load(row(1), row(2, 1))
+    tree.subtree_ids(1)
+    tree.add(row(3, 2))
+    assert tree.subtree_ids(1) == [1, 2, 3]
+    assert tree.tree()[0]["children"][0]["children"][0]["id"] == 3
+
+
+def test_add_before_load_is_ignored(load):
+    tree = load(row(1))
+    tree.add(row(2, 1))
+    # Дерево ещё не загружено: add ничего не делает, загрузка берёт строки из базы
+    assert tree.subtree_ids(1) == [1]
+
+
+def test_invalidate_reloads(load, monkeypatch):
+    tree = load(row(1))
+    assert tree.subtree_ids(1) == [1]
+    monkeypatch.setattr(categories, "pool", FakePool([row(1), row(2, 1)]))
+    tree.invalidate("products")
+    assert tree.subtree_ids(1) == [1]
+    tree.invalidate("categories")
+    assert tree.subtree_ids(1) == [1, 2]
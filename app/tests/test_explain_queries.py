@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "bench"))
+
+from explain_queries import find_seq_scans, to_positional
+
+
+def test_positional_parameters_are_numbered_in_order():
+    assert to_positional("SELECT * FROM t WHERE a = %s AND b = %s") == ("SELECT * FROM t WHERE a = $1 AND b = $2", 2)
+
+
+def test_named_parameters_reuse_their_number():
+    sql, count = to_positional("WHERE a > %(from)s AND a <= %(to)s OR b = %(from)s")
+    assert sql == "WHERE a > $1 AND a <= $2 OR b = $1"
+    assert count == 2
+
+
+def test_percent_escapes_are_unescaped():
+    sql, count = to_positional("SELECT %s <%% name, 'a%%' LIKE %(q)s, i %% 3")
+    assert sql == "SELECT $1 <% name, 'a%' LIKE $2, i % 3"
+    assert count == 2
+
+
+def test_escaped_percent_before_s_is_not_a_parameter():
+    assert to_positional("SELECT '%%s'") == ("SELECT '%s'", 0)
+
+
+@pytest.mark.parametrize("rows, min_rows, expected", [
+    (5000, 1000, [("products", 5000)]),
+    (10, 1000, []),
+])
+def test_find_seq_scans(rows, min_rows, expected):
+    plan = {"Node Type": "Limit", "Plans": [
+        {"Node Type": "Seq Scan", "Relation Name": "products", "Actual Rows": rows // 2,
+         "Rows Removed by Filter": rows - rows // 2},
+        {"Node Type": "Index Scan", "Relation Name": "categories", "Actual Rows": 1},
+    ]}
+    assert find_seq_scans(plan, min_rows) == expected
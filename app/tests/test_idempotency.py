@@ -0,0 +1,129 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import pytest
+from fastapi import HTTPException
+from psycopg2.extras import RealDictCursor
+
+from idempotency import IdempotencyStore, request_fingerprint
+
+
+class FakeDb:
+    """Every key is new to the database: the INSERT ... RETURNING claims it."""
+
+    def __init__(self):
+        self.statements = []
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, query, vars=None):
+        self.statements.append(query.split()[0])
+
+    def fetchone(self):
+        return {"key": "claimed"}
+
+    def rollback(self):
+        pass
+
+
+def test_fingerprint_ignores_key_order():
+    assert request_fingerprint({"a": 1, "b": [1, 2]}) == request_fingerprint({"b": [1, 2], "a": 1})
+    assert request_fingerprint({"a": 1}) != request_fingerprint({"a": 2})
+
+
+def test_without_key_nothing_happens():
+    db = FakeDb()
+    with IdempotencyStore().guard("purchase:1", None, {"a": 1}, db) as guard:
+        assert guard.response is None
+        guard.save(db, {"ok": True})
+    assert db.statements == []
+
+
+def test_saved_response_is_replayed_from_memory():
+    store = IdempotencyStore()
+    db = FakeDb()
+    with store.guard("purchase:1", "k", {"a": 1}, db) as guard:
+        assert guard.response is None
+        guard.save(db, {"order_id": 7}, 201)
+    with store.guard("purchase:1", "k", {"a": 1}, db) as guard:
+        assert guard.response[1:] == (201, {"order_id": 7})
+        assert guard.replay().headers["Idempotent-Replayed"] == "true"
+    # Второй запрос не дошёл до базы
+    assert db.statements == ["INSERT", "UPDATE"]
+    assert store.stats()["replays"] == 1
+
+
+def test_same_key_different_request_is_rejected():
+    store = IdempotencyStore()
+    db = FakeDb()
+    with store.guard("purchase:1", "k", {"a": 1}, db) as guard:
+        guard.save(db, {})
+    with pytest.raises(HTTPException) as error:
+        with store.guard("purchase:1", "k", {"a": 2}, db):
+            pass
+    assert error.value.status_code == 422
+
+
+def test_scopes_are_separate():
+    store = IdempotencyStore()
+    db = FakeDb()
+    with store.guard("purchase:1", "k", {"a": 1}, db) as guard:
+        guard.save(db, {})
+    with store.guard("purchase:2", "k", {"a": 1}, db) as guard:
+        assert guard.response is None
+
+
+def test_failed_request_is_not_remembered():
+    store = IdempotencyStore()
+    db = FakeDb()
+    with pytest.raises(RuntimeError):
+        with store.guard("purchase:1", "k", {"a": 1}, db) as guard:
+            guard.save(db, {})
+            raise RuntimeError("rolled back")
+    with store.guard("purchase:1", "k", {"a": 1}, db) as guard:
+        assert guard.response is None
+    assert store.stats()["inflight"] == 0
+
+
+def test_concurrent_duplicate_waits_for_the_first():
+    store = IdempotencyStore()
+    entered = threading.Event()
+    results = []
+
+    def first():
+        db = FakeDb()
+        with store.guard("purchase:1", "k", {"a": 1}, db) as guard:
+            entered.set()
+            time.sleep(0.1)
+            guard.save(db, {"order_id": 1})
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    entered.wait(1)
+    with store.guard("purchase:1", "k", {"a": 1}, FakeDb()) as guard:
+        results.append(guard.response)
+    thread.join()
+    assert results[0][1:] == (200, {"order_id": 1})
+    assert store.stats()["waits"] == 1
+
+
+def test_replay_across_workers(dsn):
+    """A second store (another worker) finds the response in idempotency_keys."""
+    key = "test-%f" % time.time()
+    db = psycopg2.connect(dsn, cursor_factory=RealDictCursor)
+    try:
+        with IdempotencyStore().guard("test", key, {"a": 1}, db) as guard:
+            with db.cursor() as cursor:
+                guard.save(cursor, {"order_id": 3}, 201)
+            db.commit()
+        with IdempotencyStore().guard("test", key, {"a": 1}, db) as guard:
+            assert guard.response[1:] == (201, {"order_id": 3})
+    finally:
+        with db.cursor() as cursor:
+            cursor.execute("DELETE FROM idempotency_keys WHERE scope = 'test' AND key = %s", (key,))
+        db.commit()
+        db.close()
@@ -0,0 +1,117 @@
+import threading
+import time
+
+import psycopg2
+import pytest
+
+from db import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.closed = 0
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePool(ConnectionPool):
+    def __init__(self, **kwargs):
+        super().__init__("fake", **kwargs)
+        self.opened = []
+
+    def _connect(self):
+        conn = FakeConnection(len(self.opened))
+        self.opened.append(conn)
+        return conn
+
+
+def test_invalid_sizes():
+    with pytest.raises(ValueError):
+        ConnectionPool("fake", min_size=3, max_size=2)
+    with pytest.raises(ValueError):
+        ConnectionPool("fake", min_size=0, max_size=0)
+
+
+def test_open_creates_min_size_and_reuses_idle():
+    pool = FakePool(min_size=2, max_size=4)
+    pool.open()
+    assert len(pool.opened) == 2
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert len(pool.opened) == 2
+
+
+def test_times_out_at_max_size():
+    pool = FakePool(min_size=0, max_size=1, acquire_timeout=0.05)
+    pool.getconn()
+    started = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert time.monotonic() - started >= 0.05
+    assert pool.stats()["timeouts_total"] == 1
+
+
+def test_waiter_gets_released_connection():
+    pool = FakePool(min_size=0, max_size=1, acquire_timeout=5)
+    conn = pool.getconn()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.getconn()))
+    waiter.start()
+    time.sleep(0.05)
+    pool.putconn(conn)
+    waiter.join(1)
+    assert got == [conn]
+    assert len(pool.opened) == 1
+
+
+def test_open_transaction_rolled_back_on_return():
+    pool = FakePool(min_size=0, max_size=1)
+    conn = pool.getconn()
+    conn.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1
+    assert pool.getconn() is conn
+
+
+def test_closed_connection_is_replaced():
+    pool = FakePool(min_size=0, max_size=1)
+    conn = pool.getconn()
+    conn.close()
+    pool.putconn(conn)
+    assert pool.stats()["size"] == 0
+    assert pool.getconn() is not conn
+
+
+def test_failed_connect_frees_the_slot():
+    pool = FakePool(min_size=0, max_size=1, acquire_timeout=0.05)
+
+    def fail():
+        raise psycopg2.OperationalError("connection refused")
+
+    pool._connect = fail
+    with pytest.raises(psycopg2.OperationalError):
+        pool.getconn()
+    assert pool.stats()["size"] == 0
+
+
+def test_closed_pool_rejects_and_closes_returned():
+    pool = FakePool(min_size=1, max_size=2)
+    pool.open()
+    conn = pool.getconn()
+    pool.close()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    pool.putconn(conn)
+    assert conn.closed
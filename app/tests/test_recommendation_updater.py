@@ -0,0 +1,118 @@
+import psycopg2
+import pytest
+from psycopg2.extras import RealDictCursor
+
+from events import EVENT_ACTIONS
+from recommendation_updater import SettledBounds, run_once
+
+
+@pytest.fixture
+def db(dsn):
+    db = psycopg2.connect(dsn, cursor_factory=RealDictCursor)
+    # Догоняем всё, что накопилось до теста
+    run_once(db, settled=SettledBounds(timeout=5))
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def sessions(dsn):
+    opened = []
+
+    def session():
+        conn = psycopg2.connect(dsn)
+        opened.append(conn)
+        return conn
+
+    yield session
+    for conn in opened:
+        conn.rollback()
+        conn.close()
+
+
+@pytest.fixture
+def ids(db):
+    with db.cursor() as cursor:
+        cursor.execute("SELECT id FROM users ORDER BY id LIMIT 3")
+        users = [row["id"] for row in cursor.fetchall()]
+        cursor.execute("SELECT id FROM products ORDER BY id LIMIT 3")
+        products = [row["id"] for row in cursor.fetchall()]
+    db.rollback()
+    if len(users) < 3 or len(products) < 3:
+        pytest.skip("the test database needs at least 3 users and 3 products")
+    return list(zip(users, products))
+
+
+def log_view(conn, user_id, product_id, commit=True):
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO user_logs (user_id, action, product_id) VALUES (%s, %s, %s) RETURNING id",
+                       (user_id, EVENT_ACTIONS["view"], product_id))
+        log_id = cursor.fetchone()[0]
+    if commit:
+        conn.commit()
+    return log_id
+
+
+def watermark(db):
+    with db.cursor() as cursor:
+        cursor.execute("SELECT last_id FROM recommendation_watermarks WHERE source = 'user_logs'")
+        last_id = cursor.fetchone()["last_id"]
+    db.rollback()
+    return last_id
+
+
+def test_lower_id_committing_late_is_not_skipped(db, sessions, ids):
+    settled = SettledBounds(timeout=0.2)
+    start = watermark(db)
+    late = sessions()
+    late_id = log_view(late, *ids[0], commit=False)
+    committed_id = log_view(sessions(), *ids[1])
+    assert late_id < committed_id
+
+    summary = run_once(db, settled=settled)
+    assert summary["interactions"] == 0
+    assert watermark(db) == start
+
+    late.commit()
+    summary = run_once(db, settled=settled)
+    assert summary["interactions"] == 2
+    assert watermark(db) == committed_id
+
+
+def test_unrelated_transactions_are_not_waited_for(db, sessions, ids):
+    settled = SettledBounds(timeout=5)
+    idle = sessions()
+    with idle.cursor() as cursor:
+        cursor.execute("UPDATE products SET stock = stock WHERE id = %s", (ids[0][1],))
+    logged = log_view(sessions(), *ids[0])
+
+    summary = run_once(db, settled=settled)
+    assert summary["seconds"] < 2
+    assert summary["interactions"] == 1
+    assert watermark(db) == logged
+
+
+def test_long_writer_carried_to_the_next_pass(db, sessions, ids):
+    settled = SettledBounds(timeout=0.2)
+    start = watermark(db)
+    short = sessions()
+    short_id = log_view(short, *ids[0], commit=False)
+    first_bound = log_view(sessions(), *ids[1])
+
+    # Проход 1: короткая транзакция ещё идёт, безопасной границы нет
+    assert run_once(db, settled=settled)["interactions"] == 0
+    short.commit()
+    long = sessions()
+    long_id = log_view(long, *ids[2], commit=False)
+    after = log_view(sessions(), *ids[0])
+
+    # Проход 2: долгая транзакция идёт, но граница прохода 1 уже безопасна
+    summary = run_once(db, settled=settled)
+    assert watermark(db) == first_bound
+    assert summary["interactions"] == 2
+    assert start < short_id < first_bound < long_id < after
+
+    long.commit()
+    summary = run_once(db, settled=settled)
+    assert summary["interactions"] == 2
+    assert watermark(db) == after
@@ -0,0 +1,205 @@
+import time
+
+import psycopg2
+import pytest
+from psycopg2.extras import RealDictCursor
+
+import db
+from db import ConnectionPool, ReplicaRouter, parse_lsn, primary_lsn, replica_status
+
+
+class FakeConnection:
+    def __init__(self, dsn):
+        self.name = psycopg2.extensions.parse_dsn(dsn)["dbname"]
+        self.closed = 0
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePool(ConnectionPool):
+    def _connect(self):
+        return FakeConnection(self.dsn)
+
+
+class Cluster:
+    """WAL positions of a fake primary and its replicas, as the router's sources see them."""
+
+    def __init__(self, *names):
+        self.primary = 0
+        self.replicas = {name: {"in_recovery": True, "streaming": True, "replay_lsn": 0} for name in names}
+
+    def write(self):
+        self.primary += 1
+
+    def replay(self, *names):
+        for name in names:
+            self.replicas[name]["replay_lsn"] = self.primary
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    monkeypatch.setattr(db, "ConnectionPool", FakePool)
+    cluster = Cluster("a", "b")
+    routers = []
+
+    def router(**kwargs):
+        router = ReplicaRouter(FakePool("dbname=primary"), ["dbname=%s" % name for name in cluster.replicas],
+                               check_interval=3600, lsn_source=lambda conn: cluster.primary,
+                               status_source=lambda conn: dict(cluster.replicas[conn.name]), **kwargs)
+        routers.append(router)
+        router.check()
+        return router
+
+    cluster.router = router
+    yield cluster
+    for router in routers:
+        router.close()
+
+
+def source(router, fresh_after=None):
+    conn, pool = router.getconn(fresh_after)
+    pool.putconn(conn)
+    return "primary" if pool is router.primary else psycopg2.extensions.parse_dsn(pool.dsn)["dbname"]
+
+
+def test_parse_lsn():
+    assert parse_lsn("0/0") == 0
+    assert parse_lsn("16/B374D848") == (0x16 << 32) + 0xB374D848
+    assert parse_lsn("1/0") > parse_lsn("0/FFFFFFFF")
+
+
+def test_write_is_read_from_the_primary_until_replayed(cluster):
+    router = cluster.router(max_lag=5)
+    cluster.write()
+    router.note_write(1)
+    router.check()
+    assert source(router, router.written_at(1)) == "primary"
+    assert source(router) in ("a", "b")
+    cluster.replay("b")
+    router.check()
+    assert {source(router, router.written_at(1)) for _ in range(4)} == {"b"}
+
+
+def test_replica_without_receiver_is_ejected(cluster):
+    # Всё полученное применено, но приёмник WAL отключён: раньше такая реплика считалась догнавшей
+    router = cluster.router(max_lag=5)
+    cluster.replicas["a"]["streaming"] = False
+    cluster.replicas["b"]["streaming"] = False
+    router.check()
+    stats = router.stats()["replicas"]
+    assert [replica["error"] for replica in stats] == ["no streaming WAL receiver"] * 2
+    assert source(router) == "primary"
+
+
+def test_replica_not_in_recovery_is_ejected(cluster):
+    router = cluster.router(max_lag=5)
+    cluster.replicas["a"].update(in_recovery=False, streaming=False, replay_lsn=None)
+    router.check()
+    assert router.stats()["replicas"][0]["error"] == "not a replica: the server is not in recovery"
+    assert {source(router) for _ in range(4)} == {"b"}
+
+
+def test_lagging_replica_is_ejected_and_comes_back(cluster):
+    router = cluster.router(max_lag=0.05)
+    cluster.write()
+    cluster.replay("b")
+    router.check()
+    assert {source(router) for _ in range(4)} == {"a", "b"}
+    time.sleep(0.06)
+    router.check()
+    assert {source(router) for _ in range(4)} == {"b"}
+    assert router.stats()["replicas"][0]["error"].startswith("lag ")
+    cluster.replay("a")
+    router.check()
+    assert {source(router) for _ in range(4)} == {"a", "b"}
+    assert router.stats()["replicas"][0]["ejections"] == 1
+
+
+def test_fresh_as_of_does_not_go_back(cluster):
+    router = cluster.router(max_lag=5)
+    fresh_as_of = router.replicas[0].fresh_as_of
+    cluster.write()
+    router.check()
+    assert router.replicas[0].fresh_as_of == fresh_as_of
+
+
+def test_unavailable_primary_does_not_advance_freshness(cluster, monkeypatch):
+    router = cluster.router(max_lag=5)
+    fresh_as_of = router.replicas[0].fresh_as_of
+
+    def unavailable(conn):
+        raise psycopg2.OperationalError("connection refused")
+
+    monkeypatch.setattr(router, "lsn_source", unavailable)
+    router.check()
+    assert router.replicas[0].fresh_as_of == fresh_as_of
+    assert router.replicas[0].healthy
+
+
+def test_real_queries_on_a_primary(dsn):
+    conn = psycopg2.connect(dsn, cursor_factory=RealDictCursor)
+    try:
+        assert primary_lsn(conn) > 0
+        assert replica_status(conn) == {"in_recovery": False, "streaming": False, "replay_lsn": None}
+    finally:
+        conn.close()
+    primary = ConnectionPool(dsn, min_size=0, max_size=2)
+    router = ReplicaRouter(primary, [dsn], check_interval=3600)
+    try:
+        router.check()
+        assert router.stats()["replicas"][0]["error"] == "not a replica: the server is not in recovery"
+    finally:
+        router.close()
+        primary.close()
+
+
+def test_paused_replay_pins_the_author_to_the_primary(dsn, replica_dsn):
+    primary = ConnectionPool(dsn, min_size=0, max_size=2)
+    router = ReplicaRouter(primary, [replica_dsn], max_lag=0.5, check_interval=3600, read_your_writes=60)
+    admin = psycopg2.connect(replica_dsn)
+    admin.autocommit = True
+    replica = router.replicas[0]
+
+    def commit():
+        with primary.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_current_xact_id()")
+            conn.commit()
+
+    def check_until(predicate):
+        deadline = time.monotonic() + 5
+        router.check()
+        while not predicate() and time.monotonic() < deadline:
+            time.sleep(0.05)
+            router.check()
+        return predicate()
+
+    try:
+        assert check_until(lambda: replica.healthy)
+        with admin.cursor() as cursor:
+            cursor.execute("SELECT pg_wal_replay_pause()")
+        try:
+            commit()
+            router.note_write(1)
+            router.check()
+            assert source(router, router.written_at(1)) == "primary"
+            time.sleep(0.6)
+            commit()
+            router.check()
+            assert replica.error.startswith("lag ")
+        finally:
+            with admin.cursor() as cursor:
+                cursor.execute("SELECT pg_wal_replay_resume()")
+        assert check_until(lambda: replica.healthy)
+        assert source(router, router.written_at(1)) != "primary"
+    finally:
+        admin.close()
+        router.close()
+        primary.close()
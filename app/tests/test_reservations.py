@@ -0,0 +1,145 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+import pytest
+from psycopg2.extras import RealDictCursor
+
+import reservations
+from reservations import ReservationSweeper, hold_until, reconcile, sweep_batch
+
+# Удержания тестов истекают в прошлом веке: проход с now ниже не трогает чужие строки базы
+EXPIRED = datetime(2000, 1, 1)
+SWEEP_AT = datetime(2000, 1, 2)
+HELD = datetime(2000, 1, 3)
+
+
+def test_hold_until():
+    before = datetime.utcnow()
+    until = hold_until(60)
+    assert before + timedelta(seconds=60) <= until <= datetime.utcnow() + timedelta(seconds=60)
+
+
+def test_sweeper_runs_batches_until_a_short_one(monkeypatch):
+    results = [(2, 5), (2, 3), (1, 1), (2, 2)]
+    calls = []
+
+    async def run_db(func, batch, now):
+        calls.append((batch, now))
+        return results.pop(0)
+
+    monkeypatch.setattr(reservations, "run_db", run_db)
+    sweeper = ReservationSweeper(batch_size=2)
+    asyncio.run(sweeper.sweep())
+    stats = sweeper.stats()
+    assert (stats["sweeps"], stats["batches"], stats["released_lines"], stats["released_units"]) == (1, 3, 5, 9)
+    # Все пачки одного прохода сравниваются с одним и тем же моментом
+    assert len({now for _, now in calls}) == 1
+
+
+def test_sweeper_counts_errors(monkeypatch):
+    async def run_db(func, batch, now):
+        raise psycopg2.OperationalError("server closed the connection")
+
+    monkeypatch.setattr(reservations, "run_db", run_db)
+    sweeper = ReservationSweeper()
+    asyncio.run(sweeper.sweep())
+    assert sweeper.stats()["errors"] == 1
+    assert sweeper.stats()["sweeps"] == 0
+
+
+@pytest.fixture
+def db(dsn):
+    db = psycopg2.connect(dsn, cursor_factory=RealDictCursor)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def holds(db):
+    """A product with stock 10 and a factory of cart lines holding it; everything is deleted afterwards."""
+    prefix = "test-reservations-%d" % time.time_ns()
+    with db.cursor() as cursor:
+        cursor.execute("INSERT INTO products (name, price, stock) VALUES (%s, 1, 10) RETURNING id", (prefix,))
+        product_id = cursor.fetchone()["id"]
+    db.commit()
+    users = []
+
+    def hold(reserved, until):
+        with db.cursor() as cursor:
+            cursor.execute("INSERT INTO users (name, email, password, role) VALUES (%s, %s, '-', 'покупатель') "
+                           "RETURNING id", (prefix, "%s-%d@example.com" % (prefix, len(users))))
+            users.append(cursor.fetchone()["id"])
+            cursor.execute("INSERT INTO cart (user_id) VALUES (%s) RETURNING id", (users[-1],))
+            cart_id = cursor.fetchone()["id"]
+            cursor.execute("INSERT INTO cart_items (cart_id, product_id, quantity, reserved, reserved_until) "
+                           "VALUES (%s, %s, %s, %s, %s) RETURNING id", (cart_id, product_id, reserved, reserved, until))
+            line_id = cursor.fetchone()["id"]
+            cursor.execute("UPDATE products SET reserved = reserved + %s WHERE id = %s", (reserved, product_id))
+        db.commit()
+        return cart_id, line_id
+
+    hold.product_id = product_id
+    yield hold
+    db.rollback()
+    with db.cursor() as cursor:
+        cursor.execute("DELETE FROM users WHERE id = ANY(%s)", (users,))
+        cursor.execute("DELETE FROM products WHERE id = %s", (product_id,))
+    db.commit()
+
+
+def reserved(db, product_id):
+    with db.cursor() as cursor:
+        cursor.execute("SELECT reserved FROM products WHERE id = %s", (product_id,))
+        value = cursor.fetchone()["reserved"]
+    db.rollback()
+    return value
+
+
+def test_sweep_releases_only_expired_holds(db, holds):
+    _, expired_line = holds(2, EXPIRED)
+    holds(3, HELD)
+    assert reserved(db, holds.product_id) == 5
+    assert sweep_batch(db, now=SWEEP_AT) == (1, 2)
+    assert reserved(db, holds.product_id) == 3
+    with db.cursor() as cursor:
+        cursor.execute("SELECT quantity, reserved FROM cart_items WHERE id = %s", (expired_line,))
+        # Строка остаётся в корзине, снимается только удержание
+        assert cursor.fetchone() == {"quantity": 2, "reserved": 0}
+    db.rollback()
+    assert sweep_batch(db, now=SWEEP_AT) == (0, 0)
+
+
+def test_sweep_goes_in_batches(db, holds):
+    for _ in range(3):
+        holds(1, EXPIRED)
+    assert sweep_batch(db, batch=2, now=SWEEP_AT) == (2, 2)
+    assert sweep_batch(db, batch=2, now=SWEEP_AT) == (1, 1)
+    assert reserved(db, holds.product_id) == 0
+
+
+def test_sweep_skips_a_cart_in_checkout(db, holds, dsn):
+    locked_cart, _ = holds(2, EXPIRED)
+    holds(1, EXPIRED)
+    checkout = psycopg2.connect(dsn)
+    try:
+        with checkout.cursor() as cursor:
+            cursor.execute("SELECT id FROM cart WHERE id = %s FOR UPDATE", (locked_cart,))
+        assert sweep_batch(db, now=SWEEP_AT) == (1, 1)
+        assert reserved(db, holds.product_id) == 2
+    finally:
+        checkout.rollback()
+        checkout.close()
+    assert sweep_batch(db, now=SWEEP_AT) == (1, 2)
+    assert reserved(db, holds.product_id) == 0
+
+
+def test_reconcile_fixes_drifted_counter(db, holds):
+    holds(2, HELD)
+    with db.cursor() as cursor:
+        cursor.execute("UPDATE products SET reserved = 7 WHERE id = %s", (holds.product_id,))
+    db.commit()
+    assert holds.product_id in reconcile(db)
+    assert reserved(db, holds.product_id) == 2
+    assert holds.product_id not in reconcile(db)
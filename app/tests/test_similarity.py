@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from similarity import SimilarityIndex, SimilarityIndexMissing, top_k_blocked
+
+
+def brute_force(queries, vectors, k, exclude=None):
+    scores = queries @ vectors.T
+    if exclude is not None:
+        scores[np.arange(len(queries)), exclude] = -np.inf
+    rows = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    return rows, np.take_along_axis(scores, rows, axis=1)
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((103, 16)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("block_rows", [1, 7, 50, 103, 1000])
+def test_matches_brute_force_for_any_block_size(vectors, block_rows):
+    queries = vectors[[0, 5, 102]]
+    rows, scores = top_k_blocked(queries, vectors, 10, block_rows=block_rows)
+    expected_rows, expected_scores = brute_force(queries, vectors, 10)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+    assert (rows == expected_rows).all()
+
+
+@pytest.mark.parametrize("block_rows", [1, 7, 1000])
+def test_exclude_skips_the_query_row(vectors, block_rows):
+    exclude = np.array([0, 5, 102])
+    rows, scores = top_k_blocked(vectors[exclude], vectors, 10, exclude=exclude, block_rows=block_rows)
+    expected_rows, _ = brute_force(vectors[exclude], vectors, 10, exclude)
+    assert (rows == expected_rows).all()
+    assert not (rows == exclude[:, None]).any()
+    assert np.isfinite(scores).all()
+
+
+def test_k_larger_than_the_matrix(vectors):
+    rows, scores = top_k_blocked(vectors[:1], vectors[:4], 10, exclude=np.array([0]), block_rows=3)
+    assert rows.shape == (1, 3)
+    assert sorted(rows[0].tolist()) == [1, 2, 3]
+    assert (np.diff(scores[0]) <= 0).all()
+
+
+def test_single_query_vector(vectors):
+    rows, _ = top_k_blocked(vectors[3], vectors, 1)
+    assert rows.tolist() == [[3]]
+
+
+@pytest.fixture
+def index(tmp_path, vectors):
+    np.save(tmp_path / "vectors.npy", vectors)
+    np.save(tmp_path / "product_ids.npy", np.arange(1000, 1000 + len(vectors)))
+    return SimilarityIndex(str(tmp_path), block_rows=16)
+
+
+def test_similar_many_maps_product_ids(index, vectors):
+    result = index.similar_many([1000, 42, 1005], 5)
+    assert result[1] is None
+    expected_rows, _ = brute_force(vectors[[0, 5]], vectors, 5, np.array([0, 5]))
+    assert [product_id for product_id, _ in result[0]] == (expected_rows[0] + 1000).tolist()
+    assert [product_id for product_id, _ in result[2]] == (expected_rows[1] + 1000).tolist()
+    assert index.stats()["queries"] == 2
+
+
+def test_missing_index(tmp_path):
+    with pytest.raises(SimilarityIndexMissing):
+        SimilarityIndex(str(tmp_path)).similar(1, 5)
@@ -0,0 +1,84 @@
+import pytest
+from starlette.requests import Request
+
+import static_pages
+from static_pages import StaticFilesCache, accepted_encodings, choose_encoding
+
+ALL = ("br", "gzip", "identity")
+
+
+def choose(header, available=ALL):
+    return choose_encoding(accepted_encodings(header), available)
+
+
+def test_accepted_encodings_parses_q_values():
+    assert accepted_encodings("gzip, BR;q=0.5 , identity; q=0, x;q=bad, ") == {
+        "gzip": 1.0, "br": 0.5, "identity": 0.0, "x": 0.0}
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", "identity"),
+    ("gzip, deflate, br", "br"),
+    ("gzip", "gzip"),
+    ("br;q=0, gzip", "gzip"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("br;q=0, gzip;q=0", "identity"),
+    ("*", "br"),
+    ("*;q=0.5, gzip", "gzip"),
+    ("gzip;q=0, *", "br"),
+    ("identity;q=0, gzip", "gzip"),
+    ("identity;q=0", None),
+    ("*;q=0", None),
+    ("*;q=0, identity", "identity"),
+    ("deflate", "identity"),
+])
+def test_choose_encoding(header, expected):
+    assert choose(header) == expected
+
+
+def test_choose_encoding_only_offers_available_variants():
+    assert choose("br", ("gzip", "identity")) == "identity"
+    assert choose("br, identity;q=0", ("gzip", "identity")) is None
+
+
+def request(method="GET", **headers):
+    return Request({
+        "type": "http",
+        "method": method,
+        "path": "/",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    monkeypatch.setattr(static_pages, "brotli", None)
+    (tmp_path / "page.html").write_text("<p>hello</p>\n" * 100)
+    (tmp_path / "tiny.txt").write_text("hi")
+    files = StaticFilesCache(directory=str(tmp_path))
+    files.load()
+    return files
+
+
+def test_response_honours_q_zero(files):
+    response = files.response(request(accept_encoding="gzip;q=0, identity"), "page.html")
+    assert "content-encoding" not in response.headers
+    response = files.response(request(accept_encoding="identity;q=0, gzip"), "page.html")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+
+
+def test_nothing_acceptable_is_406(files):
+    response = files.response(request(accept_encoding="identity;q=0"), "tiny.txt")
+    assert response.status_code == 406
+    assert response.headers["vary"] == "Accept-Encoding"
+
+
+def test_if_none_match_uses_the_variant_etag(files):
+    gzipped = files.response(request(accept_encoding="gzip"), "page.html")
+    plain = files.response(request(), "page.html")
+    assert gzipped.headers["etag"] != plain.headers["etag"]
+    etag = gzipped.headers["etag"]
+    assert files.response(request(accept_encoding="gzip", if_none_match=etag), "page.html").status_code == 304
+    assert files.response(request(if_none_match=etag), "page.html").status_code == 200
+    assert files.stats()["not_modified"] == 1
@@ -0,0 +1,209 @@
+"""Worker cost and throughput of the NumPy recommender runtime against TensorFlow.
+
+    python bench/bench_inference.py                      # synthetic model shaped like the user notebook's
+    python bench/bench_inference.py --model-dir ml/model_rec_user --h5 model_rec_user.h5
+
+First, in fresh interpreters: import + load time and peak RSS of app/ncf.py
+and, with --h5 and TensorFlow installed, of tf.keras.models.load_model. Then
+scores/sec for requests of --items products each: a plain loop with one
+forward pass per request (no server overhead), --concurrency clients each
+sending its request to the threadpool as an unbatched endpoint would,
+the same clients through inference.InferenceBatcher, and model.predict per
+request for TensorFlow.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from loadgen import percentile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, "..", "app")
+ML_DIR = os.path.join(BENCH_DIR, "..", "ml")
+
+# Выполняются в отдельном интерпретаторе: время импорта и RSS без учёта самого бенчмарка
+NUMPY_LOAD = """
+import json, resource, sys, time
+started = time.perf_counter()
+sys.path.insert(0, %(app_dir)r)
+import numpy as np
+from ncf import NCFModel
+model = NCFModel.load(%(model_dir)r)
+model.score(np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64))
+print(json.dumps({"seconds": time.perf_counter() - started,
+                  "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+TENSORFLOW_LOAD = """
+import json, resource, time
+started = time.perf_counter()
+import numpy as np
+import tensorflow as tf
+model = tf.keras.models.load_model(%(h5)r, compile=False)
+model.predict([np.zeros(1), np.zeros(1)], verbose=0)
+print(json.dumps({"seconds": time.perf_counter() - started,
+                  "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def synthetic_model(out_dir, users, items, dim=50, seed=0):
+    sys.path.insert(0, ML_DIR)
+    from export_model import write_model
+
+    rng = np.random.default_rng(seed)
+    dense = [
+        (rng.normal(0, 0.1, (2 * dim, 128)), rng.normal(0, 0.1, 128), "relu"),
+        (rng.normal(0, 0.1, (128, 64)), rng.normal(0, 0.1, 64), "relu"),
+        (rng.normal(0, 0.1, (64, 1)), np.zeros(1), "sigmoid"),
+    ]
+    write_model(out_dir, rng.normal(0, 0.1, (users, dim)), rng.normal(0, 0.1, (items, dim)), dense, source="synthetic")
+
+
+def load_cost(code):
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"
+    return json.loads(result.stdout.strip().splitlines()[-1]), None
+
+
+def make_requests(model, count, items, seed=1):
+    rng = np.random.default_rng(seed)
+    users = rng.integers(0, model.user_embedding.shape[0], count)
+    return [(int(user), rng.choice(model.num_items, items, replace=False)) for user in users]
+
+
+def report(label, latencies, seconds, pairs):
+    print("  %-10s %8.0f scores/s  %7.0f req/s  p50 %6.2f ms  p99 %6.2f ms" % (
+        label, pairs / seconds, len(latencies) / seconds, percentile(latencies, 50), percentile(latencies, 99)))
+
+
+def run_single(model, requests):
+    latencies = []
+    started = time.perf_counter()
+    for user_row, item_rows in requests:
+        request_started = time.perf_counter()
+        model.score(np.full(len(item_rows), user_row), item_rows)
+        latencies.append((time.perf_counter() - request_started) * 1000)
+    return latencies, time.perf_counter() - started
+
+
+async def run_clients(score, requests, concurrency):
+    latencies = []
+    queue = list(reversed(requests))
+
+    async def client():
+        while queue:
+            user_row, item_rows = queue.pop()
+            request_started = time.perf_counter()
+            await score(user_row, item_rows)
+            latencies.append((time.perf_counter() - request_started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+
+async def run_threadpool(model, requests, concurrency):
+    from starlette.concurrency import run_in_threadpool
+
+    async def score(user_row, item_rows):
+        return await run_in_threadpool(model.score, np.full(len(item_rows), user_row), item_rows)
+
+    await run_clients(score, requests[:concurrency * 4], concurrency)  # прогрев пула потоков
+    return await run_clients(score, requests, concurrency)
+
+
+async def run_batched(model, requests, concurrency, max_batch, wait_ms):
+    from inference import InferenceBatcher
+
+    batcher = InferenceBatcher(max_batch=max_batch, wait_ms=wait_ms)
+    batcher.set_model(model, {row: row for row in range(model.num_items)})
+    batcher.start()
+
+    async def score(user_row, item_rows):
+        return await batcher.score(user_row, item_rows.tolist())
+
+    await run_clients(score, requests[:concurrency * 4], concurrency)
+    warmup = batcher.stats()
+    latencies, seconds = await run_clients(score, requests, concurrency)
+    stats = batcher.stats()
+    await batcher.stop()
+    return latencies, seconds, (stats["requests"] - warmup["requests"]) / max(1, stats["batches"] - warmup["batches"])
+
+
+def run_tensorflow(h5, requests):
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(h5, compile=False)
+    latencies = []
+    started = time.perf_counter()
+    for user_row, item_rows in requests:
+        request_started = time.perf_counter()
+        model.predict([np.full(len(item_rows), user_row), item_rows], verbose=0)
+        latencies.append((time.perf_counter() - request_started) * 1000)
+    return latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", help="directory written by ml/export_model.py (default: synthetic)")
+    parser.add_argument("--h5", help="the same model as saved by the notebook, for the TensorFlow rows")
+    parser.add_argument("--users", type=int, default=10000, help="synthetic model users")
+    parser.add_argument("--catalog", type=int, default=22170, help="synthetic model items")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--items", type=int, default=20, help="products scored per request")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--wait-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    sys.path.insert(0, APP_DIR)
+    from ncf import NCFModel
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = args.model_dir
+        if model_dir is None:
+            model_dir = os.path.join(tmp, "model")
+            synthetic_model(model_dir, args.users, args.catalog)
+
+        print("load (fresh interpreter)")
+        runtimes = [("numpy", NUMPY_LOAD % {"app_dir": APP_DIR, "model_dir": model_dir})]
+        if args.h5:
+            runtimes.append(("tensorflow", TENSORFLOW_LOAD % {"h5": args.h5}))
+        for label, code in runtimes:
+            cost, error = load_cost(code)
+            if cost is None:
+                print("  %-10s %s" % (label, error))
+            else:
+                print("  %-10s import + load %7.0f ms  peak RSS %6.1f MB" % (label, cost["seconds"] * 1000, cost["rss_mb"]))
+
+        model = NCFModel.load(model_dir)
+        requests = make_requests(model, args.requests, args.items)
+        pairs = args.requests * args.items
+        print("%d requests x %d items" % (args.requests, args.items))
+        latencies, seconds = run_single(model, requests)
+        report("loop", latencies, seconds, pairs)
+        latencies, seconds = asyncio.run(run_threadpool(model, requests, args.concurrency))
+        report("threadpool", latencies, seconds, pairs)
+        latencies, seconds, mean_batch = asyncio.run(
+            run_batched(model, requests, args.concurrency, args.max_batch, args.wait_ms))
+        report("batched", latencies, seconds, pairs)
+        print("  %-10s %d clients, %.1f requests per forward pass" % ("", args.concurrency, mean_batch))
+        if args.h5:
+            try:
+                latencies, seconds = run_tensorflow(args.h5, requests)
+            except ImportError:
+                print("  %-10s not installed" % "tensorflow")
+            else:
+                report("tensorflow", latencies, seconds, pairs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Encode time and bytes on the wire for product lists of 1k and 10k rows.
+
+Rows are built from ml/data/items.csv names, shaped like RealDictCursor rows
+of PRODUCT_COLUMNS. Three encoders are compared:
+
+    fastapi  - what a plain `return rows` with response_model does: validate,
+               dump_python(mode="json"), json.dumps (numeric as Decimal)
+    pydantic - TypeAdapter.validate_python + dump_json (the old cached path)
+    orjson   - serialization.encode_rows on rows with price::float8
+
+and each body is gzipped at levels 1, 6 and 9:
+
+    python bench/bench_json.py --sizes 1000 10000 --repeat 20
+"""
+import argparse
+import csv
+import decimal
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from loadgen import percentile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, "..", "app")
+DATA_DIR = os.path.join(BENCH_DIR, "..", "ml", "data")
+
+
+def load_names():
+    with open(os.path.join(DATA_DIR, "items.csv"), encoding="utf-8", newline="") as file:
+        return [row["item_name"].strip() for row in csv.DictReader(file)]
+
+
+def make_rows(names, count, seed=0):
+    rng = random.Random(seed)
+    created = datetime(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        rows.append({
+            "id": i + 1,
+            "name": rng.choice(names),
+            "description": None if i % 3 else "Описание товара %d" % i,
+            "price": decimal.Decimal("%d.99" % rng.randrange(1, 5000)),
+            "stock": rng.randrange(0, 200),
+            "category_id": rng.randrange(1, 80),
+            "attributes": {"item_id": str(i), "color": rng.choice(["черный", "белый", "красный"])},
+            "created_at": created + timedelta(seconds=i),
+        })
+    return rows
+
+
+def timed(encode, repeat):
+    body, times = None, []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = encode()
+        times.append((time.perf_counter() - started) * 1000)
+    return body, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    sys.path.insert(0, APP_DIR)
+    # main.py читает static/ относительно рабочего каталога
+    os.chdir(APP_DIR)
+    import main as app_main
+    from serialization import encode_rows
+
+    adapter = app_main.product_list_adapter
+    names = load_names()
+    for size in args.sizes:
+        rows = make_rows(names, size)
+        float_rows = [{**row, "price": float(row["price"])} for row in rows]
+        encoders = {
+            "fastapi": lambda: json.dumps(adapter.dump_python(adapter.validate_python(rows), mode="json"),
+                                          ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+            "pydantic": lambda: adapter.dump_json(adapter.validate_python(rows)),
+            "orjson": lambda: encode_rows(float_rows),
+        }
+        print("%d rows" % size)
+        for label, encode in encoders.items():
+            body, times = timed(encode, args.repeat)
+            sizes = ["gzip-%d %7d B %6.2f ms" % (level, len(gzip.compress(body, level)),
+                                                   min(timed(lambda: gzip.compress(body, level), 3)[1]))
+                     for level in (1, 6, 9)]
+            print("  %-8s p50 %7.2f ms  p99 %7.2f ms  raw %8d B  %s" % (
+                label, percentile(times, 50), percentile(times, 99), len(body), "  ".join(sizes)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""p99 latency of /products while a storm of /login requests runs.
+
+Measures /products alone, then again while --login-concurrency clients
+log in as distinct sample users (bcrypt verify on every request):
+
+    python bench/bench_login_storm.py --url http://localhost:8000
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import loadgen
+
+SAMPLE_EMAILS = [
+    "ivanov@example.com", "petrova@example.com", "sidorov@example.com", "smirnova@example.com",
+    "kuznetsov@example.com", "vasilieva@example.com", "zaytseva@example.com", "belyaev@example.com",
+    "orlova@example.com", "mikhaylov@example.com", "fedorova@example.com", "solovyov@example.com",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/products")
+    parser.add_argument("--concurrency", type=int, default=4, help="clients reading --path")
+    parser.add_argument("--login-concurrency", type=int, default=32)
+    parser.add_argument("--password", default="password123")
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    baseline = loadgen.run(args.url, args.path, args.concurrency, args.duration, name=f"{args.path} (idle)")
+    baseline.print()
+
+    logins = []
+
+    def storm(email):
+        body = json.dumps({"email": email, "password": args.password})
+        logins.append(loadgen.run(args.url, "/login", 1, args.duration + 1, method="POST", body=body,
+                                  headers={"Content-Type": "application/json"}, name=f"POST /login {email}"))
+
+    threads = [threading.Thread(target=storm, args=(SAMPLE_EMAILS[i % len(SAMPLE_EMAILS)],))
+               for i in range(args.login_concurrency)]
+    for t in threads:
+        t.start()
+    under_load = loadgen.run(args.url, args.path, args.concurrency, args.duration, name=f"{args.path} (login storm)")
+    for t in threads:
+        t.join()
+
+    total = loadgen.Result("POST /login (all)")
+    for r in logins:
+        total.latencies.extend(r.latencies)
+        total.errors += r.errors
+        for status, count in r.statuses.items():
+            total.statuses[status] = total.statuses.get(status, 0) + count
+    total.elapsed = max((r.elapsed for r in logins), default=0.0)
+
+    under_load.print()
+    total.print()
+    print("p99 %s: %.2f ms idle -> %.2f ms during login storm" % (
+        args.path, baseline.summary()["p99_ms"], under_load.summary()["p99_ms"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Latency of cheap routes while expensive ones are flooded.
+
+Measures --path alone, then again while --storm-concurrency clients each
+hammer full-catalog /products pages and /login. With admission control the
+flood gets fast 503/429 answers (see the status counts) and --path keeps
+its latency; run the server with ADMISSION_ENABLED=0 to compare:
+
+    python bench/bench_overload.py --url http://localhost:8000
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import loadgen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/shop", help="cheap route to watch")
+    parser.add_argument("--concurrency", type=int, default=4, help="clients reading --path")
+    parser.add_argument("--storm-concurrency", type=int, default=64, help="clients per flooded route")
+    parser.add_argument("--catalog-path", default="/products?limit=1000")
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    baseline = loadgen.run(args.url, args.path, args.concurrency, args.duration, name=f"{args.path} (idle)")
+    baseline.print()
+
+    storms = [
+        dict(path=args.catalog_path),
+        dict(path="/login", method="POST", body=json.dumps({"email": "ivanov@example.com", "password": "wrong"}),
+             headers={"Content-Type": "application/json"}),
+    ]
+    results = []
+
+    def storm(spec):
+        results.append(loadgen.run(args.url, concurrency=args.storm_concurrency, duration=args.duration + 1, **spec))
+
+    threads = [threading.Thread(target=storm, args=(spec,)) for spec in storms]
+    for t in threads:
+        t.start()
+    under_load = loadgen.run(args.url, args.path, args.concurrency, args.duration, name=f"{args.path} (overload)")
+    for t in threads:
+        t.join()
+
+    under_load.print()
+    for result in results:
+        result.print()
+    print("p99 %s: %.2f ms idle -> %.2f ms under overload" % (
+        args.path, baseline.summary()["p99_ms"], under_load.summary()["p99_ms"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Throughput and memory of the /products/{id}/similar engine, no database needed.
+
+Builds the TF-IDF index from ml/data/items.csv (~22k items) and a 10x copy
+with jittered vectors, then in a fresh interpreter per size (like a uvicorn
+worker) maps the index and times single and batched top-K queries:
+
+    python bench/bench_similarity.py --queries 2000 --k 10 --batch 64
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, "..", "app")
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "ml"))
+
+from build_similarity_index import load_items, normalize, tfidf_vectors, tokens  # noqa: E402
+
+CHILD = """
+import json, sys, time
+import numpy as np
+from similarity import SimilarityIndex
+
+def rss_mb():
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+
+path, queries, k, batch = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4])
+before = rss_mb()
+started = time.perf_counter()
+index = SimilarityIndex(path)
+index.load()
+load_ms = (time.perf_counter() - started) * 1000
+ids = np.random.default_rng(0).choice(index._product_ids, queries).tolist()
+
+started = time.perf_counter()
+for product_id in ids:
+    index.similar(product_id, k)
+single = queries / (time.perf_counter() - started)
+
+started = time.perf_counter()
+for start in range(0, queries, batch):
+    index.similar_many(ids[start:start + batch], k)
+batched = queries / (time.perf_counter() - started)
+print(json.dumps({"items": int(index._vectors.shape[0]), "matrix_mb": index._vectors.nbytes / 2**20,
+                  "load_ms": load_ms, "single_qps": single, "batched_qps": batched,
+                  "rss_delta_mb": rss_mb() - before}))
+"""
+
+
+def write(path, vectors):
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "vectors.npy"), normalize(vectors))
+    np.save(os.path.join(path, "product_ids.npy"), np.arange(1, len(vectors) + 1, dtype=np.int64))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--dims", type=int, default=256)
+    parser.add_argument("--scale", type=int, default=10, help="size of the large index relative to items.csv")
+    args = parser.parse_args()
+
+    items = load_items()
+    base = tfidf_vectors([tokens(name, category) for _, name, category in items], args.dims)
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        sizes = [("x1", base), ("x%d" % args.scale,
+                                np.concatenate([base + rng.normal(0, 0.05, base.shape).astype(np.float32)
+                                                for _ in range(args.scale)]))]
+        for name, vectors in sizes:
+            path = os.path.join(tmp, name)
+            write(path, vectors)
+            out = subprocess.run([sys.executable, "-c", CHILD, path, str(args.queries), str(args.k), str(args.batch)],
+                                 cwd=APP_DIR, capture_output=True, text=True, check=True)
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            print("%7d items  matrix %7.1f MB  load %6.1f ms  single %8.1f q/s  batch of %d %8.1f q/s  RSS +%.1f MB" % (
+                result["items"], result["matrix_mb"], result["load_ms"], result["single_qps"], args.batch,
+                result["batched_qps"], result["rss_delta_mb"]))
+
+
+if __name__ == "__main__":
+    main()
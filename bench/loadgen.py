@@ -0,0 +1,88 @@
+"""Minimal stdlib HTTP load generator shared by the benchmarks in this folder."""
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+class Result:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.statuses = {}
+        self.elapsed = 0.0
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    def summary(self):
+        rps = self.requests / self.elapsed if self.elapsed else 0.0
+        return {
+            "name": self.name,
+            "requests": self.requests,
+            "errors": self.errors,
+            "statuses": dict(sorted(self.statuses.items())),
+            "rps": round(rps, 1),
+            "p50_ms": round(percentile(self.latencies, 50) * 1000, 2),
+            "p99_ms": round(percentile(self.latencies, 99) * 1000, 2),
+        }
+
+    def print(self):
+        s = self.summary()
+        print("%-28s %7d req  %8.1f req/s  p50 %7.2f ms  p99 %7.2f ms  errors %d  %s" % (
+            s["name"], s["requests"], s["rps"], s["p50_ms"], s["p99_ms"], s["errors"], s["statuses"]))
+
+
+def _worker(base, method, path, body, headers, stop_at, result, lock, max_requests):
+    parts = urlsplit(base)
+    conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    conn = conn_cls(parts.hostname, parts.port, timeout=30)
+    done = 0
+    while time.monotonic() < stop_at and (max_requests is None or done < max_requests):
+        started = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            resp = conn.getresponse()
+            resp.read()
+            status = resp.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = conn_cls(parts.hostname, parts.port, timeout=30)
+            with lock:
+                result.errors += 1
+            continue
+        latency = time.perf_counter() - started
+        done += 1
+        with lock:
+            result.latencies.append(latency)
+            result.statuses[status] = result.statuses.get(status, 0) + 1
+    conn.close()
+
+
+def run(base, path, concurrency=16, duration=10.0, method="GET", body=None, headers=None,
+        name=None, max_requests=None):
+    """Hit ``base + path`` from ``concurrency`` keep-alive connections for ``duration`` seconds."""
+    result = Result(name or "%s %s" % (method, path))
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=_worker, args=(base, method, path, body, headers, stop_at, result, lock, max_requests))
+        for _ in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    result.elapsed = time.perf_counter() - started
+    return result
@@ -0,0 +1,151 @@
+"""Forecast next month's sales for the test.csv shop x item grid and publish them.
+
+    python ml/export_model.py model_rec_seller.h5 ml/model_rec_seller --ids model_rec_seller_ids.npz
+    DATABASE_URL=... python ml/batch_forecast.py ml/model_rec_seller
+
+The seller notebook's model predicts log1p(item_cnt_month) from shop and item
+embeddings (shops take the place of users in the exported model). The grid is
+scored in --chunk-rows slices, ranked within each shop with one lexsort
+instead of groupby().apply(sort_values) and loaded with COPY as a new
+version. --top-k keeps only the best K items per shop; the default keeps the
+whole grid, which /sellers/{id}/restock-suggestions needs. Pairs whose shop or
+item the model has not seen are skipped and counted. Items are matched to
+products like batch_recommendations.py.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import psycopg2
+
+from batch_recommendations import ITEMS_CSV, ML_DIR, load_item_names, map_items
+
+sys.path.insert(0, os.path.join(ML_DIR, "..", "app"))
+
+from db import DATABASE_URL  # noqa: E402
+from ncf import NCFModel  # noqa: E402
+from seller_forecasts import SELLER_FORECAST_KEEP_VERSIONS, activate, copy_rows, create_version  # noqa: E402
+
+GRID_CSV = os.path.join(ML_DIR, "data", "test.csv")
+
+
+def load_grid(path=GRID_CSV):
+    """(shop_ids, item_ids) columns of a Kaggle ID,shop_id,item_id file."""
+    grid = np.loadtxt(path, delimiter=",", skiprows=1, usecols=(1, 2), dtype=np.int64, ndmin=2)
+    return grid[:, 0], grid[:, 1]
+
+
+def id_rows(model_ids, ids, rows):
+    """Embedding row of every id, -1 for ids the model has not seen.
+
+    model_ids is the embedding order saved with the model; without it row i
+    is id i and there are `rows` of them.
+    """
+    if model_ids is None:
+        return np.where((ids >= 0) & (ids < rows), ids, -1)
+    lookup = np.full(max(int(model_ids.max()), int(ids.max())) + 1, -1, dtype=np.int64)
+    lookup[model_ids] = np.arange(len(model_ids))
+    return lookup[ids]
+
+
+def score_grid(model, shop_rows, item_rows, chunk_rows):
+    """Predicted units per pair; the model's log1p output is clipped at 0 and expanded."""
+    predicted = np.empty(len(shop_rows), dtype=np.float32)
+    for start in range(0, len(shop_rows), chunk_rows):
+        end = start + chunk_rows
+        predicted[start:end] = model.score(shop_rows[start:end], item_rows[start:end])
+    return np.expm1(np.maximum(predicted, 0, out=predicted), out=predicted)
+
+
+def top_k_per_group(groups, scores, k=0):
+    """(indices, ranks) of the best k scores of every group, grouped and best-first; k=0 keeps all.
+
+    One lexsort orders by group, then by score descending (ties keep input
+    order); a row's rank is its position minus where its group starts.
+    """
+    order = np.lexsort((-scores, groups))
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    ranks = np.arange(1, len(order) + 1) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    if k:
+        keep = ranks <= k
+        order, ranks = order[keep], ranks[keep]
+    return order, ranks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model_dir", help="directory written by ml/export_model.py")
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--grid", default=GRID_CSV, help="CSV with shop_id and item_id columns")
+    parser.add_argument("--top-k", type=int, default=0, help="items kept per shop (0: all)")
+    parser.add_argument("--chunk-rows", type=int, default=65536, help="pairs scored at a time")
+    parser.add_argument("--keep", type=int, default=SELLER_FORECAST_KEEP_VERSIONS, help="versions to keep")
+    parser.add_argument("--items-csv", default=ITEMS_CSV)
+    args = parser.parse_args()
+
+    timings = {}
+    started = stage = time.perf_counter()
+
+    def lap(name):
+        nonlocal stage
+        now = time.perf_counter()
+        timings[name] = now - stage
+        stage = now
+
+    model = NCFModel.load(args.model_dir)
+    shops, items = load_grid(args.grid)
+    shop_rows = id_rows(model.user_ids, shops, model.user_embedding.shape[0])
+    item_rows = id_rows(model.item_ids, items, model.num_items)
+    known = (shop_rows >= 0) & (item_rows >= 0)
+    shops, items, shop_rows, item_rows = shops[known], items[known], shop_rows[known], item_rows[known]
+    lap("load")
+
+    predicted = score_grid(model, shop_rows, item_rows, args.chunk_rows)
+    lap("score")
+    order, ranks = top_k_per_group(shops, predicted, args.top_k)
+    lap("rank")
+    print("Scored %d of %d grid pairs (%d unknown shop or item), keeping %d rows"
+          % (len(predicted), len(known), len(known) - len(predicted), len(order)))
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        unique_items = np.unique(items)
+        with conn.cursor() as cursor:
+            matched_rows, product_ids = map_items(cursor, unique_items, load_item_names(args.items_csv))
+        conn.rollback()
+        # SERIAL начинается с 1, поэтому 0 — «товара нет в каталоге»
+        product_by_item = np.zeros(int(unique_items.max()) + 1 if len(unique_items) else 1, dtype=np.int64)
+        product_by_item[unique_items[matched_rows]] = product_ids
+        print("Matched %d of %d grid items to products" % (len(matched_rows), len(unique_items)))
+
+        def rows():
+            picked_items = items[order]
+            for shop_id, rank, item_id, product_id, value in zip(
+                    shops[order].tolist(), ranks.tolist(), picked_items.tolist(),
+                    product_by_item[picked_items].tolist(), predicted[order].tolist()):
+                yield shop_id, rank, item_id, product_id or None, value
+
+        with conn.cursor() as cursor:
+            version = create_version(cursor, os.path.basename(os.path.normpath(args.model_dir)))
+            copied = copy_rows(cursor, version, rows())
+            cursor.execute("ANALYZE seller_forecast_items")
+        conn.commit()
+        lap("copy")
+
+        # Переключение версии — одна короткая транзакция
+        with conn.cursor() as cursor:
+            activate(cursor, version, args.keep)
+        conn.commit()
+        lap("activate")
+    finally:
+        conn.close()
+    print("Activated version %d: %d rows in %.2f s (%s)" % (
+        version, copied, time.perf_counter() - started,
+        ", ".join("%s %.2f s" % (name, seconds) for name, seconds in timings.items())))
+
+
+if __name__ == "__main__":
+    main()
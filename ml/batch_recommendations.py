@@ -0,0 +1,110 @@
+"""Precompute top-K recommendations for every user and publish them as a new version.
+
+    python ml/export_model.py model_rec_user.h5 ml/model_rec_user --ids model_rec_user_ids.npz
+    DATABASE_URL=... python ml/batch_recommendations.py ml/model_rec_user --k 20
+
+Model items are matched to products by products.attributes->>'item_id' and
+otherwise by name via ml/data/items.csv; model users are users.id. The new
+version is loaded with COPY next to the live one and swapped in with a single
+UPDATE, together with a popularity list for users the model does not know.
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+import psycopg2
+
+ML_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ML_DIR, "..", "app"))
+
+from db import DATABASE_URL  # noqa: E402
+from ncf import NCFModel  # noqa: E402
+from recommendations import (RECOMMENDATIONS_KEEP_VERSIONS, RECOMMENDATIONS_TOP_K, activate,  # noqa: E402
+                             copy_rows, create_version, insert_popular)
+
+ITEMS_CSV = os.path.join(ML_DIR, "data", "items.csv")
+
+
+def load_item_names(path=ITEMS_CSV):
+    with open(path, encoding="utf-8", newline="") as file:
+        return {int(row["item_id"]): row["item_name"] for row in csv.DictReader(file)}
+
+
+def map_items(cursor, item_ids, item_names):
+    """Return (model item rows, product ids) for the model items that exist as products."""
+    cursor.execute("SELECT id, name, attributes->>'item_id' AS item_id FROM products")
+    by_item_id, by_name = {}, {}
+    for product_id, name, item_id in cursor.fetchall():
+        by_name[name] = product_id
+        if item_id is not None and item_id.isdigit():
+            by_item_id[int(item_id)] = product_id
+    rows, products = [], []
+    for row, item_id in enumerate(item_ids):
+        product_id = by_item_id.get(int(item_id)) or by_name.get(item_names.get(int(item_id)))
+        if product_id is not None:
+            rows.append(row)
+            products.append(product_id)
+    return np.array(rows, dtype=np.int64), np.array(products, dtype=np.int64)
+
+
+def map_users(cursor, user_ids):
+    cursor.execute("SELECT id FROM users WHERE id = ANY(%s)", ([int(u) for u in user_ids],))
+    known = {row[0] for row in cursor.fetchall()}
+    return [(row, int(u)) for row, u in enumerate(user_ids) if int(u) in known]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model_dir", help="directory written by ml/export_model.py")
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--k", type=int, default=RECOMMENDATIONS_TOP_K)
+    parser.add_argument("--keep", type=int, default=RECOMMENDATIONS_KEEP_VERSIONS, help="versions to keep")
+    parser.add_argument("--items-csv", default=ITEMS_CSV)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    model = NCFModel.load(args.model_dir)
+    user_ids = model.user_ids if model.user_ids is not None else np.arange(model.user_embedding.shape[0])
+    item_ids = model.item_ids if model.item_ids is not None else np.arange(model.num_items)
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        with conn.cursor() as cursor:
+            item_rows, product_ids = map_items(cursor, item_ids, load_item_names(args.items_csv))
+            users = map_users(cursor, user_ids)
+        conn.rollback()
+        print("Matched %d of %d model items to products, %d of %d model users"
+              % (len(item_rows), len(item_ids), len(users), len(user_ids)))
+
+        product_by_row = dict(zip(item_rows.tolist(), product_ids.tolist()))
+        app_user = dict(users)
+
+        def rows():
+            if not users or not len(item_rows):
+                return
+            for user_row, picked, scores in model.top_k([row for row, _ in users], args.k, item_rows):
+                for rank, (item_row, score) in enumerate(zip(picked.tolist(), scores.tolist()), start=1):
+                    yield app_user[int(user_row)], rank, product_by_row[item_row], score
+
+        with conn.cursor() as cursor:
+            version = create_version(cursor, os.path.basename(os.path.normpath(args.model_dir)))
+            copied = copy_rows(cursor, version, rows())
+            popular = insert_popular(cursor, version, args.k)
+            cursor.execute("ANALYZE recommendation_items")
+        conn.commit()
+        print("Loaded version %d: %d personal rows, %d popular rows" % (version, copied, popular))
+
+        # Переключение версии — одна короткая транзакция
+        with conn.cursor() as cursor:
+            activate(cursor, version, args.keep)
+        conn.commit()
+        print("Activated version %d in %.1f s" % (version, time.perf_counter() - started))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
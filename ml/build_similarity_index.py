@@ -0,0 +1,108 @@
+"""Build the item similarity index read by GET /products/{id}/similar.
+
+    DATABASE_URL=... python ml/build_similarity_index.py --model-dir ml/model_rec_user
+    DATABASE_URL=... python ml/build_similarity_index.py              # TF-IDF fallback
+
+With --model-dir the vectors are the trained item embeddings; otherwise they
+are TF-IDF weights of item_name words plus the item_category_id, hashed into
+--dims columns so the matrix stays dense and small. Only items that exist as
+products (matched like batch_recommendations.py) are indexed.
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import sys
+import zlib
+
+import numpy as np
+import psycopg2
+
+from batch_recommendations import ITEMS_CSV, ML_DIR, map_items
+
+sys.path.insert(0, os.path.join(ML_DIR, "..", "app"))
+
+from db import DATABASE_URL  # noqa: E402
+from ncf import NCFModel  # noqa: E402
+
+OUT_DIR = os.path.join(ML_DIR, "..", "app", "similarity_index")
+TOKEN_RE = re.compile(r"\w{2,}")
+
+
+def load_items(path=ITEMS_CSV):
+    with open(path, encoding="utf-8", newline="") as file:
+        return [(int(row["item_id"]), row["item_name"], row["item_category_id"]) for row in csv.DictReader(file)]
+
+
+def tokens(name, category_id):
+    return TOKEN_RE.findall(name.lower()) + ["category:" + category_id]
+
+
+def tfidf_vectors(docs, dims):
+    """Hashed TF-IDF: each token adds tf * idf to one signed column; rows are L2-normalized."""
+    document_frequency = {}
+    for doc in docs:
+        for token in set(doc):
+            document_frequency[token] = document_frequency.get(token, 0) + 1
+    columns = {}
+    for token, df in document_frequency.items():
+        digest = zlib.crc32(token.encode())
+        idf = math.log((1 + len(docs)) / (1 + df)) + 1
+        columns[token] = (digest % dims, idf if digest & 0x80000000 else -idf)
+    vectors = np.zeros((len(docs), dims), dtype=np.float32)
+    for row, doc in enumerate(docs):
+        for token in doc:
+            column, weight = columns[token]
+            vectors[row, column] += weight
+    return vectors
+
+
+def normalize(vectors):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def write_index(out_dir, vectors, product_ids, source):
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, "vectors.npy"), normalize(vectors))
+    np.save(os.path.join(out_dir, "product_ids.npy"), np.asarray(product_ids, dtype=np.int64))
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump({"source": source, "items": len(product_ids), "dims": int(vectors.shape[1])}, file, indent=2)
+    print("Wrote %d x %d index (%s) to %s" % (len(product_ids), vectors.shape[1], source, out_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--model-dir", help="directory written by ml/export_model.py")
+    parser.add_argument("--items-csv", default=ITEMS_CSV)
+    parser.add_argument("--dims", type=int, default=256, help="TF-IDF hash width")
+    parser.add_argument("--out", default=OUT_DIR)
+    args = parser.parse_args()
+
+    items = load_items(args.items_csv)
+    names = {item_id: name for item_id, name, _ in items}
+    if args.model_dir:
+        model = NCFModel.load(args.model_dir, mmap=False)
+        item_ids = model.item_ids if model.item_ids is not None else np.arange(model.num_items)
+        vectors, source = model.item_embedding, "item_embedding of " + os.path.basename(os.path.normpath(args.model_dir))
+    else:
+        item_ids = np.array([item_id for item_id, _, _ in items])
+        vectors, source = tfidf_vectors([tokens(name, category) for _, name, category in items], args.dims), "tfidf"
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        with conn.cursor() as cursor:
+            rows, product_ids = map_items(cursor, item_ids, names)
+    finally:
+        conn.close()
+    if not len(rows):
+        sys.exit("No model items match products; import ml/data/items.csv first")
+    write_index(args.out, np.asarray(vectors)[rows], product_ids, source)
+
+
+if __name__ == "__main__":
+    main()
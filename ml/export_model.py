@@ -0,0 +1,114 @@
+"""Export a trained notebook recommender to the directory format read by app/ncf.py.
+
+From a notebook, right after training:
+
+    from export_model import export_keras_model
+    export_keras_model(model, "model_rec_user", user_ids=user_ids, item_ids=item_ids)
+
+Or from a saved .h5 file (needs only h5py, not TensorFlow):
+
+    python ml/export_model.py model_rec_user.h5 model_rec_user --ids model_rec_user_ids.npz
+
+The ids file holds the notebook's user_ids / item_ids arrays (the row order of
+the embeddings); without it rows are assumed to be the ids themselves.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+
+def write_model(out_dir, user_embedding, item_embedding, dense, user_ids=None, item_ids=None, source=None):
+    """dense is [(kernel, bias, activation)] in forward order."""
+    os.makedirs(out_dir, exist_ok=True)
+    arrays = {"user_embedding": user_embedding, "item_embedding": item_embedding}
+    for i, (kernel, bias, _) in enumerate(dense):
+        arrays["dense_%d_kernel" % i] = kernel
+        arrays["dense_%d_bias" % i] = bias
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, name + ".npy"), np.ascontiguousarray(array, dtype=np.float32))
+    for name, ids in (("user_ids", user_ids), ("item_ids", item_ids)):
+        if ids is not None:
+            np.save(os.path.join(out_dir, name + ".npy"), np.asarray(ids, dtype=np.int64))
+    meta = {
+        "source": source,
+        "users": int(user_embedding.shape[0]),
+        "items": int(item_embedding.shape[0]),
+        "dim": int(user_embedding.shape[1]),
+        "activations": [activation for _, _, activation in dense],
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump(meta, file, indent=2)
+    print("Exported %d users x %d items, %d dense layers to %s" % (meta["users"], meta["items"], len(dense), out_dir))
+
+
+def _split_embeddings(embeddings):
+    # Второй вход моделей — всегда item_embedding; первый — user_embedding или shop_embedding
+    item = [array for name, array in embeddings if "item" in name]
+    user = [array for name, array in embeddings if "item" not in name]
+    if len(item) != 1 or len(user) != 1:
+        raise ValueError("Expected one item embedding and one user/shop embedding, got %s"
+                         % [name for name, _ in embeddings])
+    return user[0], item[0]
+
+
+def export_keras_model(model, out_dir, user_ids=None, item_ids=None):
+    embeddings, dense = [], []
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind == "Embedding":
+            embeddings.append((layer.name, layer.get_weights()[0]))
+        elif kind == "Dense":
+            kernel, bias = layer.get_weights()
+            dense.append((kernel, bias, layer.get_config()["activation"]))
+    user_embedding, item_embedding = _split_embeddings(embeddings)
+    write_model(out_dir, user_embedding, item_embedding, dense, user_ids, item_ids, source=model.name)
+
+
+def _layer_weights(group):
+    weights = {}
+
+    def visit(name, item):
+        if hasattr(item, "shape"):
+            weights[name.rsplit("/", 1)[-1].split(":")[0]] = item[()]
+
+    group.visititems(visit)
+    return weights
+
+
+def export_h5(path, out_dir, user_ids=None, item_ids=None):
+    import h5py
+
+    with h5py.File(path, "r") as file:
+        config = file.attrs["model_config"]
+        config = json.loads(config.decode() if isinstance(config, bytes) else config)
+        weights_root = file["model_weights"] if "model_weights" in file else file
+        embeddings, dense = [], []
+        for layer in config["config"]["layers"]:
+            name = layer["config"]["name"]
+            if layer["class_name"] == "Embedding":
+                embeddings.append((name, _layer_weights(weights_root[name])["embeddings"]))
+            elif layer["class_name"] == "Dense":
+                weights = _layer_weights(weights_root[name])
+                dense.append((weights["kernel"], weights["bias"], layer["config"].get("activation", "linear")))
+    user_embedding, item_embedding = _split_embeddings(embeddings)
+    write_model(out_dir, user_embedding, item_embedding, dense, user_ids, item_ids, source=os.path.basename(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("h5", help="model saved with model.save('....h5')")
+    parser.add_argument("out_dir")
+    parser.add_argument("--ids", help=".npz with user_ids and item_ids arrays")
+    args = parser.parse_args()
+
+    user_ids = item_ids = None
+    if args.ids:
+        ids = np.load(args.ids)
+        user_ids, item_ids = ids["user_ids"], ids["item_ids"]
+    export_h5(args.h5, args.out_dir, user_ids, item_ids)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
+-- Сгенерировано `python app/migrate.py schema` из app/migrations; не редактировать вручную.
+
+-- 0001_initial
+-- Исходная схема. IF NOT EXISTS позволяет принять базу, созданную до появления миграций.
+
 -- Таблица: users (пользователи)
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
     name VARCHAR(255) NOT NULL,
     email VARCHAR(255) UNIQUE NOT NULL,
@@ -9,16 +14,16 @@ CREATE TABLE users (
 );
 
 -- Таблица: categories (категории товаров)
-CREATE TABLE categories (
+CREATE TABLE IF NOT EXISTS categories (
     id SERIAL PRIMARY KEY,
-    name VARCHAR(255) NOT NULL,
+    name VARCHAR(255) NOT NULL UNIQUE,
     parent_id INT REFERENCES categories(id) ON DELETE SET NULL
 );
 
 -- Таблица: products (товары)
-CREATE TABLE products (
+CREATE TABLE IF NOT EXISTS products (
     id SERIAL PRIMARY KEY,
-    name VARCHAR(255) NOT NULL,
+    name VARCHAR(255) NOT NULL UNIQUE,
     description TEXT,
     price DECIMAL(10, 2) NOT NULL CHECK (price >= 0),
     stock INT NOT NULL CHECK (stock >= 0),
@@ -28,14 +33,14 @@ CREATE TABLE products (
 );
 
 -- Таблица: cart (корзина)
-CREATE TABLE cart (
+CREATE TABLE IF NOT EXISTS cart (
     id SERIAL PRIMARY KEY,
     user_id INT REFERENCES users(id) ON DELETE CASCADE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Таблица: cart_items (товары в корзине)
-CREATE TABLE cart_items (
+CREATE TABLE IF NOT EXISTS cart_items (
     id SERIAL PRIMARY KEY,
     cart_id INT REFERENCES cart(id) ON DELETE CASCADE,
     product_id INT REFERENCES products(id) ON DELETE CASCADE,
@@ -43,7 +48,7 @@ CREATE TABLE cart_items (
 );
 
 -- Таблица: orders (заказы)
-CREATE TABLE orders (
+CREATE TABLE IF NOT EXISTS orders (
     id SERIAL PRIMARY KEY,
     user_id INT REFERENCES users(id) ON DELETE CASCADE,
     total_amount DECIMAL(10, 2) NOT NULL CHECK (total_amount >= 0),
@@ -53,7 +58,7 @@ CREATE TABLE orders (
 );
 
 -- Таблица: order_items (товары в заказе)
-CREATE TABLE order_items (
+CREATE TABLE IF NOT EXISTS order_items (
     id SERIAL PRIMARY KEY,
     order_id INT REFERENCES orders(id) ON DELETE CASCADE,
     product_id INT REFERENCES products(id) ON DELETE CASCADE,
@@ -62,7 +67,7 @@ CREATE TABLE order_items (
 );
 
 -- Таблица: user_logs (лог действий пользователей)
-CREATE TABLE user_logs (
+CREATE TABLE IF NOT EXISTS user_logs (
     id SERIAL PRIMARY KEY,
     user_id INT REFERENCES users(id) ON DELETE CASCADE,
     action VARCHAR(255) NOT NULL,
@@ -71,9 +76,232 @@ CREATE TABLE user_logs (
 );
 
 -- Таблица: recommendations (рекомендации)
-CREATE TABLE recommendations (
+CREATE TABLE IF NOT EXISTS recommendations (
     id SERIAL PRIMARY KEY,
     user_id INT REFERENCES users(id) ON DELETE CASCADE,
     product_id INT REFERENCES products(id) ON DELETE CASCADE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- 0002_idempotency_keys
+-- Таблица: idempotency_keys (ответы на повторные запросы с Idempotency-Key)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope VARCHAR(64) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    status_code INT,
+    response JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+
+-- 0003_hot_path_indexes
+-- Индексы для горячих соединений: /cart, /recommendations, /purchase, удаление из корзины
+
+-- У пользователя одна корзина: сливаем дубликаты, созданные гонкой в add_cart_item
+UPDATE cart_items ci
+SET cart_id = keep.id
+FROM cart c
+JOIN (SELECT user_id, MIN(id) AS id FROM cart GROUP BY user_id) keep ON keep.user_id = c.user_id
+WHERE ci.cart_id = c.id AND c.id <> keep.id;
+
+DELETE FROM cart c
+USING (SELECT user_id, MIN(id) AS id FROM cart GROUP BY user_id) keep
+WHERE c.user_id = keep.user_id AND c.id <> keep.id;
+
+ALTER TABLE cart ADD CONSTRAINT cart_user_id_key UNIQUE (user_id);
+
+CREATE INDEX IF NOT EXISTS cart_items_cart_id_idx ON cart_items (cart_id);
+CREATE INDEX IF NOT EXISTS cart_items_product_id_idx ON cart_items (product_id);
+CREATE INDEX IF NOT EXISTS orders_user_id_idx ON orders (user_id);
+CREATE INDEX IF NOT EXISTS order_items_order_id_idx ON order_items (order_id);
+CREATE INDEX IF NOT EXISTS order_items_product_id_idx ON order_items (product_id);
+CREATE INDEX IF NOT EXISTS recommendations_user_id_idx ON recommendations (user_id);
+CREATE INDEX IF NOT EXISTS user_logs_user_id_idx ON user_logs (user_id);
+CREATE INDEX IF NOT EXISTS products_category_id_idx ON products (category_id);
+CREATE INDEX IF NOT EXISTS categories_parent_id_idx ON categories (parent_id);
+
+-- Keyset-пагинация /products?order_by=created_at
+CREATE INDEX IF NOT EXISTS products_created_at_id_idx ON products (created_at, id);
+
+-- Фильтры по атрибутам: attributes @> '{...}' и attributes ?& ARRAY[...]
+CREATE INDEX IF NOT EXISTS products_attributes_gin_idx ON products USING GIN (attributes);
+
+-- 0004_recommendation_store
+-- Хранилище предрасчитанных рекомендаций (ml/batch_recommendations.py)
+
+-- Таблица: recommendation_versions (версии выгрузок)
+CREATE TABLE IF NOT EXISTS recommendation_versions (
+    version SERIAL PRIMARY KEY,
+    source VARCHAR(255) NOT NULL,
+    row_count INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Таблица: recommendation_items (top-K товаров на пользователя; user_id = 0 — популярное для новых пользователей)
+CREATE TABLE IF NOT EXISTS recommendation_items (
+    version INT NOT NULL REFERENCES recommendation_versions(version) ON DELETE CASCADE,
+    user_id INT NOT NULL,
+    rank SMALLINT NOT NULL,
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    score REAL,
+    PRIMARY KEY (version, user_id, rank)
+);
+
+CREATE INDEX IF NOT EXISTS recommendation_items_product_id_idx ON recommendation_items (product_id);
+
+-- Таблица: recommendation_active (единственная строка — какая версия сейчас отдаётся)
+CREATE TABLE IF NOT EXISTS recommendation_active (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    version INT REFERENCES recommendation_versions(version)
+);
+
+INSERT INTO recommendation_active (singleton, version) VALUES (TRUE, NULL) ON CONFLICT DO NOTHING;
+
+-- Переносим уже существующие рекомендации в первую версию
+WITH new_version AS (
+    INSERT INTO recommendation_versions (source, row_count)
+    SELECT 'recommendations table', count(*) FROM recommendations HAVING count(*) > 0
+    RETURNING version
+)
+INSERT INTO recommendation_items (version, user_id, rank, product_id)
+SELECT new_version.version, r.user_id,
+       row_number() OVER (PARTITION BY r.user_id ORDER BY r.id), r.product_id
+FROM recommendations r, new_version
+WHERE r.user_id IS NOT NULL AND r.product_id IS NOT NULL;
+
+UPDATE recommendation_active SET version = (SELECT max(version) FROM recommendation_versions);
+
+-- 0005_incremental_recommendations
+-- Состояние инкрементального обновления рекомендаций (recommendation_updater.py)
+
+-- Таблица: recommendation_watermarks (до какого id уже учтены события каждого источника)
+CREATE TABLE IF NOT EXISTS recommendation_watermarks (
+    source VARCHAR(64) PRIMARY KEY,
+    last_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO recommendation_watermarks (source) VALUES ('user_logs'), ('order_items') ON CONFLICT DO NOTHING;
+
+-- Таблица: user_item_interactions (накопленный вес взаимодействий пользователя с товаром)
+CREATE TABLE IF NOT EXISTS user_item_interactions (
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    weight REAL NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, product_id)
+);
+
+-- Таблица: item_cooccurrence (сколько пользователей взаимодействовали с обоими товарами)
+CREATE TABLE IF NOT EXISTS item_cooccurrence (
+    product_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    other_id INT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    users INT NOT NULL,
+    PRIMARY KEY (product_id, other_id)
+);
+
+CREATE INDEX IF NOT EXISTS user_item_interactions_product_id_idx ON user_item_interactions (product_id);
+CREATE INDEX IF NOT EXISTS item_cooccurrence_other_id_idx ON item_cooccurrence (other_id);
+-- Самые частые соседи товара: ORDER BY users DESC LIMIT n
+CREATE INDEX IF NOT EXISTS item_cooccurrence_top_idx ON item_cooccurrence (product_id, users DESC);
+CREATE INDEX IF NOT EXISTS user_item_interactions_recent_idx ON user_item_interactions (user_id, updated_at DESC);
+
+-- 0006_product_search
+-- Полнотекстовый и нечёткий поиск товаров (/products/search)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- russian — поиск по словоформам, simple — по точным словам (артикулы, латиница, бренды)
+ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(description, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS products_search_vector_idx ON products USING GIN (search_vector);
+
+-- Опечатки: триграммы по названию (операторы % и <%)
+CREATE INDEX IF NOT EXISTS products_name_trgm_idx ON products USING GIN (name gin_trgm_ops);
+
+-- 0007_catalog_import
+-- Массовый импорт каталога (catalog_io.py)
+
+-- Проверка JSON в staging-таблице без падения всего импорта на первой плохой строке
+CREATE OR REPLACE FUNCTION jsonb_object_or_null(value TEXT) RETURNS JSONB AS $$
+BEGIN
+    RETURN CASE WHEN jsonb_typeof(value::jsonb) = 'object' THEN value::jsonb END;
+EXCEPTION WHEN invalid_text_representation THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- 0008_cart_items_unique
+-- Одна строка корзины на товар: add_cart_item увеличивает количество через ON CONFLICT
+
+-- Сливаем дубликаты, накопленные прежним add_cart_item: количество суммируется в строку с меньшим id
+UPDATE cart_items ci
+SET quantity = merged.quantity
+FROM (
+    SELECT MIN(id) AS id, SUM(quantity)::int AS quantity
+    FROM cart_items
+    GROUP BY cart_id, product_id
+    HAVING COUNT(*) > 1
+) merged
+WHERE ci.id = merged.id;
+
+DELETE FROM cart_items ci
+USING cart_items keep
+WHERE keep.cart_id = ci.cart_id AND keep.product_id = ci.product_id AND keep.id < ci.id;
+
+ALTER TABLE cart_items ADD CONSTRAINT cart_items_cart_id_product_id_key UNIQUE (cart_id, product_id);
+
+-- Уникальный индекс начинается с cart_id и заменяет отдельный
+DROP INDEX IF EXISTS cart_items_cart_id_idx;
+
+-- 0009_seller_forecasts
+-- Прогноз продаж магазинов на следующий месяц (ml/batch_forecast.py), версии — как у рекомендаций
+
+-- Таблица: seller_forecast_versions (версии выгрузок)
+CREATE TABLE IF NOT EXISTS seller_forecast_versions (
+    version SERIAL PRIMARY KEY,
+    source VARCHAR(255) NOT NULL,
+    row_count INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Таблица: seller_forecast_items (прогноз по сетке магазин x товар; rank — место товара внутри магазина)
+CREATE TABLE IF NOT EXISTS seller_forecast_items (
+    version INT NOT NULL REFERENCES seller_forecast_versions(version) ON DELETE CASCADE,
+    shop_id INT NOT NULL,
+    rank INT NOT NULL,
+    item_id INT NOT NULL,
+    -- NULL, если товара из датасета нет в каталоге
+    product_id INT REFERENCES products(id) ON DELETE CASCADE,
+    predicted REAL NOT NULL,
+    PRIMARY KEY (version, shop_id, rank)
+);
+
+CREATE INDEX IF NOT EXISTS seller_forecast_items_product_id_idx ON seller_forecast_items (product_id);
+
+-- Таблица: seller_forecast_active (единственная строка — какая версия сейчас отдаётся)
+CREATE TABLE IF NOT EXISTS seller_forecast_active (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    version INT REFERENCES seller_forecast_versions(version)
+);
+
+INSERT INTO seller_forecast_active (singleton, version) VALUES (TRUE, NULL) ON CONFLICT DO NOTHING;
+
+-- 0010_stock_reservations
+-- Удержание остатков корзинами: строка корзины держит reserved единиц до reserved_until,
+-- products.reserved — сумма удержаний по товару, свободно stock - reserved
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS reserved INT NOT NULL DEFAULT 0 CHECK (reserved >= 0);
+
+ALTER TABLE cart_items ADD COLUMN IF NOT EXISTS reserved INT NOT NULL DEFAULT 0
+    CHECK (reserved >= 0 AND reserved <= quantity);
+ALTER TABLE cart_items ADD COLUMN IF NOT EXISTS reserved_until TIMESTAMP;
+
+-- Для reservations.sweep: только строки с действующим удержанием, в порядке истечения
+CREATE INDEX IF NOT EXISTS cart_items_reserved_until_idx ON cart_items (reserved_until) WHERE reserved > 0;